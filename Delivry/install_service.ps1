@@ -12,8 +12,8 @@ if (-not $currentPrincipal.IsInRole([Security.Principal.WindowsBuiltInRole]::Adm
 # Crée le répertoire d'installation
 New-Item -ItemType Directory -Force -Path $installPath
 
-# Copie les fichiers
-Copy-Item -Path ".\OdmService.exe" -Destination $installPath -Force
+# Copie les fichiers (exécutable et, en mode onedir, ses dépendances déjà extraites)
+Copy-Item -Path ".\*" -Destination $installPath -Recurse -Force -Exclude "*.ps1"
 
 # Crée le répertoire de logs
 $logDir = "$installPath\logs"
@@ -0,0 +1,406 @@
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+
+import metrics
+from config import settings, DESKTOP
+
+# --- Acquisition dans un processus séparé (reader_process) ---
+# Le port série, le décodage et la stabilisation tournent dans un processus
+# enfant, avec son propre GIL: le trafic HTTP ne retarde plus le traitement
+# des trames, et inversement. L'enfant publie ses lectures dans un anneau en
+# mémoire partagée; le service les consomme (lecture en direct, écriture des
+# poids stables en base) et redémarre l'enfant s'il s'arrête.
+#
+# Anneau: un en-tête puis RING_SLOTS emplacements de taille fixe. L'enfant est
+# l'unique écrivain; chaque emplacement porte son numéro de séquence, écrit
+# en dernier, si bien qu'un lecteur détecte un emplacement réécrit pendant sa
+# lecture. Les lectures se font directement dans la mémoire partagée.
+
+logger = logging.getLogger("OdmService")
+
+RING_SLOTS = 1024  # Environ 10 s de trames à 9600 bauds
+POLL_INTERVAL = 0.01  # Période de consommation de l'anneau (secondes)
+HEARTBEAT_INTERVAL = 0.5
+HEARTBEAT_TIMEOUT = 10.0  # Enfant sans signe de vie: considéré comme bloqué
+RESTART_DELAY = 1.0  # Délai avant de relancer un enfant arrêté
+STOP_TIMEOUT = 2.0
+
+KIND_READING = 1  # Lecture décodée (poids en direct)
+KIND_STABLE = 2  # Poids stable à enregistrer
+KIND_CYCLE = 3  # Pesée complète (weighing_mode = "cycle")
+
+STATUSES = ("starting", "connecting", "disconnected", "connected", "stopped")
+
+# En-tête, champ par champ pour que chaque processus n'écrive que les siens:
+# séquence du dernier emplacement écrit (enfant, thread de lecture)
+_HEAD = struct.Struct('<Q')
+# battement de cœur, connected_at, last_frame_at (enfant, thread de contrôle)
+_TIMES = struct.Struct('<ddd')
+# dernier poids enregistré pour le poste (service)
+_LATEST = struct.Struct('<d')
+# statut, redémarrage en cours, port, protocole (enfant, thread de contrôle)
+_STATE = struct.Struct('<BB6x32s16s')
+# acquittement des poids stables (service): dernière séquence traitée (ou
+# perdue), dernière séquence de poids stable enregistré
+_ACK = struct.Struct('<QQ')
+_TIMES_AT = _HEAD.size
+_LATEST_AT = _TIMES_AT + _TIMES.size
+_STATE_AT = _LATEST_AT + _LATEST.size
+_ACK_AT = _STATE_AT + _STATE.size
+HEADER_SIZE = _ACK_AT + _ACK.size
+# Emplacement: séquence, type, stable (-1 = inconnu), poids, horodatage,
+# puis début et stabilisation du cycle (KIND_CYCLE uniquement)
+SLOT = struct.Struct('<Q B b 6x d d d d')
+
+
+def _text(value):
+    return value.rstrip(b'\0').decode('utf-8', 'replace') or None
+
+
+class ReadingRing:
+    """Anneau de lectures en mémoire partagée. 'name' à None crée le segment."""
+
+    def __init__(self, name=None, slots=RING_SLOTS):
+        self.slots = slots
+        self.shm = shared_memory.SharedMemory(
+            name=name, create=name is None, size=HEADER_SIZE + slots * SLOT.size)
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        self._head = self.head()
+
+    def head(self):
+        return _HEAD.unpack_from(self.buf, 0)[0]
+
+    def write(self, kind, weight, stable=None, at=None, started_at=0.0, stable_at=0.0):
+        """Publie un enregistrement (écrivain unique: le processus d'acquisition)."""
+        seq = self._head + 1
+        offset = HEADER_SIZE + (seq % self.slots) * SLOT.size
+        # Séquence invalidée pendant l'écriture, puis publiée en dernier
+        SLOT.pack_into(self.buf, offset, 0, kind, -1 if stable is None else int(stable),
+                       weight, at or time.time(), started_at, stable_at)
+        _HEAD.pack_into(self.buf, offset, seq)
+        _HEAD.pack_into(self.buf, 0, seq)
+        self._head = seq
+        return seq
+
+    def read_since(self, last_seq):
+        """
+        Enregistrements publiés après 'last_seq'.
+        Retourne (liste de (séquence, type, poids, stable, horodatage, début, stabilisation),
+        dernière séquence, perdus).
+        """
+        head = self.head()
+        lost = 0
+        if head - last_seq > self.slots:
+            # Le consommateur a pris trop de retard: les plus anciens sont écrasés
+            lost = head - last_seq - self.slots
+            last_seq = head - self.slots
+        records = []
+        for seq in range(last_seq + 1, head + 1):
+            offset = HEADER_SIZE + (seq % self.slots) * SLOT.size
+            slot_seq, kind, stable, weight, at, started_at, stable_at = SLOT.unpack_from(self.buf, offset)
+            if slot_seq != seq or _HEAD.unpack_from(self.buf, offset)[0] != seq:
+                lost += 1
+                continue
+            records.append((seq, kind, weight, None if stable < 0 else bool(stable), at, started_at, stable_at))
+        return records, head, lost
+
+    def publish_status(self, reader):
+        """Recopie l'état du lecteur dans l'en-tête (côté enfant)."""
+        _TIMES.pack_into(self.buf, _TIMES_AT, time.time(), reader.connected_at or 0.0, reader.last_frame_at or 0.0)
+        _STATE.pack_into(
+            self.buf, _STATE_AT, STATUSES.index(reader.status), int(reader.restart_requested),
+            (reader.port_name or '').encode('utf-8')[:32], (reader.protocol_name or '').encode('utf-8')[:16],
+        )
+
+    def status(self):
+        heartbeat, connected_at, last_frame_at = _TIMES.unpack_from(self.buf, _TIMES_AT)
+        status, restart, port, protocol = _STATE.unpack_from(self.buf, _STATE_AT)
+        return {
+            "heartbeat": heartbeat or None,
+            "connected_at": connected_at or None,
+            "last_frame_at": last_frame_at or None,
+            "status": STATUSES[status],
+            "restart_requested": bool(restart),
+            "port": _text(port),
+            "protocol": _text(protocol),
+        }
+
+    def latest_recorded(self):
+        return _LATEST.unpack_from(self.buf, _LATEST_AT)[0]
+
+    def set_latest_recorded(self, weight):
+        """Dernier poids enregistré pour le poste (côté service), lu par le contrôle du retour à zéro."""
+        _LATEST.pack_into(self.buf, _LATEST_AT, weight)
+
+    def acknowledged(self):
+        """(dernière séquence traitée par le service, dernière séquence de poids stable enregistré)."""
+        return _ACK.unpack_from(self.buf, _ACK_AT)
+
+    def acknowledge(self, processed, saved):
+        _ACK.pack_into(self.buf, _ACK_AT, processed, saved)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def _context():
+    """Contexte multiprocessing: 'spawn', comme sous Windows, sur toutes les plateformes."""
+    ctx = multiprocessing.get_context('spawn')
+    if not getattr(sys, 'frozen', False) and os.path.basename(sys.executable).lower() == 'pythonservice.exe':
+        # Hébergé par pythonservice.exe: l'enfant doit être lancé avec l'interpréteur
+        ctx.set_executable(os.path.join(sys.exec_prefix, 'python.exe'))
+    return ctx
+
+
+def child_main(ring_name, commands, log_queue, config, connect=None, desktop=DESKTOP):
+    """Point d'entrée du processus d'acquisition."""
+    root = logging.getLogger("OdmService")
+    root.setLevel(logging.INFO)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    settings.update(config, persist=False)
+
+    import reader
+
+    class RingScaleReader(reader.ScaleReader):
+        """Lecteur dont les sorties sont publiées dans l'anneau au lieu d'être enregistrées."""
+
+        def publish_live(self, reading):
+            ring.write(KIND_READING, reading.weight, reading.stable, self.last_frame_at)
+
+        _pending = None  # (séquence, poids) du poids stable en attente d'acquittement
+
+        def persist(self, weight):
+            # Un poids n'est enregistré qu'une fois acquitté par le service: en cas
+            # d'échec de l'écriture ou d'emplacement écrasé, il est republié par la
+            # lecture stable suivante, comme le lecteur du service réessaie
+            if self._pending is not None:
+                seq, pending_weight = self._pending
+                processed, saved = ring.acknowledged()
+                if processed < seq:
+                    return False  # Pas encore traité par le service
+                self._pending = None
+                if saved >= seq:
+                    if pending_weight == weight:
+                        return True
+                    # Le poids a changé avant l'acquittement: le précédent est enregistré
+                    self.last_sent_weight = pending_weight
+                    self.last_sent_time = time.time()
+                    return False
+                metrics.incr('reader_persist_retries')
+            self._pending = (ring.write(KIND_STABLE, weight, True, self.last_frame_at), weight)
+            return False
+
+        def persist_cycle(self, cycle):
+            ring.write(KIND_CYCLE, cycle.peak, True, cycle.ended_at, cycle.started_at, cycle.stable_at)
+            return True
+
+        def latest_recorded(self):
+            return ring.latest_recorded()
+
+    ring = ReadingRing(ring_name)
+    stop_event = threading.Event()
+    # Les octets bruts sont reçus ici: l'archive est écrite par l'enfant
+    import archive
+    archive_thread = archive.start(stop_event)
+    scale = RingScaleReader(stop_event, connect=connect or reader.find_scale_port, desktop=desktop)
+
+    def control():
+        # Commandes du service, battement de cœur et état du lecteur
+        while not stop_event.is_set():
+            ring.publish_status(scale)
+            try:
+                if not commands.poll(HEARTBEAT_INTERVAL):
+                    continue
+                command, argument = commands.recv()
+            except (EOFError, OSError):
+                command, argument = "stop", None  # Service disparu
+            if command == "stop":
+                stop_event.set()
+                scale.close()
+            elif command == "restart":
+                scale.restart()
+            elif command == "config":
+                settings.update(argument, persist=False)
+
+    control_thread = threading.Thread(target=control, daemon=True)
+    control_thread.start()
+    try:
+        scale.run()
+    finally:
+        stop_event.set()
+        control_thread.join(HEARTBEAT_INTERVAL * 2)
+        archive_thread.join(STOP_TIMEOUT)
+        ring.publish_status(scale)
+        ring.close()
+
+
+class ReaderProcess:
+    """
+    Côté service: supervise le processus d'acquisition et consomme son anneau.
+    Expose les mêmes attributs que reader.ScaleReader pour /api/health et le
+    watchdog (status, connected_at, last_frame_at, restart(), ...).
+    'connect' doit être sérialisable (fonction de module, simulator.PlateauScale).
+    """
+
+    def __init__(self, stop_event, connect=None, desktop=DESKTOP):
+        self.stop_event = stop_event
+        self.connect = connect
+        self.desktop = desktop
+        self.status = "starting"
+        self.connected_at = None
+        self.last_frame_at = None
+        self.restart_requested = False
+        self.port_name = None
+        self.protocol_name = None
+        self.process = None
+        self._restart_at = None
+        self._commands = None
+        self._send_lock = threading.Lock()
+        self._ctx = _context()
+        self._log_queue = self._ctx.Queue()
+
+    def restart(self):
+        """Reconstruit la connexion série dans l'enfant (watchdog)."""
+        self.restart_requested = True
+        self._restart_at = time.time()
+        self._send("restart")
+
+    def close(self):
+        self._send("stop")
+
+    def _send(self, command, argument=None):
+        try:
+            with self._send_lock:
+                if self._commands:
+                    self._commands.send((command, argument))
+        except (OSError, ValueError):
+            pass  # Enfant déjà arrêté: le superviseur s'en charge
+
+    def run(self):
+        """Supervise l'enfant jusqu'à l'arrêt du service."""
+        ring = ReadingRing()
+        try:
+            while not self.stop_event.is_set():
+                started = time.time()
+                self._start(ring)
+                reason = self._consume(ring)
+                if self.stop_event.is_set():
+                    break
+                metrics.incr('reader_process_restarts')
+                logger.error(f"Processus d'acquisition {reason}, redémarrage.")
+                self._terminate()
+                # Un enfant qui meurt dès le démarrage n'est pas relancé en boucle serrée
+                self.stop_event.wait(max(0.0, RESTART_DELAY - (time.time() - started)))
+        finally:
+            self._stop()
+            self._drain_logs()
+            self.status = "stopped"
+            ring.close()
+            ring.unlink()
+        logger.info("Arrêt du processus d'acquisition")
+
+    def _start(self, ring):
+        self._restart_at = None
+        receiver, commands = self._ctx.Pipe(duplex=False)
+        with self._send_lock:
+            self._commands = commands
+        self.process = self._ctx.Process(
+            target=child_main, name="OdmService-acquisition", daemon=True,
+            args=(ring.name, receiver, self._log_queue, settings.snapshot(), self.connect, self.desktop),
+        )
+        self.process.start()
+        receiver.close()
+        logger.info(f"Processus d'acquisition démarré (PID {self.process.pid})")
+
+    def _consume(self, ring):
+        """Consomme l'anneau tant que l'enfant est vivant. Retourne la raison de son arrêt."""
+        import analysis
+        from cycles import Cycle
+        from reader import save_cycle_locally, save_weight_locally
+        from state import weights
+
+        last_seq = ring.head()
+        saved_seq = ring.acknowledged()[1]
+        config_generation = settings.generation
+        started = time.time()
+        while not self.stop_event.wait(POLL_INTERVAL):
+            records, last_seq, lost = ring.read_since(last_seq)
+            if lost:
+                metrics.incr('reader_ring_overruns', lost)
+            now = time.time()
+            for seq, kind, weight, stable, at, started_at, stable_at in records:
+                if kind == KIND_READING:
+                    if self.last_frame_at is None:
+                        metrics.set_gauge('startup_first_frame_ms', round(metrics.uptime() * 1000))
+                    metrics.observe('reader_ring_latency_ms', (now - at) * 1000)
+                    weights.set_live(weight, stable)
+                    analysis.record(weight, at)
+                elif kind == KIND_STABLE and save_weight_locally(weight, self.desktop):
+                    saved_seq = seq
+                    metrics.observe('frame_to_persist_ms', (time.time() - at) * 1000)
+                elif kind == KIND_CYCLE and save_cycle_locally(Cycle(weight, started_at, stable_at, at), self.desktop):
+                    metrics.observe('cycle_end_to_persist_ms', (time.time() - at) * 1000)
+            # Acquittement des poids stables, enregistrés ou non (perdus compris)
+            ring.acknowledge(last_seq, saved_seq)
+
+            status = ring.status()
+            self.status = status["status"]
+            self.connected_at = status["connected_at"]
+            self.last_frame_at = status["last_frame_at"]
+            # Redémarrage demandé: en cours tant que l'enfant ne s'est pas reconnecté
+            if self._restart_at and (self.connected_at or 0) > self._restart_at:
+                self._restart_at = None
+            self.restart_requested = status["restart_requested"] or self._restart_at is not None
+            self.port_name = status["port"]
+            self.protocol_name = status["protocol"]
+
+            latest = weights.latest(self.desktop, settings.get('company'))
+            ring.set_latest_recorded(float(latest["valeur"]) if latest else 0.0)
+            if settings.generation != config_generation:
+                config_generation = settings.generation
+                self._send("config", settings.snapshot())
+            self._drain_logs()
+
+            if not self.process.is_alive():
+                return f"arrêté (code {self.process.exitcode})"
+            heartbeat = status["heartbeat"] or started
+            if now - heartbeat > HEARTBEAT_TIMEOUT:
+                return f"sans signe de vie depuis {now - heartbeat:.0f}s"
+        return "arrêté"
+
+    def _drain_logs(self):
+        # Journal de l'enfant, transmis aux handlers du service
+        while True:
+            try:
+                record = self._log_queue.get_nowait()
+            except (queue.Empty, OSError, ValueError):
+                return
+            logger.handle(record)
+
+    def _stop(self):
+        if self.process and self.process.is_alive():
+            self._send("stop")
+            self.process.join(STOP_TIMEOUT)
+        self._terminate()
+
+    def _terminate(self):
+        if self.process and self.process.is_alive():
+            self.process.kill()
+            self.process.join(STOP_TIMEOUT)
+        with self._send_lock:
+            if self._commands:
+                self._commands.close()
+                self._commands = None
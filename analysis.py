@@ -0,0 +1,322 @@
+import bisect
+import logging
+import math
+import threading
+import time
+from array import array
+from collections import deque
+
+import datastore
+import diagnostics
+import metrics
+import storage
+from config import settings
+
+# NumPy est optionnel: sans lui, l'anneau ne conserve que FALLBACK_READINGS
+# lectures, et chaque analyse résume les nouvelles lectures par blocs de
+# SUMMARY_READINGS (décalage du zéro, bruit). Ces résumés, conservés sur
+# HORIZON_S, donnent la dérive sur la même durée qu'avec NumPy. Les lectures
+# sont résumées au moins toutes les SUMMARY_PERIOD secondes, avant que
+# l'anneau ne les remplace, quel que soit analysis_interval.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+ENGINE = "numpy" if np is not None else "python"
+
+# --- Analyse de la dérive et du bruit de la balance ---
+# Les lectures décodées sont conservées dans un anneau borné (valeur et date).
+# Périodiquement, un thread d'arrière-plan en prend une copie et la traite
+# par blocs, avec des statistiques glissantes vectorisées:
+#  - décalage du zéro: poids moyen des fenêtres au repos à plateau vide, et sa
+#    dérive (kg/h) d'un bloc à l'autre;
+#  - bruit: écart type médian des fenêtres au repos;
+#  - temps de stabilisation des pesées enregistrées (table cycles).
+# Les anomalies sont exposées par /api/analysis et les métriques. Le thread
+# du lecteur ne fait qu'écrire deux valeurs dans l'anneau. L'anneau n'est
+# alloué qu'au démarrage de l'analyse (analysis_interval non nul): ni le
+# processus d'acquisition ni un service sans analyse n'en paient la mémoire.
+
+logger = logging.getLogger("OdmService")
+
+FALLBACK_READINGS = 1 << 16  # Lectures conservées sans NumPy (environ 12 minutes)
+# Environ 3 h 20 de trames à 9600 bauds (87 trames/s), 16 Mo
+HISTORY_READINGS = 1 << 20 if np is not None else FALLBACK_READINGS
+BLOCKS = 16  # Blocs par analyse: points de la droite de dérive du zéro
+SUMMARY_READINGS = FALLBACK_READINGS // BLOCKS  # Lectures par résumé sans NumPy (environ 47 s)
+HORIZON_S = 12000  # Durée couverte par les résumés: celle de l'anneau avec NumPy
+MAX_SUMMARIES = 4096  # Borne des résumés conservés, quel que soit le débit des trames
+SUMMARY_PERIOD = 300  # Secondes au plus entre deux résumés (l'anneau couvre environ 12 minutes)
+WINDOW = 16  # Fenêtre glissante (lectures)
+SETTLE_SAMPLE = 1000  # Pesées récentes prises en compte pour les temps de stabilisation
+
+
+class ReadingHistory:
+    """Anneau des dernières lectures (écrivain unique: le lecteur)."""
+
+    def __init__(self, size=HISTORY_READINGS):
+        self.size = size
+        self.weights = array('d', bytes(8 * size))
+        self.times = array('d', bytes(8 * size))
+        self.position = 0
+        self.count = 0
+
+    def record(self, weight, at):
+        i = self.position
+        self.weights[i] = weight
+        self.times[i] = at
+        self.position = (i + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def snapshot(self, limit=None):
+        """Copie des lectures, dans l'ordre chronologique: (poids, dates)."""
+        count = min(self.count, limit or self.count)
+        end = self.position
+        start = end - count
+        if start >= 0:
+            return self.weights[start:end], self.times[start:end]
+        return (self.weights[start:] + self.weights[:end],
+                self.times[start:] + self.times[:end])
+
+
+# Anneau du service, créé par start_history()
+history = None
+_history_lock = threading.Lock()
+diagnostics.register_bound("analysis_history", lambda: history.count if history else 0, HISTORY_READINGS)
+
+
+def start_history():
+    """Alloue l'anneau des lectures s'il ne l'est pas encore. Retourne l'anneau."""
+    global history
+    with _history_lock:
+        if history is None:
+            history = ReadingHistory()
+        return history
+
+
+def record(weight, at):
+    """Conserve une lecture décodée pour l'analyse (appelé par le lecteur)."""
+    ring = history
+    if ring is not None:
+        ring.record(weight, at)
+
+
+def _rolling_numpy(weights):
+    """Moyenne et écart type glissants (fenêtre WINDOW), par sommes cumulées."""
+    w = np.asarray(weights, dtype=np.float64)
+    c1 = np.concatenate(([0.0], np.cumsum(w)))
+    c2 = np.concatenate(([0.0], np.cumsum(w * w)))
+    mean = (c1[WINDOW:] - c1[:-WINDOW]) / WINDOW
+    var = (c2[WINDOW:] - c2[:-WINDOW]) / WINDOW - mean * mean
+    return mean, np.sqrt(np.clip(var, 0.0, None))
+
+
+def _rolling_python(weights):
+    means = []
+    stds = []
+    s1 = sum(weights[:WINDOW])
+    s2 = sum(v * v for v in weights[:WINDOW])
+    for i in range(WINDOW, len(weights) + 1):
+        mean = s1 / WINDOW
+        means.append(mean)
+        stds.append(math.sqrt(max(s2 / WINDOW - mean * mean, 0.0)))
+        if i < len(weights):
+            new, old = weights[i], weights[i - WINDOW]
+            s1 += new - old
+            s2 += new * new - old * old
+    return means, stds
+
+
+def _median(values):
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2] if ordered else None
+
+
+def analyze_block(weights, times, tolerance, empty_threshold):
+    """
+    Statistiques d'un bloc de lectures. Une fenêtre est au repos si sa
+    moyenne ne varie pas de plus de 'tolerance' sur la demi-fenêtre et la
+    fenêtre suivantes (un chargement ou un déchargement la fait varier).
+    Retourne (date médiane, décalage du zéro ou None, bruit ou None).
+    """
+    if len(weights) < 2 * WINDOW:
+        return None, None, None
+    middle = times[len(times) // 2]
+    if np is not None:
+        mean, std = _rolling_numpy(weights)
+        head = mean[:-WINDOW]
+        at_rest = ((np.abs(mean[WINDOW:] - head) <= tolerance)
+                   & (np.abs(mean[WINDOW // 2:-WINDOW // 2] - head) <= tolerance))
+        mean, std = mean[:-WINDOW][at_rest], std[:-WINDOW][at_rest]
+        empty = np.abs(mean) <= empty_threshold
+        zero = float(np.median(mean[empty])) if empty.any() else None
+        noise = float(np.median(std)) if len(std) else None
+        return middle, zero, noise
+
+    mean, std = _rolling_python(weights)
+    half = WINDOW // 2
+    rest = [i for i in range(len(mean) - WINDOW)
+            if abs(mean[i + WINDOW] - mean[i]) <= tolerance and abs(mean[i + half] - mean[i]) <= tolerance]
+    zero = _median([mean[i] for i in rest if abs(mean[i]) <= empty_threshold])
+    noise = _median([std[i] for i in rest])
+    return middle, zero, noise
+
+
+def _slope_per_hour(points):
+    """Pente (par heure) de la droite des moindres carrés passant par (date, valeur)."""
+    if len(points) < 2:
+        return None
+    t0 = points[0][0]
+    xs = [(t - t0) / 3600 for t, _ in points]
+    ys = [v for _, v in points]
+    mx, my = sum(xs) / len(xs), sum(ys) / len(ys)
+    sxx = sum((x - mx) ** 2 for x in xs)
+    if sxx == 0:
+        return None
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sxx
+
+
+def _settle_times():
+    cycles = storage.backend.cycles(limit=SETTLE_SAMPLE)
+    values = sorted(c['duree_stabilisation_s'] for c in cycles)
+    if not values:
+        return None
+    return {
+        "count": len(values),
+        "p50": values[len(values) // 2],
+        "p90": values[min(len(values) - 1, int(len(values) * 0.9))],
+        "max": values[-1],
+    }
+
+
+class Analyzer:
+    """Analyse périodique (analysis_interval secondes, 0 = désactivée)."""
+
+    def __init__(self, stop_event, source=None):
+        self.stop_event = stop_event
+        self.source = source
+        self.report = None
+        self._anomalies = set()
+        self._lock = threading.Lock()  # Analyse périodique et ?fresh=1 de l'API
+        # Sans NumPy: (date médiane, zéro, bruit) des blocs déjà résumés
+        self._summaries = deque(maxlen=MAX_SUMMARIES)
+        self._summarized_until = float('-inf')
+
+    def run(self):
+        last_run = last_summary = time.time()
+        while not self.stop_event.wait(1.0):
+            interval = settings.get('analysis_interval')
+            if not interval:
+                continue
+            if self.source is None:
+                # Les lectures sont conservées à partir de l'activation de l'analyse
+                self.source = start_history()
+            try:
+                if time.time() - last_run >= interval:
+                    last_run = last_summary = time.time()
+                    self.analyze()
+                elif np is None and time.time() - last_summary >= SUMMARY_PERIOD:
+                    last_summary = time.time()
+                    with self._lock:
+                        self._summarize(settings.snapshot())
+            except Exception as e:
+                logger.error(f"Erreur de l'analyse des lectures: {e}")
+
+    def analyze(self):
+        """Analyse les lectures conservées et les pesées enregistrées. Retourne le rapport."""
+        with self._lock:
+            if self.source is None:
+                self.source = start_history()
+            return self._analyze()
+
+    def _analyze(self):
+        start = time.perf_counter()
+        cfg = settings.snapshot()
+        if np is not None:
+            weights, times = self.source.snapshot()
+            size = max(-(-len(weights) // BLOCKS), 8 * WINDOW)
+            blocks = list(self._blocks(weights, times, 0, size, cfg))
+            readings = len(weights)
+        else:
+            blocks = self._summarize(cfg)
+            readings = len(blocks) * SUMMARY_READINGS
+
+        zeros = [(middle, zero) for middle, zero, _ in blocks if zero is not None]
+        noises = [noise for _, _, noise in blocks if noise is not None]
+
+        zero_offset = zeros[-1][1] if zeros else None
+        noise = _median(noises)
+        settle = _settle_times()
+
+        anomalies = []
+        if zero_offset is not None and abs(zero_offset) > cfg['analysis_zero_limit']:
+            anomalies.append({"type": "zero_offset", "value": round(zero_offset, 3), "limit": cfg['analysis_zero_limit'],
+                              "message": f"Plateau vide lu à {zero_offset:.2f} kg: tarage ou étalonnage à vérifier."})
+        if noise is not None and noise > cfg['analysis_noise_limit']:
+            anomalies.append({"type": "noise", "value": round(noise, 3), "limit": cfg['analysis_noise_limit'],
+                              "message": f"Bruit de {noise:.2f} kg au repos: cellule de charge ou câblage à vérifier."})
+        if settle and settle["p90"] > cfg['analysis_settle_limit']:
+            anomalies.append({"type": "settle_time", "value": settle["p90"], "limit": cfg['analysis_settle_limit'],
+                              "message": f"90% des pesées se stabilisent en {settle['p90']:.1f}s ou plus."})
+
+        duration_ms = (time.perf_counter() - start) * 1000
+        self.report = {
+            "analyzed_at": datastore.format_date(datastore.now_ms()),
+            "engine": ENGINE,
+            "readings": readings,
+            "span_h": round((blocks[-1][0] - blocks[0][0]) / 3600, 2) if blocks else 0.0,
+            "duration_ms": round(duration_ms, 1),
+            "zero_offset_kg": None if zero_offset is None else round(zero_offset, 3),
+            "zero_drift_kg_per_h": None if _slope_per_hour(zeros) is None else round(_slope_per_hour(zeros), 3),
+            "noise_kg": None if noise is None else round(noise, 3),
+            "settle_s": settle,
+            "anomalies": anomalies,
+        }
+
+        metrics.observe('analysis_ms', duration_ms)
+        metrics.set_gauge('analysis_anomalies', len(anomalies))
+        if zero_offset is not None:
+            metrics.set_gauge('analysis_zero_offset_kg', round(zero_offset, 3))
+        if noise is not None:
+            metrics.set_gauge('analysis_noise_kg', round(noise, 3))
+        current = {a["type"] for a in anomalies}
+        for anomaly in anomalies:
+            if anomaly["type"] not in self._anomalies:
+                metrics.incr(f"analysis_anomaly_{anomaly['type']}")
+                logger.warning(f"Analyse: {anomaly['message']}")
+        self._anomalies = current
+        return self.report
+
+    @staticmethod
+    def _blocks(weights, times, first, size, cfg):
+        """Statistiques des blocs de 'size' lectures à partir de 'first' (le dernier peut être incomplet)."""
+        for offset in range(first, len(weights), size):
+            middle, zero, noise = analyze_block(
+                weights[offset:offset + size], times[offset:offset + size],
+                cfg['stabilization_tolerance'], cfg['cycle_empty_threshold'])
+            if middle is not None:
+                yield middle, zero, noise
+            # Entre deux blocs, le GIL est rendu au lecteur et à l'API
+            time.sleep(0)
+
+    def _summarize(self, cfg):
+        """
+        Sans NumPy: résume les blocs complets de lectures arrivées depuis la
+        dernière analyse, oublie les résumés de plus de HORIZON_S. Retourne
+        les résumés, du plus ancien au plus récent.
+        """
+        weights, times = self.source.snapshot(FALLBACK_READINGS)
+        first = bisect.bisect_right(times, self._summarized_until)
+        complete = first + (len(weights) - first) // SUMMARY_READINGS * SUMMARY_READINGS
+        for block in self._blocks(weights[:complete], times[:complete], first, SUMMARY_READINGS, cfg):
+            self._summaries.append(block)
+        if complete > first:
+            self._summarized_until = times[complete - 1]
+        while self._summaries and self._summaries[0][0] < self._summaries[-1][0] - HORIZON_S:
+            self._summaries.popleft()
+        return list(self._summaries)
+
+
+# Instance utilisée par le service (créée par core.ServiceCore)
+analyzer = None
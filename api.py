@@ -0,0 +1,394 @@
+import logging
+import math
+import re
+import threading
+
+from flask import Flask, Response, request, jsonify
+from flask_cors import CORS
+from werkzeug.serving import ThreadedWSGIServer
+
+import analysis
+import archive
+import backup
+import diagnostics
+import encoding
+import health
+import metrics
+import ratelimit
+import storage
+from config import settings, DESKTOP
+from state import weights, IdempotencyConflict, WriteRejected
+
+# --- API HTTP locale ---
+# Ce module n'est importé qu'une fois le service déclaré RUNNING auprès du SCM:
+# Flask et ses dépendances représentent l'essentiel du temps d'import.
+
+HOST = '127.0.0.1'
+PORT = 5000
+MAX_CONCURRENT_REQUESTS = 32  # Au-delà, les connexions attendent dans la file d'écoute
+SLOT_WAIT = 0.25  # Attente maximale d'une place libre avant de répondre 503 (secondes)
+BUSY_RESPONSE = (b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\n"
+                 b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+MAX_HISTORY = 1000  # Nombre maximal d'enregistrements par page d'historique
+MAX_IDEMPOTENCY_KEY_LENGTH = 200
+MAX_BATCH = 100  # Poids au plus par POST /api/poids/batch
+MAX_NAME_LENGTH = 64  # desktop et company: conservés en mémoire (WeightState) et en base
+MAX_REQUEST_BYTES = 64 * 1024  # Corps de requête au-delà duquel Flask répond 413
+MAX_ARCHIVE_WINDOW_MS = 3600 * 1000  # Fenêtre maximale d'une extraction de l'archive
+
+logger = logging.getLogger("OdmService")
+
+# --- Flask App ---
+app = Flask(__name__)
+# La taille des entrées (postes, clés d'idempotence) est bornée comme leur nombre
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+# Les origines distantes n'ont accès qu'aux données de poids, pas aux endpoints d'administration
+CORS(app, resources={r"/api/poids.*": {"origins": [re.compile(r".*odmtec.*"), re.compile(r".*otchoumouang\.github\.io.*")]}})
+
+
+def respond(value, status=200, records=False):
+    """
+    Réponse des endpoints /api/poids au format négocié (JSON ou MessagePack).
+    'records' indique un enregistrement (ou une liste d'enregistrements) de la
+    table poids, dont l'encodage est mis en cache par ID.
+    """
+    fmt = encoding.negotiate(request.accept_mimetypes)
+    if not records:
+        body = encoding.encode(value, fmt)
+    elif isinstance(value, list):
+        body = encoding.encode_records(value, fmt)
+    else:
+        body = encoding.encode_record(value, fmt)
+    return Response(body, status=status, mimetype=fmt)
+
+def too_many_requests(message, retry_after):
+    """Réponse 429 avec le délai (secondes entières) avant de réessayer."""
+    response = jsonify({"error": message})
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response, 429
+
+@app.after_request
+def compress_response(response):
+    # Seules les données de poids (historique notamment) justifient la compression
+    if not request.path.startswith('/api/poids') or response.direct_passthrough:
+        return response
+    response.vary.add('Accept-Encoding')
+    # Le corps dépend aussi du format négocié (JSON ou MessagePack, voir respond())
+    response.vary.add('Accept')
+    if response.content_encoding or response.status_code < 200 or response.status_code >= 300:
+        return response
+    body, content_encoding = encoding.compress(response.get_data(), request.accept_encodings)
+    if content_encoding:
+        response.set_data(body)
+        response.content_encoding = content_encoding
+    return response
+
+@app.before_request
+def admin_requires_json():
+    # Un formulaire ou un fetch "simple" d'une autre page web ne peut pas
+    # envoyer du JSON sans requête préalable CORS (refusée): exiger ce type
+    # de contenu protège les modifications d'administration du CSRF.
+    if request.path.startswith('/api/admin/') and request.method not in ('GET', 'HEAD', 'OPTIONS') \
+            and not request.is_json:
+        return jsonify({"error": "Content-Type: application/json requis."}), 415
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({"error": f"Requête trop volumineuse (au plus {MAX_REQUEST_BYTES} octets)."}), 413
+
+def invalid_weight(data, key):
+    """Message d'erreur si le poids, son poste, sa société ou sa clé d'idempotence est invalide, sinon None."""
+    if not isinstance(data, dict) or 'poids' not in data:
+        return "Le modèle de données est invalide ou le poids est négatif."
+    poids = data['poids']
+    if isinstance(poids, bool) or not isinstance(poids, (int, float)) or not math.isfinite(poids) or poids < 0:
+        return "Le modèle de données est invalide ou le poids est négatif."
+    for field in ('desktop', 'company'):
+        value = data.get(field)
+        if value is not None and (not isinstance(value, str) or not 0 < len(value) <= MAX_NAME_LENGTH):
+            return f"'{field}' doit être une chaîne de 1 à {MAX_NAME_LENGTH} caractères."
+    if key is not None and (not isinstance(key, str) or not 0 < len(key) <= MAX_IDEMPOTENCY_KEY_LENGTH):
+        return f"La clé d'idempotence doit compter 1 à {MAX_IDEMPOTENCY_KEY_LENGTH} caractères."
+    return None
+
+# --- API Endpoints ---
+@app.route('/api/poids', methods=['POST'])
+def post_poids():
+    data = request.get_json(silent=True)
+    # Un client qui renvoie la même requête (nouvel essai après une erreur
+    # réseau) réutilise sa clé: le poids n'est enregistré qu'une fois.
+    key = request.headers.get('Idempotency-Key') or (data.get('idempotency_key') if isinstance(data, dict) else None)
+    error = invalid_weight(data, key)
+    if error:
+        return jsonify({"error": error}), 400
+
+    poids_valeur = data['poids']
+    desktop = data.get('desktop') or DESKTOP
+    company = data.get('company') or settings.get('company')
+
+    # Limitation par client puis contre-pression: un client trop bavard ne doit
+    # pas retarder les écritures de la balance (prioritaires dans WeightState).
+    retry_after = ratelimit.check_write(
+        request.remote_addr, desktop, settings.get('api_write_rate'), settings.get('api_write_burst'))
+    if retry_after:
+        metrics.incr('api_rate_limited')
+        return too_many_requests("Trop de requêtes: réessayez plus tard.", retry_after)
+    if weights.pending_writes >= settings.get('api_write_queue_limit'):
+        metrics.incr('api_backpressure_rejections')
+        return too_many_requests("Base de données occupée: réessayez plus tard.", 1)
+
+    timeout = settings.get('api_write_wait_ms') / 1000
+    try:
+        if key is None:
+            record, created = weights.add(poids_valeur, desktop, company, timeout=timeout), True
+        else:
+            record, created = weights.add_idempotent(poids_valeur, desktop, company, key, timeout=timeout)
+        if record is None:
+            return jsonify({"error": "Une erreur interne est survenue."}), 500
+        if not created:
+            # Doublon: même réponse que la requête d'origine, sans nouvelle insertion
+            response = jsonify({"message": "Valeur ajoutée avec succès", "poids": record['valeur']})
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response, 200
+        return jsonify({"message": "Valeur ajoutée avec succès", "poids": poids_valeur}), 200
+    except IdempotencyConflict as e:
+        # Même clé, autre poids: ni rejeu ni nouvel enregistrement
+        return jsonify({"error": str(e)}), 422
+    except WriteRejected as e:
+        metrics.incr('api_backpressure_rejections')
+        logger.warning(f"POST /api/poids refusé: {e}")
+        return too_many_requests("Base de données occupée: réessayez plus tard.", 1)
+    except Exception as e:
+        logger.error(f"API Error on POST: {e}")
+        return jsonify({"error": "Une erreur interne est survenue."}), 500
+
+@app.route('/api/poids/batch', methods=['POST'])
+def post_poids_batch():
+    # Série de poids [{"poids", "desktop", "company", "idempotency_key"}, ...]
+    # enregistrée en une seule transaction: tous ou aucun. La série prend un
+    # seul jeton, dans le seau de l'adresse, quels que soient ses postes.
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or not 0 < len(items) <= MAX_BATCH:
+        return jsonify({"error": f"Une liste de 1 à {MAX_BATCH} poids est attendue."}), 400
+    for i, item in enumerate(items):
+        error = invalid_weight(item, item.get('idempotency_key') if isinstance(item, dict) else None)
+        if error:
+            return jsonify({"error": f"Poids {i}: {error}"}), 400
+
+    batch = [(item['poids'], item.get('desktop') or DESKTOP, item.get('company') or settings.get('company'),
+              item.get('idempotency_key')) for item in items]
+    retry_after = ratelimit.check_batch(
+        request.remote_addr, settings.get('api_write_rate'), settings.get('api_write_burst'))
+    if retry_after:
+        metrics.incr('api_rate_limited')
+        return too_many_requests("Trop de requêtes: réessayez plus tard.", retry_after)
+    if weights.pending_writes >= settings.get('api_write_queue_limit'):
+        metrics.incr('api_backpressure_rejections')
+        return too_many_requests("Base de données occupée: réessayez plus tard.", 1)
+
+    try:
+        results = weights.add_batch(batch, timeout=settings.get('api_write_wait_ms') / 1000)
+        if results is None:
+            return jsonify({"error": "Une erreur interne est survenue."}), 500
+        metrics.observe('api_batch_size', len(batch))
+        return jsonify({"message": f"{sum(created for _, created in results)} valeur(s) ajoutée(s) avec succès",
+                        "results": [{"id": record['id'], "poids": record['valeur'], "replayed": not created}
+                                    for record, created in results]}), 200
+    except IdempotencyConflict as e:
+        return jsonify({"error": str(e)}), 422
+    except WriteRejected as e:
+        metrics.incr('api_backpressure_rejections')
+        logger.warning(f"POST /api/poids/batch refusé: {e}")
+        return too_many_requests("Base de données occupée: réessayez plus tard.", 1)
+    except Exception as e:
+        logger.error(f"API Error on POST batch: {e}")
+        return jsonify({"error": "Une erreur interne est survenue."}), 500
+
+@app.route('/api/poids', methods=['GET'])
+def get_poids():
+    desktop = request.args.get('desktop')
+    company = request.args.get('company')
+
+    try:
+        dernier_poids = weights.latest(desktop, company)
+        if dernier_poids:
+            return respond(dernier_poids, records=True)
+        else:
+            return respond({"message": "Aucun enregistrement trouvé pour les critères fournis."}, 404)
+    except Exception as e:
+        logger.error(f"API Error on GET: {e}")
+        return jsonify({"error": "Une erreur interne est survenue."}), 500
+
+@app.route('/api/poids/history', methods=['GET'])
+def get_poids_history():
+    desktop = request.args.get('desktop')
+    company = request.args.get('company')
+    limit = request.args.get('limit', 100, type=int)
+    before = request.args.get('before', type=int)
+    if limit is None or not 1 <= limit <= MAX_HISTORY:
+        return jsonify({"error": f"'limit' doit être compris entre 1 et {MAX_HISTORY}."}), 400
+
+    try:
+        historique = storage.backend.history(desktop, company, limit=limit, before_id=before)
+        return respond(historique, records=True)
+    except Exception as e:
+        logger.error(f"API Error on GET history: {e}")
+        return jsonify({"error": "Une erreur interne est survenue."}), 500
+
+@app.route('/api/poids/cycles', methods=['GET'])
+def get_poids_cycles():
+    # Pesées complètes (weighing_mode = "cycle"): pic, début, stabilisation, fin
+    desktop = request.args.get('desktop')
+    company = request.args.get('company')
+    limit = request.args.get('limit', 100, type=int)
+    before = request.args.get('before', type=int)
+    if limit is None or not 1 <= limit <= MAX_HISTORY:
+        return jsonify({"error": f"'limit' doit être compris entre 1 et {MAX_HISTORY}."}), 400
+
+    try:
+        return respond(storage.backend.cycles(desktop, company, limit=limit, before_id=before))
+    except Exception as e:
+        logger.error(f"API Error on GET cycles: {e}")
+        return jsonify({"error": "Une erreur interne est survenue."}), 500
+
+@app.route('/api/poids/live', methods=['GET'])
+def get_poids_live():
+    live = weights.live()
+    if live:
+        return respond(live)
+    return respond({"message": "Aucune lecture de la balance pour le moment."}, 404)
+
+@app.route('/api/admin/config', methods=['GET'])
+def get_config():
+    return jsonify({"generation": settings.generation, "config": settings.snapshot()})
+
+@app.route('/api/admin/config', methods=['PUT', 'PATCH'])
+def put_config():
+    changes = request.get_json(silent=True)
+    try:
+        changed = settings.update(changes)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except OSError as e:
+        logger.error(f"API Error on config update: {e}")
+        return jsonify({"error": "Impossible d'enregistrer la configuration."}), 500
+
+    if changed:
+        logger.info(f"Configuration modifiée: {', '.join(changed)} (génération {settings.generation})")
+    return jsonify({"generation": settings.generation, "changed": changed, "config": settings.snapshot()})
+
+@app.route('/api/health', methods=['GET'])
+def get_health():
+    body, healthy = health.report()
+    return jsonify(body), 200 if healthy else 503
+
+@app.route('/api/debug/memory', methods=['GET'])
+def get_debug_memory():
+    body = {"bounds": diagnostics.bounds()}
+    profiler = diagnostics.profiler
+    report = profiler.report(fresh=request.args.get('fresh') == '1') if profiler else None
+    if report is None:
+        body["message"] = "Diagnostics mémoire désactivés (memory_diagnostics)."
+    else:
+        body["tracemalloc"] = report
+    return jsonify(body)
+
+@app.route('/api/analysis', methods=['GET'])
+def get_analysis():
+    # Dernier rapport de dérive, de bruit et de temps de stabilisation (?fresh=1: analyse immédiate)
+    analyzer = analysis.analyzer
+    if analyzer is None:
+        return jsonify({"message": "Analyse non démarrée."}), 503
+    try:
+        report = analyzer.analyze() if request.args.get('fresh') == '1' else analyzer.report
+    except Exception as e:
+        logger.error(f"API Error on analysis: {e}")
+        return jsonify({"error": "Une erreur interne est survenue."}), 500
+    if report is None:
+        return jsonify({"message": "Aucune analyse effectuée pour le moment (analysis_interval)."}), 404
+    return jsonify(report)
+
+@app.route('/api/admin/backup', methods=['POST'])
+def post_backup():
+    # Sauvegarde immédiate de la base (corps JSON, {} ou {"compress": false}
+    # pour une copie non compressée)
+    body = request.get_json(silent=True) or {}
+    compress = body.get('compress') if isinstance(body, dict) else None
+    if compress is not None and not isinstance(compress, bool):
+        return jsonify({"error": "'compress' doit être un booléen."}), 400
+    try:
+        result = backup.create(compress=compress)
+    except backup.BackupBusy as e:
+        return jsonify({"error": str(e)}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"API Error on backup: {e}")
+        return jsonify({"error": "Une erreur interne est survenue."}), 500
+    return jsonify(result), 201
+
+@app.route('/api/admin/archive', methods=['GET'])
+def get_archive():
+    # Flux brut reçu de la balance entre start et end (millisecondes depuis l'epoch)
+    start = request.args.get('start', type=int)
+    end = request.args.get('end', type=int)
+    if start is None or end is None or not 0 <= end - start <= MAX_ARCHIVE_WINDOW_MS:
+        return jsonify({"error": f"'start' et 'end' (ms) requis, fenêtre d'au plus {MAX_ARCHIVE_WINDOW_MS} ms."}), 400
+    try:
+        data = archive.extract(start / 1000, end / 1000)
+    except Exception as e:
+        logger.error(f"API Error on archive extract: {e}")
+        return jsonify({"error": "Une erreur interne est survenue."}), 500
+    return Response(data, mimetype='application/octet-stream')
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    return jsonify(metrics.snapshot())
+
+
+class BoundedWSGIServer(ThreadedWSGIServer):
+    """Serveur WSGI multi-thread avec un nombre borné de requêtes traitées simultanément."""
+
+    def __init__(self, host, port, app, max_threads=MAX_CONCURRENT_REQUESTS):
+        super().__init__(host, port, app)
+        self.max_threads = max_threads
+        self.active_threads = 0
+        self._slots = threading.BoundedSemaphore(max_threads)
+        self._count_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        # serve_forever attend ici: une attente bornée le laisse répondre à shutdown()
+        if not self._slots.acquire(timeout=SLOT_WAIT):
+            metrics.incr('api_busy_rejections')
+            try:
+                request.sendall(BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        with self._count_lock:
+            self.active_threads += 1
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self._release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._release()
+
+    def _release(self):
+        with self._count_lock:
+            self.active_threads -= 1
+        self._slots.release()
+
+
+def create_server(host=HOST, port=PORT):
+    """Crée le serveur HTTP (socket déjà ouverte, prêt à servir)."""
+    server = BoundedWSGIServer(host, port, app)
+    diagnostics.register_bound("http_request_threads", lambda: server.active_threads, server.max_threads)
+    metrics.set_gauge('startup_http_ready_ms', round(metrics.uptime() * 1000))
+    return server
@@ -0,0 +1,358 @@
+"""
+Archive des octets bruts reçus de la balance, pour l'audit et le rejeu.
+
+Extraction d'une fenêtre (dates ISO 8601 UTC ou millisecondes depuis l'epoch),
+ou des N secondes qui précèdent un enregistrement de la table poids:
+
+    python archive.py extract --start 2026-10-19T08:00:00 --end 2026-10-19T08:01:00 -o pesee.bin
+    python archive.py extract --id 1234 --before 30 -o pesee.bin
+    python archive.py info
+"""
+import argparse
+import bisect
+import logging
+import mmap
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+import diagnostics
+import metrics
+from config import settings, CONFIG_DIR
+
+# --- Archive des trames brutes ---
+# Le lecteur dépose chaque bloc d'octets reçu (horodaté) dans une file bornée,
+# sans jamais attendre; un thread d'arrière-plan les regroupe en blocs
+# compressés (zlib) ajoutés en fin de segment. Chaque segment a son index
+# (premier/dernier horodatage et position de chaque bloc), à taille fixe,
+# lu par mmap et parcouru par dichotomie: extraire une pesée ne décompresse
+# que les blocs de sa fenêtre. Les segments les plus anciens sont supprimés
+# au-delà de archive_max_mb.
+
+logger = logging.getLogger("OdmService")
+
+ARCHIVE_DIR = os.path.join(CONFIG_DIR, 'archive')
+
+QUEUE_LIMIT = 4096  # Blocs reçus en attente d'archivage (au-delà: ignorés et comptés)
+BLOCK_SIZE = 64 * 1024  # Taille brute visée d'un bloc compressé
+BLOCK_INTERVAL = 1.0  # Délai maximal avant l'écriture d'un bloc incomplet (secondes)
+COMPRESS_LEVEL = 6
+
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+# Bloc: taille compressée, taille brute, CRC32 des données brutes
+BLOCK_HEADER = struct.Struct('<III')
+# Enregistrement (dans un bloc décompressé): horodatage (s), longueur
+RECORD = struct.Struct('<dI')
+# Entrée d'index: premier et dernier horodatage du bloc, position dans le segment
+INDEX_ENTRY = struct.Struct('<ddQ')
+
+
+class FrameArchive:
+    """
+    Écriture de l'archive. append() est appelé par le lecteur pour chaque
+    lecture du port; run() est la boucle du thread d'arrière-plan, pilotée
+    par archive_enabled (activable à chaud).
+    """
+
+    def __init__(self, stop_event, directory=None):
+        self.stop_event = stop_event
+        self.directory = directory or ARCHIVE_DIR
+        self.enabled = False
+        self._queue = queue.Queue(QUEUE_LIMIT)
+        self._block = bytearray()
+        self._block_first = None
+        self._block_last = None
+        self._block_started = None
+        self._segment = None
+        self._index = None
+
+    def append(self, chunk, at=None):
+        """Dépose un bloc d'octets reçu. Ne bloque jamais le lecteur."""
+        if not self.enabled:
+            return
+        try:
+            self._queue.put_nowait((at or time.time(), bytes(chunk)))
+        except queue.Full:
+            metrics.incr('archive_dropped_chunks')
+
+    def queue_size(self):
+        return self._queue.qsize()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.enabled = settings.get('archive_enabled')
+                try:
+                    at, chunk = self._queue.get(timeout=BLOCK_INTERVAL / 4)
+                    self._add(at, chunk)
+                except queue.Empty:
+                    pass
+                if self._block and (len(self._block) >= BLOCK_SIZE
+                                    or time.time() - self._block_started >= BLOCK_INTERVAL):
+                    self.flush()
+                if not self.enabled and self._segment:
+                    self.close()
+            except Exception as e:
+                logger.error(f"Erreur de l'archive des trames: {e}")
+                self.stop_event.wait(1.0)
+        # Arrêt: les blocs en attente sont écrits avant de fermer le segment
+        self.enabled = False
+        try:
+            while True:
+                self._add(*self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        except Exception as e:
+            logger.error(f"Erreur de l'archive des trames: {e}")
+        self.close()
+
+    def _add(self, at, chunk):
+        if not self._block:
+            self._block_first = at
+            self._block_started = time.time()
+        self._block += RECORD.pack(at, len(chunk))
+        self._block += chunk
+        self._block_last = at
+
+    def flush(self):
+        """Compresse le bloc en cours et l'ajoute au segment (puis à son index)."""
+        if not self._block:
+            return
+        start = time.perf_counter()
+        raw = bytes(self._block)
+        compressed = zlib.compress(raw, COMPRESS_LEVEL)
+        if self._segment is None or self._segment.tell() >= settings.get('archive_segment_mb') * 1024 * 1024:
+            self._rotate()
+        offset = self._segment.tell()
+        self._segment.write(BLOCK_HEADER.pack(len(compressed), len(raw), zlib.crc32(raw)))
+        self._segment.write(compressed)
+        self._segment.flush()
+        # L'index n'est écrit qu'après le bloc: une entrée désigne toujours un bloc complet
+        self._index.write(INDEX_ENTRY.pack(self._block_first, self._block_last, offset))
+        self._index.flush()
+        self._block.clear()
+        metrics.incr('archive_bytes_raw', len(raw))
+        metrics.incr('archive_bytes_written', BLOCK_HEADER.size + len(compressed))
+        metrics.observe('archive_block_ms', (time.perf_counter() - start) * 1000)
+
+    def _rotate(self):
+        self._close_files()
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, f"frames-{time.time_ns() // 1_000_000}")
+        self._segment = open(base + SEGMENT_SUFFIX, 'ab')
+        self._index = open(base + INDEX_SUFFIX, 'ab')
+        self._enforce_limit()
+
+    def _enforce_limit(self):
+        """Supprime les segments les plus anciens au-delà de archive_max_mb."""
+        limit = settings.get('archive_max_mb') * 1024 * 1024
+        segments = list_segments(self.directory)
+        total = sum(os.path.getsize(path) for path in segments)
+        current = self._segment.name if self._segment else None
+        for path in segments:
+            if total <= limit or path == current:
+                break
+            total -= os.path.getsize(path)
+            for suffix_path in (path, path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX):
+                try:
+                    os.remove(suffix_path)
+                except OSError as e:
+                    logger.error(f"Archive: suppression impossible de {suffix_path}: {e}")
+            metrics.incr('archive_segments_deleted')
+
+    def close(self):
+        self.flush()
+        self._close_files()
+
+    def _close_files(self):
+        for f in (self._segment, self._index):
+            if f:
+                f.close()
+        self._segment = self._index = None
+
+
+def list_segments(directory=None):
+    """Segments de l'archive, du plus ancien au plus récent."""
+    directory = directory or ARCHIVE_DIR
+    try:
+        names = sorted(n for n in os.listdir(directory) if n.endswith(SEGMENT_SUFFIX))
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, n) for n in names]
+
+
+class Segment:
+    """Un segment et son index, projetés en mémoire (lecture seule)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._files = []
+        # Index d'abord: tout bloc qu'il désigne est déjà entièrement écrit dans le segment
+        self.index = self._map(path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX)
+        self.data = self._map(path)
+        count = len(self.index) // INDEX_ENTRY.size if self.index is not None else 0
+        self.entries = [INDEX_ENTRY.unpack_from(self.index, i * INDEX_ENTRY.size) for i in range(count)]
+        # Derniers horodatages croissants: recherche du premier bloc utile par dichotomie
+        self._last = [entry[1] for entry in self.entries]
+
+    def _map(self, path):
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        self._files.append(f)
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def first(self):
+        return self.entries[0][0] if self.entries else None
+
+    @property
+    def last(self):
+        return self.entries[-1][1] if self.entries else None
+
+    def read(self, start, end):
+        """Blocs reçus entre start et end (secondes depuis l'epoch): liste de (horodatage, octets)."""
+        chunks = []
+        for first, last, offset in self.entries[bisect.bisect_left(self._last, start):]:
+            if first > end:
+                break
+            compressed_len, raw_len, crc = BLOCK_HEADER.unpack_from(self.data, offset)
+            begin = offset + BLOCK_HEADER.size
+            raw = zlib.decompress(self.data[begin:begin + compressed_len])
+            if len(raw) != raw_len or zlib.crc32(raw) != crc:
+                logger.error(f"Archive: bloc corrompu dans {self.path} à la position {offset}")
+                continue
+            position = 0
+            while position < len(raw):
+                at, length = RECORD.unpack_from(raw, position)
+                position += RECORD.size
+                if start <= at <= end:
+                    chunks.append((at, raw[position:position + length]))
+                position += length
+        return chunks
+
+    def close(self):
+        for m in (self.data, self.index):
+            if m is not None:
+                m.close()
+        for f in self._files:
+            f.close()
+
+
+def read(start, end, directory=None):
+    """Blocs d'octets bruts reçus entre start et end (secondes depuis l'epoch), dans l'ordre."""
+    chunks = []
+    for path in list_segments(directory):
+        segment = Segment(path)
+        try:
+            if segment.entries and segment.first <= end and segment.last >= start:
+                chunks.extend(segment.read(start, end))
+        finally:
+            segment.close()
+    return chunks
+
+
+def extract(start, end, directory=None):
+    """Flux brut (octets concaténés) reçu entre start et end."""
+    return b''.join(chunk for _, chunk in read(start, end, directory))
+
+
+# Instance utilisée par le service (créée par core.ServiceCore)
+writer = None
+
+
+def record(chunk):
+    """Archive un bloc d'octets reçu du port série (appelé par le lecteur)."""
+    if writer is not None:
+        writer.append(chunk)
+
+
+def start(stop_event, directory=None):
+    """Crée l'archive du processus et démarre son thread d'écriture."""
+    global writer
+    writer = FrameArchive(stop_event, directory)
+    diagnostics.register_bound("archive_queue", writer.queue_size, QUEUE_LIMIT)
+    thread = threading.Thread(target=writer.run, daemon=True)
+    thread.start()
+    return thread
+
+
+def _parse_time(value):
+    """Millisecondes depuis l'epoch ou date ISO 8601 (UTC) -> secondes depuis l'epoch."""
+    if value.isdigit():
+        return int(value) / 1000
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive des trames brutes OdmService")
+    parser.add_argument("--dir", default=ARCHIVE_DIR, help="dossier de l'archive")
+    commands = parser.add_subparsers(dest="command", required=True)
+    info = commands.add_parser("info", help="segments et période couverte")
+    info.set_defaults(func=_info)
+    ext = commands.add_parser("extract", help="extrait le flux brut d'une période ou d'une pesée")
+    ext.add_argument("--start", help="début (ISO 8601 UTC ou ms depuis l'epoch)")
+    ext.add_argument("--end", help="fin (ISO 8601 UTC ou ms depuis l'epoch)")
+    ext.add_argument("--id", type=int, help="ID d'un enregistrement de la table poids")
+    ext.add_argument("--before", type=float, default=30, help="secondes extraites avant la pesée (--id)")
+    ext.add_argument("--after", type=float, default=2, help="secondes extraites après la pesée (--id)")
+    ext.add_argument("-o", "--output", help="fichier de sortie (défaut: sortie standard)")
+    ext.set_defaults(func=_extract)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+def _info(args):
+    for path in list_segments(args.dir):
+        segment = Segment(path)
+        try:
+            span = (f"{datetime.fromtimestamp(segment.first, timezone.utc):%Y-%m-%d %H:%M:%S} -> "
+                    f"{datetime.fromtimestamp(segment.last, timezone.utc):%Y-%m-%d %H:%M:%S}"
+                    if segment.entries else "vide")
+            print(f"{os.path.basename(path)}  {os.path.getsize(path) / 1024:>9.0f} ko  "
+                  f"{len(segment.entries):>6} blocs  {span}")
+        finally:
+            segment.close()
+    return 0
+
+
+def _extract(args):
+    if args.id is not None:
+        import datastore
+        rows = datastore.get_historique_poids(limit=1, before_id=args.id + 1)
+        if not rows or rows[0]['id'] != args.id:
+            print(f"Enregistrement {args.id} introuvable.", file=sys.stderr)
+            return 1
+        at = datetime.fromisoformat(rows[0]['date']).replace(tzinfo=timezone.utc).timestamp()
+        start, end = at - args.before, at + args.after
+    elif args.start and args.end:
+        start, end = _parse_time(args.start), _parse_time(args.end)
+    else:
+        print("Indiquez --id ou --start et --end.", file=sys.stderr)
+        return 2
+
+    began = time.perf_counter()
+    data = extract(start, end, args.dir)
+    if args.output:
+        with open(args.output, 'wb') as f:
+            f.write(data)
+    else:
+        sys.stdout.buffer.write(data)
+    print(f"{len(data)} octets extraits en {(time.perf_counter() - began) * 1000:.1f} ms", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
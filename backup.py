@@ -0,0 +1,200 @@
+"""
+Sauvegardes de poids.db, faites à chaud par l'API de sauvegarde de SQLite.
+
+    python backup.py create [--no-compress]
+    python backup.py list
+
+Le service en fait une toutes les backup_interval secondes, et à la demande
+par POST /api/admin/backup (Content-Type: application/json).
+"""
+import argparse
+import gzip
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import datastore
+import metrics
+import storage
+from config import settings, CONFIG_DIR
+
+# --- Sauvegarde en ligne ---
+# La copie se fait par petits groupes de pages (STEP_PAGES): le verrou de
+# lecture n'est tenu que pendant un groupe, et une courte pause entre deux
+# groupes laisse passer les écritures du lecteur et de l'API. Une écriture
+# faite par une autre connexion pendant la copie la fait reprendre du début,
+# si bien que l'instantané est toujours cohérent; après MAX_RESTARTS reprises,
+# la copie se fait en une seule étape (en WAL, sans bloquer les écritures;
+# sinon, pendant la durée de la copie). La copie est écrite sous un
+# nom temporaire, éventuellement compressée (gzip), puis renommée: un fichier
+# poids-AAAAMMJJ-HHMMSS-mmm.db[.gz] est toujours complet (millisecondes: deux
+# sauvegardes de la même seconde, planifiée et demandée, ne s'écrasent pas). Au-delà de backup_keep
+# fichiers, les plus anciens sont supprimés.
+
+logger = logging.getLogger("OdmService")
+
+BACKUP_DIR = os.path.join(CONFIG_DIR, 'backups')
+
+STEP_PAGES = 64  # Pages copiées par étape (256 ko en pages de 4 ko)
+STEP_PAUSE = 0.005  # Pause entre deux étapes (secondes)
+MAX_RESTARTS = 3  # Reprises de la copie par étapes avant une copie en une étape
+# Les sauvegardes sans millisecondes viennent des versions précédentes
+NAME = re.compile(r'^poids-\d{8}-\d{6}(-\d{3})?\.db(\.gz)?$')
+
+
+class BackupBusy(Exception):
+    """Une sauvegarde est déjà en cours."""
+
+
+class _Restarted(Exception):
+    """La copie par étapes a repris du début trop souvent."""
+
+
+_lock = threading.Lock()
+
+
+def list_backups(directory=None):
+    """Sauvegardes du dossier, de la plus ancienne à la plus récente."""
+    directory = directory or BACKUP_DIR
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if NAME.match(name))
+
+
+def prune(keep, directory=None):
+    """Supprime les sauvegardes au-delà des 'keep' plus récentes. Retourne le nombre supprimé."""
+    backups = list_backups(directory)
+    removed = 0
+    for path in backups[:max(len(backups) - keep, 0)]:
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError as e:
+            logger.error(f"Suppression de la sauvegarde {path} impossible: {e}")
+    return removed
+
+
+def create(compress=None, directory=None, keep=None):
+    """
+    Sauvegarde la base et applique la rétention. Lève BackupBusy si une
+    sauvegarde est déjà en cours. Retourne le chemin, la taille (octets), la
+    durée (ms) et le nombre de pages copiées.
+    """
+    if storage.backend.name != "sqlite":
+        raise ValueError(f"Sauvegarde impossible avec le stockage {storage.backend.name}.")
+    if not _lock.acquire(blocking=False):
+        raise BackupBusy("Une sauvegarde est déjà en cours.")
+    try:
+        cfg = settings.snapshot()
+        compress = cfg['backup_compress'] if compress is None else compress
+        directory = directory or BACKUP_DIR
+        os.makedirs(directory, exist_ok=True)
+        start = time.perf_counter()
+
+        moment = datetime.now(timezone.utc)
+        name = f"poids-{moment:%Y%m%d-%H%M%S}-{moment.microsecond // 1000:03d}.db"
+        path = os.path.join(directory, name)
+        partial = path + '.partial'
+        pages = 0
+        restarts = 0
+        previous = None
+
+        def pause(status, remaining, total):
+            nonlocal pages, restarts, previous
+            pages = total
+            if previous is not None and remaining >= previous:
+                # La base a été modifiée pendant la copie, qui reprend au début
+                restarts += 1
+                if restarts > MAX_RESTARTS:
+                    raise _Restarted()
+            previous = remaining
+            time.sleep(STEP_PAUSE)
+
+        try:
+            source = sqlite3.connect(datastore.DB_PATH)
+            target = sqlite3.connect(partial)
+            try:
+                try:
+                    source.backup(target, pages=STEP_PAGES, progress=pause)
+                except _Restarted:
+                    metrics.incr('backup_single_step')
+                    source.backup(target)
+                    pages = source.execute("PRAGMA page_count").fetchone()[0]
+            finally:
+                target.close()
+                source.close()
+
+            if compress:
+                with open(partial, 'rb') as raw, gzip.open(partial + '.gz', 'wb', compresslevel=6) as packed:
+                    shutil.copyfileobj(raw, packed, 1024 * 1024)
+                os.remove(partial)
+                path = path + '.gz'
+                os.replace(partial + '.gz', path)
+            else:
+                os.replace(partial, path)
+        except Exception:
+            # Les fichiers temporaires ne suivent pas NAME: prune ne les supprimerait jamais
+            for leftover in (partial, partial + '.gz'):
+                try:
+                    os.remove(leftover)
+                except OSError:
+                    pass
+            raise
+
+        duration_ms = (time.perf_counter() - start) * 1000
+        size = os.path.getsize(path)
+        removed = prune(cfg['backup_keep'] if keep is None else keep, directory)
+        metrics.incr('backups')
+        metrics.observe('backup_ms', duration_ms)
+        metrics.set_gauge('backup_last_size', size)
+        logger.info(f"Sauvegarde {path} ({size / 1024:.0f} ko, {pages} pages) en {duration_ms:.0f} ms"
+                    f"{f', {removed} ancienne(s) supprimée(s)' if removed else ''}.")
+        return {"path": path, "size": size, "duration_ms": round(duration_ms, 1),
+                "pages": pages, "compressed": compress}
+    finally:
+        _lock.release()
+
+
+def run(stop_event):
+    """Sauvegardes périodiques (backup_interval secondes, 0 = désactivées)."""
+    last_run = time.time()
+    while not stop_event.wait(5):
+        interval = settings.get('backup_interval')
+        if not interval or storage.backend.name != "sqlite" or time.time() - last_run < interval:
+            continue
+        last_run = time.time()
+        try:
+            create()
+        except BackupBusy:
+            pass
+        except Exception as e:
+            metrics.incr('backup_errors')
+            logger.error(f"Erreur de sauvegarde de la base: {e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sauvegardes de la base OdmService")
+    parser.add_argument("--dir", default=BACKUP_DIR, help="dossier des sauvegardes")
+    commands = parser.add_subparsers(dest="command", required=True)
+    cmd = commands.add_parser("create", help="sauvegarde la base maintenant")
+    cmd.add_argument("--no-compress", action="store_true", help="copie non compressée")
+    cmd = commands.add_parser("list", help="sauvegardes présentes")
+    args = parser.parse_args(argv)
+
+    if args.command == "create":
+        result = create(compress=False if args.no_compress else None, directory=args.dir)
+        print(f"{result['path']}  {result['size'] / 1024:.0f} ko  {result['duration_ms']:.0f} ms")
+    else:
+        for path in list_backups(args.dir):
+            print(f"{os.path.basename(path)}  {os.path.getsize(path) / 1024:>9.0f} ko")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1036 @@
+"""
+Benchmarks du service, exécutables sans Windows ni balance:
+
+    python bench.py protocols [--frames N] [--chunk N] [--min-fps N]
+    python bench.py startup [--max-http-ms N] [--max-frame-ms N]
+    python bench.py memory [--seconds S] [--max-growth-kb N]
+    python bench.py cycles [--seconds S] [--min-ratio X]
+    python bench.py analysis [--readings N] [--max-ms N] [--max-stall-ms N]
+    python bench.py durability [--writes N] [--kill-after S]
+    python bench.py client [--requests N]
+    python bench.py storage [--writes N]
+    python bench.py lifecycle [--cycles N] [--max-stop-ms N] [--max-frame-ms N]
+    python bench.py hotplug [--absent S] [--max-reconnect-ms N]
+
+Chaque sous-commande affiche ses mesures et retourne un code de sortie non nul
+si un seuil n'est pas respecté, pour pouvoir être utilisée avant une livraison.
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+
+import protocols
+
+
+def _stream(protocol, frames, noise_every=50):
+    """Construit un flux continu de trames avec quelques octets parasites."""
+    rng = random.Random(42)
+    parts = []
+    for i in range(frames):
+        parts.append(protocol.encode(rng.randint(0, 60000), stable=rng.random() > 0.1))
+        if noise_every and i % noise_every == 0:
+            parts.append(b'\x00\xff\r\n')
+    return b''.join(parts)
+
+
+def bench_protocols(args):
+    """Débit de décodage (trames/s) de chaque protocole, lu par blocs comme sur le port série."""
+    failed = False
+    print(f"{'protocole':<10} {'trames':>8} {'trames/s':>12} {'Mo/s':>8}")
+    for protocol in protocols.REGISTRY.values():
+        data = _stream(protocol, args.frames)
+        buffer = bytearray()
+        decoded = 0
+        start = time.perf_counter()
+        for offset in range(0, len(data), args.chunk):
+            buffer.extend(data[offset:offset + args.chunk])
+            readings, consumed = protocol.scan(buffer)
+            if consumed:
+                del buffer[:consumed]
+            decoded += len(readings)
+        elapsed = time.perf_counter() - start
+
+        fps = decoded / elapsed if elapsed else float('inf')
+        print(f"{protocol.name:<10} {decoded:>8} {fps:>12,.0f} {len(data) / elapsed / 1e6:>8.1f}")
+        if decoded < args.frames * 0.99:
+            print(f"  ÉCHEC: seulement {decoded}/{args.frames} trames décodées")
+            failed = True
+        if fps < args.min_fps:
+            print(f"  ÉCHEC: débit inférieur au seuil de {args.min_fps:,} trames/s")
+            failed = True
+    return 1 if failed else 0
+
+
+STARTUP_MODULES = ["config", "metrics", "protocols", "datastore", "simulator", "reader", "api"]
+
+
+def _import_time_ms(module):
+    """Temps d'import à froid (cumulé, en ms) d'un module, mesuré dans un interpréteur neuf."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1]) / 1000.0
+    raise RuntimeError(f"Import de {module} impossible:\n{result.stderr[-500:]}")
+
+
+def bench_startup(args):
+    """Temps d'import par module, délai jusqu'au premier HTTP 200 et jusqu'à la première trame."""
+    failed = False
+    print("Temps d'import à froid (cumulé):")
+    for module in STARTUP_MODULES:
+        print(f"  {module:<10} {_import_time_ms(module):>8.1f} ms")
+
+    _temp_datastore()
+
+    # Premier HTTP 200: import de la pile HTTP + ouverture de la socket + première réponse
+    start = time.perf_counter()
+    import api
+    server = api.create_server(port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/api/metrics"
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    break
+        except OSError:
+            time.sleep(0.005)
+    http_ms = (time.perf_counter() - start) * 1000
+    server.shutdown()
+
+    # Première trame: import du lecteur + connexion (simulée) + première trame décodée
+    start = time.perf_counter()
+    import reader
+    import simulator
+    stop = threading.Event()
+    scale = reader.ScaleReader(stop, connect=simulator.connect_factory())
+    thread = threading.Thread(target=scale.run, daemon=True)
+    thread.start()
+    while scale.last_frame_at is None and time.perf_counter() - start < 10:
+        time.sleep(0.001)
+    frame_ms = (time.perf_counter() - start) * 1000
+    stop.set()
+    scale.close()
+
+    print(f"Premier HTTP 200:      {http_ms:>8.1f} ms")
+    print(f"Première trame:        {frame_ms:>8.1f} ms")
+    if http_ms > args.max_http_ms:
+        print(f"  ÉCHEC: premier HTTP 200 au-delà de {args.max_http_ms} ms")
+        failed = True
+    if frame_ms > args.max_frame_ms:
+        print(f"  ÉCHEC: première trame au-delà de {args.max_frame_ms} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+def _temp_datastore():
+    import datastore
+    datastore.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="odm-bench-"), "poids.db")
+    datastore.init_db()
+
+
+def _traced_kb():
+    import gc
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0] / 1024.0
+
+
+def bench_memory(args):
+    """
+    Vérifie que la mémoire reste stable sous un flot de données invalides:
+    port série inondé de déchets pour chaque protocole, puis POST /api/poids
+    avec des postes tous différents. Échoue si la mémoire tracée croît de plus
+    de --max-growth-kb entre la fin de la chauffe et la fin du flot, ou si une
+    structure déclarée dépasse sa borne.
+    """
+    import contextlib
+    import diagnostics
+    import reader
+    import simulator
+    import state
+
+    failed = False
+    _temp_datastore()
+    tracemalloc.start()
+
+    for protocol in protocols.REGISTRY.values():
+        stop = threading.Event()
+        flood = simulator.FloodSerial()
+        scale = reader.ScaleReader(stop, connect=lambda: (flood, protocol), desktop=f"FLOOD-{protocol.name}")
+        thread = threading.Thread(target=scale.run, daemon=True)
+        thread.start()
+        time.sleep(args.seconds / 4)
+        before = _traced_kb()
+        time.sleep(args.seconds)
+        after = _traced_kb()
+        stop.set()
+        scale.close()
+        thread.join()
+        growth = after - before
+        print(f"lecteur {protocol.name:<8} {flood.bytes_sent / 1e6:>8.1f} Mo invalides  "
+              f"croissance {growth:>8.1f} ko  buffer max {len(scale.buffer)} o")
+        if growth > args.max_growth_kb:
+            print(f"  ÉCHEC: croissance mémoire > {args.max_growth_kb} ko")
+            failed = True
+
+    import api
+    client = api.app.test_client()
+    bodies = [b'', b'{', b'[]', b'{"poids": -1}', b'{"x": 1}']
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        # Chauffe: remplit l'état en mémoire jusqu'à sa borne
+        for i in range(state.MAX_STATIONS):
+            client.post('/api/poids', json={"poids": i, "desktop": f"FLOOD-{i}"})
+        before = _traced_kb()
+        for i in range(state.MAX_STATIONS, state.MAX_STATIONS + args.posts):
+            client.post('/api/poids', json={"poids": i, "desktop": f"FLOOD-{i}"})
+            client.post('/api/poids', data=bodies[i % len(bodies)], content_type='application/json')
+        after = _traced_kb()
+    growth = after - before
+    print(f"API POST {args.posts:>6} postes distincts + corps invalides  croissance {growth:>8.1f} ko")
+    if growth > args.max_growth_kb:
+        print(f"  ÉCHEC: croissance mémoire > {args.max_growth_kb} ko")
+        failed = True
+
+    tracemalloc.stop()
+    for name, bound in diagnostics.bounds().items():
+        over = isinstance(bound["size"], int) and bound["size"] > bound["limit"]
+        print(f"  {name:<32} {bound['size']!s:>8} / {bound['limit']}{'  DÉPASSEMENT' if over else ''}")
+        failed = failed or over
+    return 1 if failed else 0
+
+
+def bench_cycles(args):
+    """
+    Volume d'écriture des deux modes de pesée sur la même balance simulée:
+    une palette qui se stabilise par paliers (620, 1180 puis 1250 kg) puis une
+    charge simple, en boucle. Échoue si le mode "cycle" n'écrit pas au moins
+    --min-ratio fois moins de lignes que le mode "plateau", ou s'il perd une pesée.
+    """
+    import contextlib
+    import datastore
+    import reader
+    import simulator
+    from config import settings
+    from state import weights
+
+    loads = (0, 620, 1180, 1250, 0, 830, 0)
+    weighings_per_loop = 2
+    plateau_readings = 20
+    rows = {}
+    print(f"{'mode':<8} {'lignes':>7} {'pesées':>7} {'lignes/pesée':>13}")
+    for mode in ("plateau", "cycle"):
+        _temp_datastore()
+        weights.load()
+        settings.update({"weighing_mode": mode, "min_send_interval": 0.05}, persist=False)
+        stop = threading.Event()
+        scale = reader.ScaleReader(
+            stop, connect=simulator.PlateauScale(loads=loads, readings_per_plateau=plateau_readings), desktop="BENCH")
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            thread = threading.Thread(target=scale.run, daemon=True)
+            thread.start()
+            time.sleep(args.seconds)
+            stop.set()
+            scale.close()
+            thread.join()
+        # Nombre de boucles complètes du profil de charge pendant la mesure
+        loops = int(args.seconds / (len(loads) * plateau_readings * simulator.SimulatedSerial().frame_interval))
+        rows[mode] = len(datastore.get_historique_poids(limit=100000))
+        weighings = loops * weighings_per_loop
+        print(f"{mode:<8} {rows[mode]:>7} {weighings:>7} {rows[mode] / max(weighings, 1):>13.2f}")
+        if mode == "cycle":
+            cycles = datastore.get_cycles(limit=100000)
+            if len(cycles) < weighings - 1:
+                print(f"  ÉCHEC: {len(cycles)} pesées enregistrées pour {weighings} attendues")
+                return 1
+            peaks = sorted({c['valeur'] for c in cycles})
+            settle = sorted(c['duree_stabilisation_s'] for c in cycles)
+            print(f"  pics {peaks}, stabilisation médiane {settle[len(settle) // 2]:.2f}s")
+
+    ratio = rows["plateau"] / max(rows["cycle"], 1)
+    print(f"écritures divisées par {ratio:.1f}")
+    if ratio < args.min_ratio:
+        print(f"  ÉCHEC: réduction inférieure à {args.min_ratio}")
+        return 1
+    return 0
+
+
+def bench_analysis(args):
+    """
+    Analyse de dérive et de bruit sur --readings lectures synthétiques: zéro
+    qui dérive jusqu'à --offset kg, bruit gaussien --noise kg, charges de
+    800 kg. Sans NumPy, les lectures arrivent par tranches résumées à
+    chaque analyse, comme dans le service. Échoue si le décalage, sa dérive
+    ou le bruit ne sont pas retrouvés (et signalés), si la dernière analyse
+    dépasse --max-ms, ou si un thread qui simule le lecteur (une lecture par
+    milliseconde) est bloqué plus de --max-stall-ms.
+    """
+    import analysis
+    from config import settings
+
+    _temp_datastore()
+    settings.update({"stabilization_tolerance": 1.0, "cycle_empty_threshold": 5.0,
+                     "analysis_zero_limit": 1.0, "analysis_noise_limit": 0.5}, persist=False)
+    history = analysis.ReadingHistory(min(args.readings, analysis.HISTORY_READINGS))
+    analyzer = analysis.Analyzer(threading.Event(), source=history)
+    # Sans NumPy, l'anneau ne couvre que FALLBACK_READINGS: analyses intermédiaires
+    step = args.readings if analysis.np is not None else analysis.FALLBACK_READINGS // 2
+    rng = random.Random(1)
+    start_at = time.time() - args.readings / 870
+    for i in range(args.readings):
+        # 2000 lectures à vide, puis 1000 chargées
+        base = 800.0 if i % 3000 >= 2000 else args.offset * i / args.readings
+        history.record(base + rng.gauss(0, args.noise), start_at + i / 870)
+        if (i + 1) % step == 0 and i + 1 < args.readings:
+            analyzer.analyze()
+    expected_drift = args.offset * 870 * 3600 / args.readings
+
+    stalls = []
+    stop = threading.Event()
+
+    def fake_reader():
+        last = time.perf_counter()
+        while not stop.is_set():
+            time.sleep(0.001)
+            now = time.perf_counter()
+            stalls.append(now - last)
+            last = now
+
+    thread = threading.Thread(target=fake_reader, daemon=True)
+    thread.start()
+    time.sleep(0.05)
+    report = analyzer.analyze()
+    stop.set()
+    thread.join()
+    stall_ms = max(stalls) * 1000
+
+    print(f"moteur {report['engine']}, {report['readings']} lectures sur {report['span_h']} h "
+          f"analysées en {report['duration_ms']:.1f} ms")
+    print(f"zéro {report['zero_offset_kg']} kg (dérive {report['zero_drift_kg_per_h']} kg/h), "
+          f"bruit {report['noise_kg']} kg, blocage max du lecteur {stall_ms:.1f} ms")
+    for anomaly in report["anomalies"]:
+        print(f"  anomalie {anomaly['type']}: {anomaly['message']}")
+
+    failed = False
+    if report["zero_offset_kg"] is None or abs(report["zero_offset_kg"] - args.offset) > 0.5:
+        print(f"  ÉCHEC: décalage du zéro attendu vers {args.offset} kg")
+        failed = True
+    drift = report["zero_drift_kg_per_h"]
+    if drift is None or abs(drift - expected_drift) > abs(expected_drift) * 0.2 + 0.1:
+        print(f"  ÉCHEC: dérive attendue vers {expected_drift:.2f} kg/h")
+        failed = True
+    if report["noise_kg"] is None or abs(report["noise_kg"] - args.noise) > args.noise / 2:
+        print(f"  ÉCHEC: bruit attendu vers {args.noise} kg")
+        failed = True
+    expected = {"zero_offset"} if abs(args.offset) > 1.0 else set()
+    if args.noise > 0.5:
+        expected.add("noise")
+    if {a["type"] for a in report["anomalies"]} != expected:
+        print(f"  ÉCHEC: anomalies attendues {sorted(expected)}")
+        failed = True
+    if report["duration_ms"] > args.max_ms:
+        print(f"  ÉCHEC: analyse au-delà de {args.max_ms} ms")
+        failed = True
+    if stall_ms > args.max_stall_ms:
+        print(f"  ÉCHEC: lecteur bloqué au-delà de {args.max_stall_ms} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+# Écrivain tué pendant ses écritures: chaque ID affiché est commité
+_KILL_WRITER = """
+import sys, threading
+import datastore
+datastore.DB_PATH = sys.argv[1]
+datastore.set_durability(sys.argv[2])
+datastore.init_db()
+if datastore.uses_wal():
+    from core import ServiceCore
+    threading.Thread(target=ServiceCore().run_checkpoint_task, daemon=True).start()
+while True:
+    new_id = datastore.add_poids(1.0, "KILL", "BENCH")
+    print(f"ID {new_id}", flush=True)
+"""
+
+
+def bench_durability(args):
+    """
+    Pour chaque profil de durabilité: latence de --writes add_poids, puis un
+    écrivain tué (SIGKILL) après --kill-after secondes d'écritures. Échoue si
+    une écriture confirmée manque ou si la base n'est pas intègre après l'arrêt
+    brutal. La perte en cas de coupure de courant n'est pas simulable ici: la
+    fenêtre affichée est celle garantie par le profil.
+    """
+    import contextlib
+    import sqlite3
+    import datastore
+    from config import settings
+    from core import ServiceCore
+
+    failed = False
+    interval = settings.get('checkpoint_interval')
+    windows = {"strict": "aucune", "balanced": f"<= {interval}s (checkpoint)",
+               "relaxed": f"<= {interval}s, base endommageable"}
+    print(f"{'profil':<9} {'moy. ms':>8} {'p50 ms':>8} {'p99 ms':>8} {'tué: confirmées/présentes':>26}  "
+          f"perte sur coupure de courant")
+    for profile in datastore.DURABILITY_PROFILES:
+        datastore.set_durability(profile)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            _temp_datastore()
+            service = ServiceCore()
+            checkpointer = None
+            if datastore.uses_wal():
+                checkpointer = threading.Thread(target=service.run_checkpoint_task, daemon=True)
+                checkpointer.start()
+                time.sleep(0.1)
+            latencies = []
+            for i in range(args.writes):
+                start = time.perf_counter()
+                datastore.add_poids(float(i), "BENCH", "BENCH")
+                latencies.append((time.perf_counter() - start) * 1000)
+            service.stop_event.set()
+            if checkpointer:
+                checkpointer.join()
+        latencies.sort()
+
+        db_path = datastore.DB_PATH + ".kill"
+        writer = subprocess.Popen([sys.executable, "-c", _KILL_WRITER, db_path, profile],
+                                  cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        acknowledged = 0
+        deadline = None
+        for line in writer.stdout:
+            if line.startswith("ID "):
+                acknowledged = int(line.split()[1])
+                deadline = deadline or time.time() + args.kill_after
+                if time.time() >= deadline:
+                    writer.kill()
+                    break
+        writer.wait()
+        conn = sqlite3.connect(db_path)
+        integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        present = conn.execute("SELECT COALESCE(MAX(id), 0) FROM poids").fetchone()[0]
+        conn.close()
+
+        print(f"{profile:<9} {sum(latencies) / len(latencies):>8.3f} {latencies[len(latencies) // 2]:>8.3f} "
+              f"{latencies[int(len(latencies) * 0.99)]:>8.3f} {acknowledged:>13}/{present:<12}  {windows[profile]}")
+        if present < acknowledged or integrity != "ok":
+            print(f"  ÉCHEC: {acknowledged - present} écriture(s) confirmée(s) perdue(s), intégrité {integrity}")
+            failed = True
+    return 1 if failed else 0
+
+
+def bench_client(args):
+    """
+    Client de l'API (client.py) contre le serveur HTTP du service: latence
+    avec et sans connexions réutilisées, puis chaque méthode (sync et
+    asyncio), les nouvelles tentatives sur 429 et l'envoi par lots (nombre
+    de requêtes POST pour une série de poids).
+    Échoue si un résultat est faux.
+    """
+    import asyncio
+    import contextlib
+    import logging
+    import requests
+    import api
+    import client
+    import metrics
+    import storage
+    from config import settings
+    from state import weights
+
+    # Une ligne de journal par requête noierait les résultats
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        _temp_datastore()
+    weights.load()
+    server = api.create_server('127.0.0.1', 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    failures = []
+
+    def check(name, condition):
+        print(f"  {'ok   ' if condition else 'ÉCHEC'} {name}")
+        if not condition:
+            failures.append(name)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), \
+            client.Client(url, desktop="CLIENT", company="BENCH", attempts=6) as odm:
+        odm.post(1.0)
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            requests.get(url + "/api/poids", timeout=5)
+        single = (time.perf_counter() - start) * 1000 / args.requests
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            odm.latest()
+        pooled = (time.perf_counter() - start) * 1000 / args.requests
+
+        first = odm.post(10.0, key="bench-key")
+        replay = odm.post(10.0, key="bench-key")
+        # Série de MAX_BATCH postes différents, limites par défaut: un seul jeton
+        stations = odm._request('POST', '/api/poids/batch', attempts=1, json=[
+            {"poids": 5.0, "desktop": f"POSTE{i}", "company": "BENCH"} for i in range(api.MAX_BATCH)]).json()["results"]
+        batch_keys = [f"bench-batch-{i}" for i in range(3)]
+        batch_first = odm.post_batch([20.0, 21.0, 22.0], keys=batch_keys)
+        batch_replay = odm.post_batch([20.0, 21.0, 22.0], keys=batch_keys)
+
+        # Requêtes POST envoyées (nouvelles tentatives comprises)
+        posts = []
+        send = odm.session.request
+
+        def counted(method, *a, **kw):
+            if method == 'POST':
+                posts.append(method)
+            return send(method, *a, **kw)
+        odm.session.request = counted
+        settings.update({"api_write_rate": 1.0, "api_write_burst": 1}, persist=False)
+        metrics_before = metrics.get_counter('api_rate_limited')
+        many = odm.post_many([float(i) for i in range(600)])
+        limited = metrics.get_counter('api_rate_limited') - metrics_before
+        many_posts = len(posts) - limited
+        settings.update({"api_write_rate": 0.0}, persist=False)
+        del posts[:]
+        with odm.batcher(max_size=10, max_delay=0.05) as batch:
+            for i in range(25):
+                batch.add(100.0 + i)
+        batch_posts = len(posts)
+        odm.session.request = send
+        history = list(odm.history(desktop="CLIENT", page_size=7))
+        latest = odm.latest(desktop="CLIENT")
+        try:
+            odm.post(11.0, key="bench-key")
+            conflict = None
+        except client.ApiError as e:
+            conflict = e.status
+
+        stop = threading.Event()
+
+        def scale():
+            for value in (0, 0, 500, 500, 500, 0):
+                weights.set_live(value, True)
+                time.sleep(0.1)
+            stop.set()
+        threading.Thread(target=scale, daemon=True).start()
+        streamed = [r['poids'] for r in odm.stream(interval=0.02, stop_event=stop)]
+
+        async def run_async():
+            async with client.AsyncClient(url, desktop="ASYNC") as aodm:
+                posted = await aodm.post_many([1.0, 2.0, 3.0, 4.0])
+                records = [r async for r in aodm.history(desktop="ASYNC", page_size=3)]
+                return posted, records, await aodm.latest(desktop="ASYNC")
+        posted, async_history, async_latest = asyncio.run(run_async())
+
+    # Nettoyage (comme ServiceCore.run_cleanup_task): la clé du poids supprimé est oubliée
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), \
+            client.Client(url, desktop="CLIENT", company="BENCH") as odm:
+        storage.backend.cleanup(10)
+        weights.load()
+        weights.forget_keys(storage.backend.oldest_id())
+        after_cleanup = odm.post(10.0, key="bench-key")
+
+    start = time.perf_counter()
+    try:
+        client.Client("http://127.0.0.1:9", attempts=3, backoff=0.05).latest()
+        unreachable = None
+    except client.ApiError as e:
+        unreachable = e
+    unreachable_ms = (time.perf_counter() - start) * 1000
+    server.shutdown()
+
+    print(f"GET /api/poids: {single:.2f} ms par requête sans pool, {pooled:.2f} ms avec le client")
+    check("idempotence: rejeu signalé, une seule ligne", not first["replayed"] and replay["replayed"])
+    check("lot: une clé par poids, rejeu signalé sans nouvelle ligne",
+          not any(r["replayed"] for r in batch_first) and all(r["replayed"] for r in batch_replay)
+          and [r["id"] for r in batch_first] == [r["id"] for r in batch_replay])
+    check(f"lot de {api.MAX_BATCH} postes accepté avec les limites par défaut",
+          len(stations) == api.MAX_BATCH and not any(r["replayed"] for r in stations))
+    check(f"post_many: 600 poids en {many_posts} requêtes malgré {limited} refus 429",
+          len(many) == 600 and many_posts == 6 and limited > 0)
+    check(f"regroupement: 25 poids envoyés en {batch_posts} requêtes",
+          batch.sent == 25 and not batch.errors and batch_posts == 3)
+    check(f"historique paginé: {len(history)} enregistrements", len(history) == 1 + 1 + 3 + 600 + 25
+          and [r['id'] for r in history] == sorted((r['id'] for r in history), reverse=True))
+    check("dernier poids", latest and latest['id'] == history[0]['id'])
+    check(f"clé réutilisée pour un autre poids: {conflict}", conflict == 422)
+    check("clé d'un poids supprimé par le nettoyage: nouvel enregistrement", not after_cleanup["replayed"])
+    check(f"flux en direct: {streamed}", streamed == [0, 500, 0])
+    check("asyncio: post_many, historique, dernier poids",
+          len(posted) == 4 and len(async_history) == 4 and async_latest['valeur'] in (1.0, 2.0, 3.0, 4.0))
+    check(f"service injoignable: ApiError après 3 tentatives ({unreachable_ms:.0f} ms)",
+          unreachable is not None and unreachable.status is None)
+    return 1 if failures else 0
+
+
+def _conformance(engine):
+    """Comportement commun attendu de tout moteur de stockage. Retourne la liste des écarts."""
+    import datastore
+
+    errors = []
+
+    def expect(name, condition):
+        if not condition:
+            errors.append(name)
+
+    expect("stockage vide", engine.latest() is None and engine.history() == [] and engine.cycles() == []
+           and engine.oldest_id() is None)
+    expect("poids négatif refusé", engine.add(-1, "A", "X") is None)
+    first = engine.add(10.0, "A", "X", 1000)
+    second = engine.add(20.0, "B", "X", 3000)
+    third = engine.add(30.0, "A", "Y", 2000)
+    expect("ID croissants", first < second < third)
+    expect("dernier: date la plus récente", engine.latest()["id"] == second)
+    expect("dernier filtré par poste", engine.latest(desktop="A")["id"] == third)
+    expect("dernier filtré par poste et société", engine.latest("A", "X")["valeur"] == 10.0)
+    expect("dernier: poste inconnu", engine.latest(desktop="Z") is None)
+    expect("date ISO", engine.latest("A", "X")["date"] == "1970-01-01T00:00:01.000")
+    expect("un dernier par poste", sorted(r["id"] for r in engine.latest_per_station()) == [first, second, third])
+
+    record, created = engine.add_idempotent(40.0, "A", "X", "cle-1", 4000)
+    replay, replayed = engine.add_idempotent(99.0, "A", "X", "cle-1", 5000)
+    expect("idempotence", created and not replayed and replay == record and record["valeur"] == 40.0)
+    cycle = engine.add_cycle(50.0, "C", "X", 5000, 6500, 9000)
+    cycles = engine.cycles()
+    expect("pesée complète", len(cycles) == 1 and cycles[0]["id"] == cycle
+           and cycles[0]["duree_stabilisation_s"] == 1.5 and cycles[0]["fin"] == "1970-01-01T00:00:09.000")
+
+    ids = [r["id"] for r in engine.history()]
+    expect("historique du plus récent au plus ancien", ids == sorted(ids, reverse=True) and len(ids) == 5)
+    expect("historique paginé", [r["id"] for r in engine.history(limit=2, before_id=ids[1])] == ids[2:4])
+    expect("historique filtré", [r["id"] for r in engine.history(company="Y")] == [third])
+
+    expect("nettoyage: nombre supprimé", engine.cleanup(2) == 3)
+    expect("nettoyage: les plus récents restent", [r["id"] for r in engine.history()] == ids[:2])
+    expect("nettoyage: clé de la ligne supprimée oubliée",
+           engine.add_idempotent(41.0, "A", "X", "cle-1", 7000)[1] if record["id"] not in ids[:2] else True)
+    expect("ID jamais réattribués", engine.add(1.0, "A", "X") > cycle)
+
+    count = len(engine.history())
+    expect("lot: un poids invalide, rien d'enregistré",
+           engine.add_batch([(2.0, "A", "X", "lot-1"), (-1, "A", "X", None)], 8000) is None
+           and len(engine.history()) == count)
+    batch = engine.add_batch([(2.0, "A", "X", "lot-1"), (3.0, "B", "X", None), (2.0, "A", "X", "lot-1")], 8000)
+    replay = engine.add_batch([(2.0, "A", "X", "lot-1")], 9000)
+    expect("lot: ordre, ID croissants, clé répétée dans le lot",
+           [created for _, created in batch] == [True, True, False] and batch[0][0]["id"] < batch[1][0]["id"]
+           and batch[2][0] == batch[0][0] and len(engine.history()) == count + 2)
+    expect("lot: clé déjà enregistrée", replay == [(batch[0][0], False)])
+    try:
+        engine.add_batch([(6.0, "A", "X", "lot-2"), (9.0, "A", "X", "lot-1")], 9000)
+        conflict = False
+    except datastore.IdempotencyConflict:
+        conflict = True
+    expect("lot: clé réutilisée pour un autre poids refusée, rien d'enregistré",
+           conflict and len(engine.history()) == count + 2)
+    expect("plus ancien ID", engine.oldest_id() == min(r["id"] for r in engine.history(limit=1000)))
+    expect("nettoyage sans effet", engine.cleanup(1000) == 0)
+    engine.ping()
+    return errors
+
+
+def bench_storage(args):
+    """
+    Vérifie chaque moteur de stockage (storage.py) avec les mêmes contrôles,
+    puis compare leurs latences: écriture, dernier poids, parcours de
+    l'historique, nettoyage. Pour le journal, vérifie aussi la relecture,
+    l'abandon d'une entrée tronquée et les erreurs d'écriture et de
+    compaction. Échoue sur le moindre écart.
+    """
+    import contextlib
+    import datastore
+    import storage
+
+    def engines():
+        directory = tempfile.mkdtemp(prefix="odm-bench-")
+        datastore.DB_PATH = os.path.join(directory, "poids.db")
+        return {"sqlite": storage.SQLiteStorage(), "memory": storage.MemoryStorage(),
+                "log": storage.LogStorage(os.path.join(directory, "poids.log"))}
+
+    failed = False
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for name, engine in engines().items():
+            engine.open()
+            errors = _conformance(engine)
+            if name == "log":
+                engine.close()
+                reopened = storage.LogStorage(engine.path)
+                reopened.open()
+                if reopened.history() != engine.history() or reopened.latest() != engine.latest():
+                    errors.append("relecture du journal")
+                reopened.close()
+                with open(engine.path, 'ab') as f:
+                    f.write(storage.LOG_HEADER.pack(storage.LOG_POIDS, 100, 0) + b'tronq')
+                size = os.path.getsize(engine.path)
+                reopened.open()
+                if reopened.history() != engine.history() or os.path.getsize(engine.path) != size - storage.LOG_HEADER.size - 5:
+                    errors.append("entrée tronquée en fin de journal")
+                # Erreurs d'écriture: None, mémoire et journal inchangés
+                before = reopened.history()
+                if (reopened.add(1.0, "A" * (storage.MAX_NAME_LENGTH + 1), "X") is not None
+                        or reopened.add(1.0, 5, "X") is not None
+                        or reopened.add_idempotent(1.0, "A", "X", "\ud800") != (None, False)):
+                    errors.append("poste ou clé invalide refusé")
+                file, broken = reopened._file, open(engine.path, 'rb')
+                reopened._file = broken  # Écriture impossible (OSError): journal fermé par le moteur
+                if reopened.add(1.0, "A", "X") is not None or reopened.add_cycle(1.0, "A", "X", 1, 2, 3) is not None:
+                    errors.append("erreur d'écriture: None")
+                broken.close()
+                reopened._file = file
+                if reopened.history() != before or os.path.getsize(engine.path) != size - storage.LOG_HEADER.size - 5:
+                    errors.append("erreur d'écriture: mémoire et journal inchangés")
+                # Compaction impossible (fichier verrouillé sous Windows): rien ne change
+                replace = storage.os.replace
+
+                def locked(*a):
+                    raise PermissionError("fichier verrouillé")
+                storage.os.replace = locked
+                try:
+                    compacted = reopened.cleanup(1)
+                finally:
+                    storage.os.replace = replace
+                if (compacted != 0 or reopened.history() != before or os.path.exists(engine.path + '.partial')
+                        or os.path.getsize(engine.path) != size - storage.LOG_HEADER.size - 5):
+                    errors.append("compaction impossible: mémoire et journal inchangés")
+                if reopened.add(2.0, "A", "X") is None or reopened.cleanup(1) != len(before):
+                    errors.append("compaction impossible: écritures et nettoyage possibles ensuite")
+                reopened.close()
+            print(f"{name:<7} conformité: {'ok' if not errors else 'ÉCARTS ' + ', '.join(errors)}", file=sys.stderr)
+            failed = failed or bool(errors)
+
+        rows = []
+        for name, engine in engines().items():
+            engine.open()
+            start = time.perf_counter()
+            for i in range(args.writes):
+                engine.add(float(i), f"P{i % 20}", "BENCH")
+            write_us = (time.perf_counter() - start) * 1e6 / args.writes
+            start = time.perf_counter()
+            for i in range(1000):
+                engine.latest(f"P{i % 20}", "BENCH")
+            latest_us = (time.perf_counter() - start) * 1e3
+            start = time.perf_counter()
+            before, scanned = None, 0
+            while True:
+                page = engine.history(limit=1000, before_id=before)
+                scanned += len(page)
+                if len(page) < 1000:
+                    break
+                before = page[-1]["id"]
+            scan_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            engine.cleanup(args.writes // 2)
+            cleanup_ms = (time.perf_counter() - start) * 1000
+            engine.close()
+            rows.append((name, write_us, latest_us, scanned, scan_ms, cleanup_ms))
+
+    print(f"{'moteur':<7} {'écriture µs':>12} {'dernier µs':>11} {'parcours':>18} {'nettoyage ms':>13}")
+    for name, write_us, latest_us, scanned, scan_ms, cleanup_ms in rows:
+        print(f"{name:<7} {write_us:>12.1f} {latest_us:>11.1f} {scanned:>7} en {scan_ms:>6.1f} ms {cleanup_ms:>13.1f}")
+    return 1 if failed else 0
+
+
+def bench_lifecycle(args):
+    """
+    Cycles arrêt/redémarrage du service complet (base, API, lecteur simulé,
+    threads d'arrière-plan) dans le même processus, sous un flot de POST:
+    délai du démarrage à la première trame et de stop() au retour de run().
+    Échoue au-delà des seuils, si une étape d'arrêt est abandonnée ou si un
+    POST confirmé manque dans le stockage après l'arrêt. Vérifie enfin que
+    l'arrêt reste borné quand toutes les places du serveur HTTP sont prises
+    par des connexions muettes.
+    """
+    import contextlib
+    import socket
+    import api
+    import logging
+    import metrics
+    import simulator
+    import storage
+    from config import settings
+    from core import ServiceCore
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    # Pas de limitation des POST: le flot doit durer jusqu'à l'arrêt
+    limits = {name: settings.get(name) for name in ("api_write_rate", "api_write_burst", "reader_process")}
+    settings.update({"api_write_rate": 10000.0, "api_write_burst": 100000}, persist=False)
+    failed = False
+    print(f"{'mode':<9} {'cycle':>5} {'1re trame ms':>13} {'arrêt ms':>9} {'POST confirmés/présents':>24}")
+    for mode in ("thread", "process"):
+        settings.update({"reader_process": mode == "process"}, persist=False)
+        frames, stops = [], []
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            _temp_datastore()
+            for cycle in range(args.cycles):
+                # Le processus d'acquisition exige une fonction 'connect' sérialisable
+                connect = (simulator.PlateauScale(port="SIM0") if mode == "process"
+                           else simulator.connect_factory(weights=simulator.plateau_weights(), port="SIM0"))
+                timeouts = metrics.get_counter('shutdown_timeouts')
+                start = time.perf_counter()
+                service = ServiceCore(connect=connect, http_host='127.0.0.1', http_port=0)
+                runner = threading.Thread(target=service.run, daemon=True)
+                runner.start()
+                while ((service.reader is None or service.reader.last_frame_at is None)
+                       and time.perf_counter() - start < 10):
+                    time.sleep(0.001)
+                frame_ms = (time.perf_counter() - start) * 1000
+                service.http_ready.wait(10)
+
+                # Des POST sont en cours au moment de l'arrêt
+                url = f"http://127.0.0.1:{service.http_server.server_port}/api/poids"
+                confirmed = []
+                posting = threading.Event()
+
+                def post():
+                    while not posting.is_set():
+                        body = f'{{"poids": 42.0, "desktop": "LIFECYCLE{cycle}"}}'.encode()
+                        request = urllib.request.Request(url, body, {"Content-Type": "application/json"})
+                        try:
+                            with urllib.request.urlopen(request, timeout=2) as response:
+                                if response.status == 200:
+                                    confirmed.append(1)
+                        except OSError:
+                            return
+                posters = [threading.Thread(target=post, daemon=True) for _ in range(4)]
+                for poster in posters:
+                    poster.start()
+                time.sleep(0.2)
+
+                start = time.perf_counter()
+                service.stop()
+                runner.join(10)
+                stop_ms = (time.perf_counter() - start) * 1000
+                posting.set()
+                for poster in posters:
+                    poster.join()
+
+                storage.backend.open()
+                present = len(storage.backend.history(desktop=f"LIFECYCLE{cycle}", limit=100000))
+                storage.backend.close()
+                print(f"{mode:<9} {cycle:>5} {frame_ms:>13.1f} {stop_ms:>9.1f} {len(confirmed):>11}/{present:<12}",
+                      file=sys.stderr)
+                frames.append(frame_ms)
+                stops.append(stop_ms)
+                if runner.is_alive() or metrics.get_counter('shutdown_timeouts') > timeouts:
+                    print("  ÉCHEC: arrêt incomplet (étape abandonnée)", file=sys.stderr)
+                    failed = True
+                if present < len(confirmed):
+                    print(f"  ÉCHEC: {len(confirmed) - present} POST confirmé(s) perdu(s)", file=sys.stderr)
+                    failed = True
+        if max(frames) > args.max_frame_ms:
+            print(f"  ÉCHEC ({mode}): première trame au-delà de {args.max_frame_ms} ms")
+            failed = True
+        if max(stops) > args.max_stop_ms:
+            print(f"  ÉCHEC ({mode}): arrêt au-delà de {args.max_stop_ms} ms")
+            failed = True
+
+    # Serveur saturé: serve_forever attend une place quand stop() arrive
+    settings.update({"reader_process": False}, persist=False)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        _temp_datastore()
+        service = ServiceCore(connect=simulator.connect_factory(weights=simulator.plateau_weights(), port="SIM0"),
+                              http_host='127.0.0.1', http_port=0)
+        runner = threading.Thread(target=service.run, daemon=True)
+        runner.start()
+        service.http_ready.wait(10)
+        address = ('127.0.0.1', service.http_server.server_port)
+        idle = [socket.create_connection(address, timeout=2) for _ in range(api.MAX_CONCURRENT_REQUESTS + 1)]
+        deadline = time.monotonic() + 5
+        while service.http_server.active_threads < api.MAX_CONCURRENT_REQUESTS and time.monotonic() < deadline:
+            time.sleep(0.01)
+        try:
+            busy = idle[-1].recv(64).startswith(b"HTTP/1.1 503")
+        except OSError:
+            busy = False
+        start = time.perf_counter()
+        service.stop()
+        runner.join(10)
+        stop_ms = (time.perf_counter() - start) * 1000
+        for connection in idle:
+            connection.close()
+    print(f"serveur saturé: arrêt en {stop_ms:.1f} ms, connexion en trop {'refusée (503)' if busy else 'sans réponse'}",
+          file=sys.stderr)
+    if runner.is_alive() or stop_ms > args.max_stop_ms or not busy:
+        print("  ÉCHEC: arrêt non borné ou connexion en trop sans réponse 503", file=sys.stderr)
+        failed = True
+    settings.update(limits, persist=False)
+    return 1 if failed else 0
+
+
+def bench_hotplug(args):
+    """
+    Balance USB branchée, débranchée puis rebranchée sur un autre port, à côté
+    de deux ports muets, avec la recherche du lecteur (reader.ScaleLocator)
+    sur un inventaire de ports simulé: ports ouverts pendant l'absence de la
+    balance, délai du branchement à la connexion, reconnexion après un
+    redémarrage du watchdog, puis balance sur l'un de deux adaptateurs
+    identiques sans numéro de série. Échoue si un port muet est ouvert alors
+    que la balance connue est présente, ou au-delà de --max-reconnect-ms.
+    """
+    import contextlib
+    import metrics
+    import reader
+    import simulator
+
+    identity = {"vid": 0x067B, "pid": 0x2303, "serial_number": "BENCH1"}
+    ports = {
+        "COM1": simulator.SimulatedPortInfo("COM1"),
+        "COM3": simulator.SimulatedPortInfo("COM3", vid=0x0403, pid=0x6001, serial_number="OTHER"),
+    }
+    twin = {"vid": 0x1A86, "pid": 0x7523, "serial_number": None}  # CH340: pas de numéro de série
+    opened = []
+    scales = []
+    scale_ports = set()
+
+    def open_port(device, timeout):
+        opened.append(device)
+        ser = simulator.SimulatedSerial(port=device, timeout=timeout, weights=simulator.plateau_weights())
+        if device in scale_ports:
+            scales.append(ser)
+        else:
+            ser.stalled = True  # Port d'un autre appareil: rien n'arrive
+        return ser
+
+    def connected_after(moment):
+        deadline = time.perf_counter() + 10
+        while time.perf_counter() < deadline:
+            if scale.status == "connected" and (scale.connected_at or 0) >= moment:
+                return (time.time() - moment) * 1000
+            time.sleep(0.001)
+        return None
+
+    failed = False
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        _temp_datastore()
+        stop = threading.Event()
+        locator = reader.ScaleLocator(list_ports=lambda: list(ports.values()), open_port=open_port)
+        scale = reader.ScaleReader(stop, connect=locator, desktop="HOTPLUG")
+        threading.Thread(target=scale.run, daemon=True).start()
+
+        # Balance absente: seuls les tests complets espacés ouvrent les ports
+        time.sleep(args.absent)
+        absent_opens = len(opened)
+
+        results = []
+        for label, device, action in (("branchement", "COM5", None), ("rebranchement", "COM6", "unplug"),
+                                      ("watchdog", "COM6", "restart"), ("jumeaux", "COM7", "twins")):
+            if action in ("unplug", "twins"):
+                unplugged = "COM5" if action == "unplug" else "COM6"
+                del ports[unplugged]
+                scale_ports.discard(unplugged)
+                scales[-1].close()  # Lecture en erreur, comme un adaptateur USB retiré
+                time.sleep(1.0)
+            elif action == "restart":
+                time.sleep(0.2)
+            before = len(opened)
+            moment = time.time()
+            if action == "restart":
+                scale.restart()
+            elif action == "twins":
+                # Même VID/PID, sans numéro de série: la balance est sur le premier
+                scale_ports.add(device)
+                ports[device] = simulator.SimulatedPortInfo(device, **twin)
+                ports["COM8"] = simulator.SimulatedPortInfo("COM8", **twin)
+            else:
+                scale_ports.add(device)
+                ports[device] = simulator.SimulatedPortInfo(device, **identity)
+            latency = connected_after(moment)
+            results.append((label, device, latency, opened[before:]))
+        stop.set()
+        scale.close()
+
+    print(f"Balance absente {args.absent:.0f}s: {absent_opens} ouverture(s) de port "
+          f"(recherche à intervalle fixe de 10s: un test de chaque port toutes les 10s)")
+    for label, device, latency, tested in results:
+        shown = "non reconnectée" if latency is None else f"{latency:.0f} ms"
+        print(f"{label:<14} {device}: {shown:>16}, ports testés {tested}")
+        # Au premier branchement, le test d'un port muet peut être en cours;
+        # la balance sur un adaptateur jumeau n'est pas la balance connue
+        unknown = label in ("branchement", "jumeaux")
+        limit = args.max_reconnect_ms + (reader.PROBE_TIMEOUT * 1000 if unknown else 0)
+        if latency is None or latency > limit:
+            print(f"  ÉCHEC: connexion au-delà de {limit:.0f} ms")
+            failed = True
+        if not unknown and any(port != device for port in tested):
+            print("  ÉCHEC: ports muets testés alors que la balance était présente")
+            failed = True
+    timing = metrics.snapshot()["timings"].get('reconnect_ms', {})
+    print(f"reconnect_ms (perte -> reconnexion): {metrics.get_counter('reader_reconnects')} reconnexion(s), "
+          f"max {timing.get('max', 0):.0f} ms")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks OdmService")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("protocols", help="débit du décodage des trames")
+    p.add_argument("--frames", type=int, default=100000)
+    p.add_argument("--chunk", type=int, default=64, help="taille des lectures simulées (octets)")
+    p.add_argument("--min-fps", type=int, default=50000, help="débit minimal accepté par protocole")
+    p.set_defaults(func=bench_protocols)
+
+    p = sub.add_parser("startup", help="temps de démarrage (imports, premier HTTP 200, première trame)")
+    p.add_argument("--max-http-ms", type=float, default=2000)
+    p.add_argument("--max-frame-ms", type=float, default=1000)
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser("memory", help="stabilité mémoire sous un flot de données invalides")
+    p.add_argument("--seconds", type=float, default=4, help="durée du flot par protocole")
+    p.add_argument("--posts", type=int, default=3000, help="nombre de POST après la chauffe")
+    p.add_argument("--max-growth-kb", type=float, default=256)
+    p.set_defaults(func=bench_memory)
+
+    p = sub.add_parser("cycles", help="volume d'écriture: un enregistrement par palier ou par pesée")
+    p.add_argument("--seconds", type=float, default=6, help="durée de la mesure par mode")
+    p.add_argument("--min-ratio", type=float, default=2.0)
+    p.set_defaults(func=bench_cycles)
+
+    p = sub.add_parser("analysis", help="analyse de dérive et de bruit sur l'historique des lectures")
+    p.add_argument("--readings", type=int, default=1 << 20)
+    p.add_argument("--offset", type=float, default=2.5, help="décalage final du zéro (kg)")
+    p.add_argument("--noise", type=float, default=0.2, help="écart type du bruit (kg)")
+    p.add_argument("--max-ms", type=float, default=2000)
+    p.add_argument("--max-stall-ms", type=float, default=50)
+    p.set_defaults(func=bench_analysis)
+
+    p = sub.add_parser("durability", help="latence d'écriture et pertes par profil de durabilité")
+    p.add_argument("--writes", type=int, default=500)
+    p.add_argument("--kill-after", type=float, default=1.0, help="durée d'écriture avant SIGKILL (secondes)")
+    p.set_defaults(func=bench_durability)
+
+    p = sub.add_parser("client", help="client de l'API: connexions réutilisées, tentatives, regroupement")
+    p.add_argument("--requests", type=int, default=300)
+    p.set_defaults(func=bench_client)
+
+    p = sub.add_parser("storage", help="conformité et performances des moteurs de stockage")
+    p.add_argument("--writes", type=int, default=5000)
+    p.set_defaults(func=bench_storage)
+
+    p = sub.add_parser("lifecycle", help="arrêt et redémarrage du service complet")
+    p.add_argument("--cycles", type=int, default=5)
+    p.add_argument("--max-stop-ms", type=float, default=1000)
+    p.add_argument("--max-frame-ms", type=float, default=1000)
+    p.set_defaults(func=bench_lifecycle)
+
+    p = sub.add_parser("hotplug", help="reconnexion de la balance au débranchement et au rebranchement")
+    p.add_argument("--absent", type=float, default=8, help="durée d'absence initiale de la balance (secondes)")
+    p.add_argument("--max-reconnect-ms", type=float, default=1000)
+    p.set_defaults(func=bench_hotplug)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,10 @@
-param([string]$pythonVersion = "310")
+param(
+    [string]$pythonVersion = "310",
+    # onedir: exécutable + dépendances déjà extraites (démarrage rapide, recommandé)
+    # onefile: exécutable unique, décompressé dans un dossier temporaire à chaque démarrage
+    [ValidateSet("onedir", "onefile")]
+    [string]$layout = "onedir"
+)
 
 # Crée un environnement virtuel
 python -m venv .venv
@@ -13,16 +19,22 @@ $dllFiles = Get-ChildItem -Path $pywin32Path -Filter "*.dll" | Select-Object -Ex
 
 # Construit le tableau d'arguments
 $pyInstallerArgs = @(
-    "--onefile",
+    "--$layout",
     "--name=OdmService",
     "--hidden-import=win32timezone",
     "--hidden-import=servicemanager",
     "--hidden-import=logging.handlers",
     "--hidden-import=flask",
     "--hidden-import=flask_cors",
-    "--runtime-tmpdir=.",
+    # api et reader sont importés à la demande après le démarrage du service
+    "--hidden-import=api",
+    "--hidden-import=reader",
+    "--hidden-import=acquisition",
     "--icon=NONE"
 )
+if ($layout -eq "onefile") {
+    $pyInstallerArgs += "--runtime-tmpdir=."
+}
 
 # Ajoute les DLLs au format correct
 foreach ($dll in $dllFiles) {
@@ -40,12 +52,18 @@ $pyInstallerArgs | ForEach-Object { Write-Host "  $_" }
 pyinstaller @pyInstallerArgs
 
 # Vérifie la création de l'exécutable
-$exePath = ".\dist\OdmService.exe"
+if ($layout -eq "onedir") {
+    $exePath = ".\dist\OdmService\OdmService.exe"
+    $distContent = ".\dist\OdmService\*"
+} else {
+    $exePath = ".\dist\OdmService.exe"
+    $distContent = $exePath
+}
 if (Test-Path $exePath) {
     # Crée le package de déploiement
     $deployDir = "OdmService_Deploy"
     New-Item -ItemType Directory -Path $deployDir -Force
-    Copy-Item -Path $exePath -Destination $deployDir
+    Copy-Item -Path $distContent -Destination $deployDir -Recurse -Force
     Copy-Item -Path ".\install_service.ps1" -Destination $deployDir
     Copy-Item -Path ".\uninstall_service.ps1" -Destination $deployDir
 
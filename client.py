@@ -0,0 +1,344 @@
+"""
+Client Python de l'API locale OdmService (http://localhost:5000).
+
+    from client import Client
+
+    with Client(desktop="POSTE-1") as odm:
+        odm.post(1250.0)
+        print(odm.latest())
+        for record in odm.history():
+            ...
+        for reading in odm.stream():
+            ...
+
+AsyncClient offre les mêmes méthodes pour asyncio.
+"""
+import asyncio
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- Client de l'API ---
+# Une session requests garde les connexions ouvertes (keep-alive) dans un pool
+# de pool_size connexions, partagé par les threads de l'appelant, quand le
+# serveur le permet (le serveur Werkzeug du service ferme chaque connexion:
+# le pool borne alors le nombre de requêtes simultanées). Une erreur
+# réseau, un 5xx ou un 429 provoque une nouvelle tentative après un délai
+# exponentiel tiré au hasard (ou le Retry-After du serveur): plusieurs
+# clients refusés en même temps ne reviennent pas ensemble. Chaque poids porte
+# une clé d'idempotence, réutilisée par ses nouvelles tentatives: un poids
+# n'est jamais enregistré deux fois. Les séries (post_many, Batcher) partent
+# par POST /api/poids/batch: une requête et une transaction pour BATCH_SIZE
+# poids au plus.
+
+BASE_URL = "http://localhost:5000"
+TIMEOUT = 5  # Secondes, par tentative
+ATTEMPTS = 3
+BACKOFF = 0.2  # Délai de base entre deux tentatives (secondes), doublé à chaque échec
+MAX_BACKOFF = 5.0
+POOL_SIZE = 4
+BATCH_SIZE = 100  # Poids par requête POST /api/poids/batch (au plus api.MAX_BATCH)
+PAGE_SIZE = 100  # Enregistrements par page d'historique (au plus 1000, voir api.MAX_HISTORY)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class ApiError(Exception):
+    """Échec d'un appel après ses tentatives. 'status' est None si le service n'a pas répondu."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class Client:
+    """
+    'desktop' et 'company' sont envoyés avec chaque poids (défaut: ceux du
+    service). Utilisable depuis plusieurs threads.
+    """
+
+    def __init__(self, base_url=BASE_URL, desktop=None, company=None, timeout=TIMEOUT,
+                 attempts=ATTEMPTS, backoff=BACKOFF, pool_size=POOL_SIZE):
+        self.base_url = base_url.rstrip('/')
+        self.desktop = desktop
+        self.company = company
+        self.timeout = timeout
+        self.attempts = attempts
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def _delay(self, attempt, response):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), MAX_BACKOFF) * random.uniform(1.0, 1.2)
+        return random.uniform(0, min(self.backoff * 2 ** attempt, MAX_BACKOFF))
+
+    def _request(self, method, path, ok=(200,), attempts=None, **kwargs):
+        """Envoie la requête, avec nouvelles tentatives. Retourne la réponse si son statut est dans 'ok'."""
+        attempts = attempts or self.attempts
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(attempts):
+            response = None
+            try:
+                response = self.session.request(method, self.base_url + path, **kwargs)
+                if response.status_code in ok:
+                    return response
+                if response.status_code not in RETRY_STATUSES:
+                    break
+                error = ApiError(_message(response), response.status_code)
+            except requests.RequestException as e:
+                error = ApiError(f"Service injoignable: {e}")
+            if attempt + 1 < attempts:
+                time.sleep(self._delay(attempt, response))
+        else:
+            raise error
+        raise ApiError(_message(response), response.status_code)
+
+    def _params(self, desktop, company, **params):
+        params.update(desktop=desktop, company=company)
+        return {name: value for name, value in params.items() if value is not None}
+
+    def health(self):
+        """(sain, rapport de /api/health), sans nouvelle tentative."""
+        response = self._request('GET', '/api/health', ok=(200, 503), attempts=1)
+        return response.status_code == 200, response.json()
+
+    def latest(self, desktop=None, company=None):
+        """Dernier poids enregistré (filtré par poste et société), ou None."""
+        response = self._request('GET', '/api/poids', ok=(200, 404), params=self._params(desktop, company))
+        return response.json() if response.status_code == 200 else None
+
+    def live(self):
+        """Dernière lecture de la balance ({'poids', 'stable', 'age_s'}), ou None."""
+        response = self._request('GET', '/api/poids/live', ok=(200, 404))
+        return response.json() if response.status_code == 200 else None
+
+    def post(self, weight, desktop=None, company=None, key=None):
+        """
+        Enregistre un poids. 'key' (clé d'idempotence) est générée si elle
+        n'est pas fournie. Retourne la réponse de l'API, avec 'replayed' à
+        True si le poids avait déjà été enregistré sous cette clé.
+        """
+        body = {"poids": weight}
+        body.update(self._params(desktop or self.desktop, company or self.company))
+        response = self._request('POST', '/api/poids', json=body,
+                                 headers={"Idempotency-Key": key or str(uuid.uuid4())})
+        result = response.json()
+        result["replayed"] = response.headers.get('Idempotent-Replayed') == 'true'
+        return result
+
+    def post_batch(self, weights, desktop=None, company=None, keys=None):
+        """
+        Enregistre au plus BATCH_SIZE poids en une requête: tous ou aucun.
+        'keys' (clés d'idempotence, une par poids) sont générées si elles ne
+        sont pas fournies. Retourne, dans l'ordre des poids, les
+        {'id', 'poids', 'replayed'} de l'API.
+        """
+        weights = list(weights)
+        keys = list(keys) if keys is not None else [str(uuid.uuid4()) for _ in weights]
+        params = self._params(desktop or self.desktop, company or self.company)
+        body = [dict(params, poids=weight, idempotency_key=key) for weight, key in zip(weights, keys)]
+        return self._request('POST', '/api/poids/batch', json=body).json()["results"]
+
+    def post_many(self, weights, desktop=None, company=None):
+        """
+        Enregistre une série de poids par lots de BATCH_SIZE (post_batch),
+        envoyés en parallèle sur les connexions du pool. Retourne les
+        résultats dans l'ordre des poids; lève la première erreur (ApiError)
+        une fois tous les envois terminés.
+        """
+        weights = list(weights)
+        chunks = [weights[i:i + BATCH_SIZE] for i in range(0, len(weights), BATCH_SIZE)]
+        if len(chunks) <= 1:
+            return [result for chunk in chunks for result in self.post_batch(chunk, desktop, company)]
+        with ThreadPoolExecutor(min(self.pool_size, len(chunks))) as executor:
+            results = list(executor.map(lambda chunk: self.post_batch(chunk, desktop, company), chunks))
+        return [result for chunk in results for result in chunk]
+
+    def batcher(self, max_size=50, max_delay=0.5, desktop=None, company=None):
+        """Regroupement des envois (voir Batcher)."""
+        return Batcher(self, max_size, max_delay, desktop, company)
+
+    def history(self, desktop=None, company=None, page_size=PAGE_SIZE, before=None):
+        """Enregistrements du plus récent au plus ancien, page par page."""
+        while True:
+            params = self._params(desktop, company, limit=page_size, before=before)
+            page = self._request('GET', '/api/poids/history', params=params).json()
+            yield from page
+            if len(page) < page_size:
+                return
+            before = page[-1]['id']
+
+    def stream(self, interval=0.2, changes_only=True, stop_event=None):
+        """
+        Lectures en direct de la balance, par interrogation de /api/poids/live
+        toutes les 'interval' secondes. Avec 'changes_only', une lecture n'est
+        produite que si le poids ou la stabilité change. S'arrête quand
+        'stop_event' (threading.Event) est positionné.
+        """
+        previous = None
+        while not (stop_event and stop_event.is_set()):
+            reading = self.live()
+            if reading is not None:
+                current = (reading['poids'], reading['stable'])
+                if not changes_only or current != previous:
+                    previous = current
+                    yield reading
+            if stop_event:
+                stop_event.wait(interval)
+            else:
+                time.sleep(interval)
+
+
+class Batcher:
+    """
+    Regroupe les poids ajoutés par add() et les envoie par séries (une
+    requête post_batch chacune), dès 'max_size' poids en attente (au plus
+    BATCH_SIZE) ou au plus tard 'max_delay' secondes après le premier. Les
+    erreurs d'envoi sont conservées dans 'errors', une par poids de la série
+    refusée; close() (ou la sortie du bloc with) envoie ce qui reste.
+    """
+
+    def __init__(self, client, max_size=50, max_delay=0.5, desktop=None, company=None):
+        self.client = client
+        self.max_size = min(max_size, BATCH_SIZE)
+        self.max_delay = max_delay
+        self.desktop = desktop
+        self.company = company
+        self.errors = []
+        self.sent = 0
+        self._pending = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, weight):
+        with self._condition:
+            if self._closed:
+                raise ApiError("Regroupement fermé.")
+            self._pending.append(weight)
+            if len(self._pending) == 1 or len(self._pending) >= self.max_size:
+                self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                deadline = time.monotonic() + self.max_delay
+                while len(self._pending) < self.max_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch, self._pending = self._pending[:self.max_size], self._pending[self.max_size:]
+            try:
+                self.client.post_batch(batch, self.desktop, self.company)
+                self.sent += len(batch)
+            except ApiError as e:
+                self.errors.extend((weight, e) for weight in batch)
+
+    def close(self):
+        """Envoie les poids en attente et arrête le thread d'envoi."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+
+class AsyncClient:
+    """
+    Variante asyncio de Client. Les appels HTTP s'exécutent dans des threads
+    (asyncio.to_thread) sur le pool de connexions d'un Client: aucune
+    dépendance HTTP asynchrone n'est nécessaire.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.client = Client(*args, **kwargs)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        self.client.close()
+
+    async def health(self):
+        return await asyncio.to_thread(self.client.health)
+
+    async def latest(self, desktop=None, company=None):
+        return await asyncio.to_thread(self.client.latest, desktop, company)
+
+    async def live(self):
+        return await asyncio.to_thread(self.client.live)
+
+    async def post(self, weight, desktop=None, company=None, key=None):
+        return await asyncio.to_thread(self.client.post, weight, desktop, company, key)
+
+    async def post_batch(self, weights, desktop=None, company=None, keys=None):
+        return await asyncio.to_thread(self.client.post_batch, weights, desktop, company, keys)
+
+    async def post_many(self, weights, desktop=None, company=None):
+        """Envoie les poids par lots de BATCH_SIZE (voir Client.post_many)."""
+        return await asyncio.to_thread(self.client.post_many, weights, desktop, company)
+
+    async def history(self, desktop=None, company=None, page_size=PAGE_SIZE, before=None):
+        while True:
+            params = self.client._params(desktop, company, limit=page_size, before=before)
+            response = await asyncio.to_thread(self.client._request, 'GET', '/api/poids/history', params=params)
+            page = response.json()
+            for record in page:
+                yield record
+            if len(page) < page_size:
+                return
+            before = page[-1]['id']
+
+    async def stream(self, interval=0.2, changes_only=True):
+        previous = None
+        while True:
+            reading = await self.live()
+            if reading is not None:
+                current = (reading['poids'], reading['stable'])
+                if not changes_only or current != previous:
+                    previous = current
+                    yield reading
+            await asyncio.sleep(interval)
+
+
+def _message(response):
+    """Message d'erreur de l'API ('error' ou 'message'), ou statut HTTP."""
+    try:
+        body = response.json()
+    except ValueError:
+        body = None
+    if isinstance(body, dict) and (body.get('error') or body.get('message')):
+        return body.get('error') or body.get('message')
+    return f"{response.status_code} {response.reason}"
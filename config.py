@@ -0,0 +1,190 @@
+import json
+import os
+import socket
+import threading
+import time
+
+import protocols
+
+# --- Configuration ---
+# Le fichier de configuration vit à côté de la base et des logs, avec un fallback local
+try:
+    CONFIG_DIR = os.path.join(os.getenv('ProgramData'), 'OdmService')
+    if not os.path.exists(CONFIG_DIR):
+        os.makedirs(CONFIG_DIR)
+except Exception:
+    CONFIG_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CONFIG_PATH = os.path.join(CONFIG_DIR, 'config.json')
+
+# Identifiant du poste, utilisé par défaut pour chaque enregistrement
+DESKTOP = socket.gethostname()
+
+# Schéma des paramètres réglables: nom -> (type, valeur par défaut, minimum, maximum)
+# Un minimum/maximum à None signifie "pas de borne".
+SCHEMA = {
+    "company": (str, "SITC, SAN-PEDRO", None, None),
+    "port": (str, "", None, None),  # Vide = détection automatique
+    "baudrate": (int, 9600, 300, 921600),
+    "protocol": (str, "", None, None),  # Vide = détection automatique (voir protocols.py)
+    # "plateau": un enregistrement par nouveau poids stable; "cycle": un seul
+    # par pesée complète, au retour au plateau vide (voir cycles.py)
+    "weighing_mode": (str, "plateau", None, None),
+    "cycle_empty_threshold": (float, 5.0, 0.0, 100000.0),  # Poids (kg) en dessous duquel le plateau est vide
+    "stabilization_count": (int, 3, 1, 50),
+    "stabilization_tolerance": (float, 1.0, 0.0, 1000.0),
+    "min_send_interval": (float, 2.0, 0.0, 3600.0),
+    "watchdog_timeout": (float, 15.0, 0.0, 3600.0),  # Sans trame valide pendant ce délai: reconnexion (0 = désactivé)
+    "cleanup_interval": (int, 600, 10, 86400),
+    "cleanup_keep": (int, 5, 1, 1000000),
+    "memory_diagnostics": (bool, False, None, None),  # tracemalloc + /api/debug/memory (coûteux, à activer ponctuellement)
+    "memory_snapshot_interval": (int, 300, 10, 86400),
+    # Écritures via POST /api/poids, par couple (adresse du client, desktop): débit
+    # soutenu (jetons/s, 0 = illimité) et rafale maximale
+    "api_write_rate": (float, 5.0, 0.0, 10000.0),
+    "api_write_burst": (int, 20, 1, 100000),
+    # Contre-pression: au-delà de ces seuils, POST /api/poids répond 429
+    "api_write_queue_limit": (int, 8, 1, 1000),  # Écritures en attente ou en cours
+    "api_write_wait_ms": (float, 500.0, 1.0, 60000.0),  # Attente maximale du verrou d'écriture
+    # Acquisition (port série, décodage, stabilisation) dans un processus séparé
+    # (voir acquisition.py). Pris en compte au démarrage du service.
+    "reader_process": (bool, False, None, None),
+    # Archive des octets bruts reçus de la balance (voir archive.py)
+    "archive_enabled": (bool, False, None, None),
+    "archive_max_mb": (int, 500, 1, 1000000),  # Espace disque maximal de l'archive
+    "archive_segment_mb": (int, 16, 1, 1024),  # Taille d'un segment avant rotation
+    # Moteur de stockage des poids: "sqlite", "memory" ou "log" (voir storage.py).
+    # Pris en compte au démarrage du service.
+    "storage": (str, "sqlite", None, None),
+    # Durabilité des écritures en base: "strict", "balanced" ou "relaxed" (voir
+    # datastore.py). Pris en compte au démarrage du service.
+    "durability": (str, "strict", None, None),
+    "checkpoint_interval": (float, 2.0, 0.1, 3600.0),  # Secondes entre deux checkpoints du WAL
+    # Sauvegardes à chaud de la base (voir backup.py)
+    "backup_interval": (int, 86400, 0, 31 * 86400),  # Secondes entre deux sauvegardes (0 = désactivées)
+    "backup_keep": (int, 7, 1, 1000),  # Sauvegardes conservées
+    "backup_compress": (bool, True, None, None),
+    # Analyse périodique des lectures: dérive du zéro, bruit, temps de
+    # stabilisation (voir analysis.py). Au-delà des seuils: anomalie.
+    "analysis_interval": (int, 300, 0, 86400),  # Secondes entre deux analyses (0 = désactivée)
+    "analysis_zero_limit": (float, 1.0, 0.0, 100000.0),  # Écart du zéro toléré (kg)
+    "analysis_noise_limit": (float, 0.5, 0.0, 100000.0),  # Écart type toléré au repos (kg)
+    "analysis_settle_limit": (float, 10.0, 0.0, 3600.0),  # Temps de stabilisation toléré (90e centile, s)
+}
+
+DEFAULTS = {name: spec[1] for name, spec in SCHEMA.items()}
+
+WEIGHING_MODES = ("plateau", "cycle")
+DURABILITY_PROFILES = ("strict", "balanced", "relaxed")
+STORAGE_ENGINES = ("sqlite", "memory", "log")
+
+
+def validate(values):
+    """
+    Valide et normalise un dictionnaire de paramètres complet.
+    Lève ValueError avec un message explicite au premier paramètre invalide.
+    """
+    unknown = set(values) - set(SCHEMA)
+    if unknown:
+        raise ValueError(f"Paramètres inconnus: {', '.join(sorted(unknown))}")
+
+    validated = {}
+    for name, (expected_type, default, minimum, maximum) in SCHEMA.items():
+        value = values.get(name, default)
+        # bool est un sous-type de int: on le refuse explicitement
+        if isinstance(value, bool) != (expected_type is bool):
+            raise ValueError(f"'{name}' doit être de type {expected_type.__name__}")
+        if expected_type is float and isinstance(value, int):
+            value = float(value)
+        if not isinstance(value, expected_type):
+            raise ValueError(f"'{name}' doit être de type {expected_type.__name__}")
+        if expected_type is str:
+            value = value.strip()
+        elif expected_type is not bool:
+            if minimum is not None and value < minimum:
+                raise ValueError(f"'{name}' doit être >= {minimum}")
+            if maximum is not None and value > maximum:
+                raise ValueError(f"'{name}' doit être <= {maximum}")
+        validated[name] = value
+
+    if validated["protocol"] and validated["protocol"] not in protocols.REGISTRY:
+        raise ValueError(f"'protocol' doit être vide ou l'un de: {', '.join(protocols.names())}")
+    if validated["weighing_mode"] not in WEIGHING_MODES:
+        raise ValueError(f"'weighing_mode' doit être l'un de: {', '.join(WEIGHING_MODES)}")
+    if validated["storage"] not in STORAGE_ENGINES:
+        raise ValueError(f"'storage' doit être l'un de: {', '.join(STORAGE_ENGINES)}")
+    if validated["durability"] not in DURABILITY_PROFILES:
+        raise ValueError(f"'durability' doit être l'un de: {', '.join(DURABILITY_PROFILES)}")
+    return validated
+
+
+class RuntimeConfig:
+    """
+    Configuration partagée par les threads du service.
+
+    Les valeurs sont un dictionnaire immuable remplacé d'un bloc à chaque
+    modification: un lecteur voit toujours soit l'ancienne, soit la nouvelle
+    configuration complète, jamais un mélange des deux. Le compteur
+    'generation' permet aux boucles de détecter un changement sans verrou.
+    """
+
+    def __init__(self, path=CONFIG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._values = dict(DEFAULTS)
+        self.generation = 0
+        self.applied_at = time.time()
+
+    def load(self):
+        """Charge le fichier de configuration s'il existe (sinon garde les valeurs par défaut)."""
+        if not os.path.exists(self.path):
+            return self.snapshot()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError("Le fichier de configuration doit contenir un objet JSON.")
+        with self._lock:
+            self._swap(validate(data))
+        return self.snapshot()
+
+    def get(self, name):
+        return self._values[name]
+
+    def snapshot(self):
+        return dict(self._values)
+
+    def update(self, changes, persist=True):
+        """
+        Applique un ensemble de modifications de façon atomique.
+        Tous les paramètres sont validés avant que le moindre changement ne soit visible.
+        Retourne la liste des paramètres effectivement modifiés.
+        """
+        if not isinstance(changes, dict):
+            raise ValueError("Les modifications doivent être un objet JSON.")
+        with self._lock:
+            merged = dict(self._values)
+            merged.update(changes)
+            new_values = validate(merged)
+            changed = sorted(k for k in new_values if new_values[k] != self._values[k])
+            if not changed:
+                return changed
+            if persist:
+                self._write(new_values)
+            self._swap(new_values)
+            return changed
+
+    def _swap(self, new_values):
+        self._values = new_values
+        self.applied_at = time.time()
+        self.generation += 1
+
+    def _write(self, values):
+        """Écrit le fichier via un fichier temporaire pour ne jamais laisser un JSON tronqué."""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(values, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+# Instance partagée par le service
+settings = RuntimeConfig()
@@ -0,0 +1,304 @@
+import logging
+import logging.handlers
+import threading
+import time
+
+from config import settings
+
+# --- Cœur du service ---
+# Base, API HTTP, lecteur, watchdog et nettoyage, sans dépendance à pywin32:
+# OdmService.py l'héberge sous le SCM, soak.py et bench.py l'exécutent sous Linux.
+# Les modules lourds (Flask, pyserial) sont importés dans les threads qui
+# les utilisent, pour ne pas retarder le démarrage.
+#
+# Arrêt: stop() positionne stop_event et ferme le port série; le thread de
+# run() exécute alors les étapes d'arrêt dans l'ordre (lecteur, HTTP,
+# écritures en cours, threads d'arrière-plan, stockage), chacune attendue au
+# plus STOP_TIMEOUT secondes. Tous les threads attendent sur stop_event: aucun
+# n'est bloqué dans un sleep. Une étape qui dépasse son délai est journalisée
+# et abandonnée (threads démons), l'arrêt du service n'est jamais bloqué.
+
+logger = logging.getLogger("OdmService")
+
+STOP_TIMEOUT = 0.5  # Attente maximale par étape d'arrêt (secondes)
+HTTP_POLL_INTERVAL = 0.05  # Réactivité de serve_forever à shutdown() (secondes)
+
+
+class ServiceCore:
+    """
+    'connect' remplace la recherche de la balance (simulateurs); 'http_port'
+    à 0 choisit un port libre, lisible dans http_server.server_port une fois
+    http_ready positionné.
+    """
+
+    def __init__(self, connect=None, http_host=None, http_port=None):
+        self.connect = connect
+        self.http_host = http_host
+        self.http_port = http_port
+        self.stop_event = threading.Event()
+        self.http_ready = threading.Event()
+        self.reader = None
+        self.reader_thread = None
+        self.http_server = None
+        self._http_lock = threading.Lock()  # Création du serveur HTTP et arrêt
+        self.flask_thread = None
+        self.cleanup_thread = None
+        self.checkpoint_thread = None
+        self.backup_thread = None
+        self.watchdog_thread = None
+        self.diagnostics_thread = None
+        self.archive_thread = None
+        self.analysis_thread = None
+
+    def start(self):
+        """Initialise la base et démarre les threads d'arrière-plan (HTTP, nettoyage)."""
+        import datastore
+        import storage
+        from state import weights
+        try:
+            datastore.set_durability(settings.get('durability'))
+            # Le journal "log" ne synchronise chaque écriture qu'en durabilité stricte
+            options = {"sync": settings.get('durability') == "strict"} if settings.get('storage') == "log" else {}
+            storage.backend = storage.create(settings.get('storage'), **options)
+            storage.backend.open()
+            logger.info(f"Storage '{storage.backend.name}' initialized ({weights.load()} poste(s) en mémoire).")
+        except Exception as e:
+            logger.error(f"CRITICAL: Failed to initialize database: {e}")
+            raise
+
+        # Flask est importé dans son propre thread, en parallèle de la recherche de la balance
+        self.flask_thread = threading.Thread(target=self.run_http, daemon=True)
+        self.flask_thread.start()
+        logger.info("Flask server thread started.")
+
+        # Démarrage du thread de nettoyage
+        self.cleanup_thread = threading.Thread(target=self.run_cleanup_task, daemon=True)
+        self.cleanup_thread.start()
+        logger.info(f"Cleanup thread started. Will run every {settings.get('cleanup_interval')} seconds.")
+
+        # Checkpoints du WAL hors du chemin des écritures (profils balanced et relaxed)
+        if storage.backend.name == "sqlite" and datastore.uses_wal():
+            self.checkpoint_thread = threading.Thread(target=self.run_checkpoint_task, daemon=True)
+            self.checkpoint_thread.start()
+
+        # Sauvegardes périodiques de la base: inactives si backup_interval vaut 0
+        import backup
+        self.backup_thread = threading.Thread(target=backup.run, args=(self.stop_event,), daemon=True)
+        self.backup_thread.start()
+
+        # Diagnostics mémoire: inactifs tant que memory_diagnostics est à false
+        import diagnostics
+        diagnostics.profiler = diagnostics.MemoryProfiler(self.stop_event)
+        self.diagnostics_thread = threading.Thread(target=diagnostics.profiler.run, daemon=True)
+        self.diagnostics_thread.start()
+
+        # Archive des trames brutes: inactive tant que archive_enabled est à false
+        import archive
+        self.archive_thread = archive.start(self.stop_event)
+
+        # Analyse de la dérive et du bruit: inactive si analysis_interval vaut 0
+        import analysis
+        analysis.analyzer = analysis.Analyzer(self.stop_event)
+        self.analysis_thread = threading.Thread(target=analysis.analyzer.run, daemon=True)
+        self.analysis_thread.start()
+
+    def run(self):
+        """Démarre le service, puis attend stop() et arrête les composants avant de retourner."""
+        self.start()
+
+        import health
+        if settings.get('reader_process'):
+            # Acquisition dans un processus enfant, supervisé et relancé en cas d'arrêt
+            import acquisition
+            self.reader = acquisition.ReaderProcess(self.stop_event, connect=self.connect)
+        else:
+            import reader
+            self.reader = reader.ScaleReader(self.stop_event, connect=self.connect or reader.find_scale_port)
+        health.register_reader(self.reader)
+        if not self.stop_event.is_set():
+            # Le watchdog reconstruit la connexion si le lecteur ne reçoit plus de trames
+            self.watchdog_thread = threading.Thread(
+                target=health.Watchdog(self.reader, self.stop_event).run, daemon=True)
+            self.watchdog_thread.start()
+            # Le lecteur a son propre thread: une recherche de la balance en
+            # cours ne retarde pas l'arrêt des autres composants
+            self.reader_thread = threading.Thread(target=self.reader.run, daemon=True)
+            self.reader_thread.start()
+
+        self.stop_event.wait()
+        self.shutdown()
+
+    def stop(self):
+        """Demande l'arrêt (depuis n'importe quel thread); run() retourne une fois l'arrêt terminé."""
+        self.stop_event.set()
+        if self.reader:
+            self.reader.close()
+
+    def shutdown(self):
+        """Étapes d'arrêt, dans l'ordre. Retourne la durée totale (ms)."""
+        import metrics
+        start = time.perf_counter()
+        steps = (
+            ("lecteur", self._stop_reader),
+            ("API HTTP", self._stop_http),
+            ("écritures en cours", self._flush_writes),
+            ("threads d'arrière-plan", self._join_background),
+            ("stockage", self._close_storage),
+        )
+        for name, step in steps:
+            step_start = time.perf_counter()
+            try:
+                done = step()
+            except Exception as e:
+                logger.error(f"Arrêt: erreur de l'étape {name}: {e}")
+                continue
+            if not done:
+                metrics.incr('shutdown_timeouts')
+                logger.warning(f"Arrêt: {name} non terminé après "
+                               f"{(time.perf_counter() - step_start) * 1000:.0f} ms, abandonné.")
+        duration_ms = (time.perf_counter() - start) * 1000
+        metrics.observe('shutdown_ms', duration_ms)
+        logger.info(f"Arrêt du service ({duration_ms:.0f} ms)")
+        return duration_ms
+
+    def _join(self, *threads):
+        """Attend les threads, chacun au plus STOP_TIMEOUT secondes. Retourne True s'ils sont tous terminés."""
+        done = True
+        for thread in threads:
+            if thread is not None and thread is not threading.current_thread():
+                thread.join(STOP_TIMEOUT)
+                done = done and not thread.is_alive()
+        return done
+
+    def _stop_reader(self):
+        if self.reader:
+            self.reader.close()
+        return self._join(self.reader_thread, self.watchdog_thread)
+
+    def _stop_http(self):
+        with self._http_lock:
+            server = self.http_server
+        if server is None:
+            # La pile HTTP est encore en cours de chargement: run_http s'arrêtera seul
+            return self._join(self.flask_thread)
+        # shutdown() attend la fin de la boucle de serve_forever, qui peut être
+        # occupée à attendre une place libre (au plus api.SLOT_WAIT): attente bornée
+        stopper = threading.Thread(target=server.shutdown, name="http-shutdown", daemon=True)
+        stopper.start()
+        if not self._join(stopper):
+            return False
+        # Les requêtes en cours se terminent avant la fermeture de la socket
+        deadline = time.monotonic() + STOP_TIMEOUT
+        while server.active_threads and time.monotonic() < deadline:
+            time.sleep(0.005)
+        server.server_close()
+        return not server.active_threads and self._join(self.flask_thread)
+
+    def _flush_writes(self):
+        from state import weights
+        deadline = time.monotonic() + STOP_TIMEOUT
+        while weights.pending_writes and time.monotonic() < deadline:
+            time.sleep(0.005)
+        return not weights.pending_writes
+
+    def _join_background(self):
+        # L'archive écrit ses blocs en attente, le checkpoint final vide le WAL
+        return self._join(self.cleanup_thread, self.checkpoint_thread, self.backup_thread,
+                          self.diagnostics_thread, self.archive_thread, self.analysis_thread)
+
+    def _close_storage(self):
+        import storage
+        storage.backend.close()
+        return True
+
+    def run_http(self):
+        """Charge la pile HTTP et sert l'API locale."""
+        try:
+            import api
+            host = self.http_host or api.HOST
+            port = api.PORT if self.http_port is None else self.http_port
+            server = api.create_server(host, port)
+            with self._http_lock:
+                if self.stop_event.is_set():
+                    server.server_close()
+                    return
+                self.http_server = server
+            logger.info(f"API HTTP prête sur {host}:{server.server_port}")
+            self.http_ready.set()
+            server.serve_forever(poll_interval=HTTP_POLL_INTERVAL)
+        except Exception as e:
+            logger.error(f"Failed to start Flask server: {e}")
+
+    def run_checkpoint_task(self):
+        """
+        Reporte périodiquement le WAL dans la base. La connexion reste ouverte
+        pendant toute la vie du service: tant qu'elle l'est, les écritures ne
+        font plus de checkpoint elles-mêmes.
+        """
+        import sqlite3
+        import datastore
+        import metrics
+
+        conn = datastore.get_db_connection()
+        datastore.background_checkpoint = True
+        logger.info(f"Checkpoints du WAL toutes les {settings.get('checkpoint_interval')}s "
+                    f"(durabilité {datastore.durability}).")
+        try:
+            while not self.stop_event.wait(settings.get('checkpoint_interval')):
+                try:
+                    start = time.perf_counter()
+                    log, checkpointed = datastore.checkpoint(conn)
+                    metrics.observe('checkpoint_ms', (time.perf_counter() - start) * 1000)
+                    # Pages du WAL pas encore reportées (lecture en cours, par exemple)
+                    metrics.set_gauge('wal_pending_pages', log - checkpointed)
+                except sqlite3.Error as e:
+                    logger.error(f"Erreur de checkpoint du WAL: {e}")
+        finally:
+            datastore.background_checkpoint = False
+            try:
+                datastore.checkpoint(conn, "TRUNCATE")
+            except sqlite3.Error as e:
+                logger.error(f"Erreur du checkpoint final du WAL: {e}")
+            conn.close()
+
+    def run_cleanup_task(self):
+        """Tâche de fond pour nettoyer la DB et les logs périodiquement."""
+        import storage
+        from state import weights
+
+        last_run = time.time()
+        while not self.stop_event.is_set():
+            # L'intervalle est relu à chaque réveil: une modification de
+            # cleanup_interval prend effet sans redémarrer le thread.
+            # On vérifie l'arrêt toutes les 5 secondes pour un arrêt plus réactif
+            remaining = last_run + settings.get('cleanup_interval') - time.time()
+            if remaining > 0:
+                self.stop_event.wait(min(remaining, 5))
+                continue
+            last_run = time.time()
+
+            try:
+                logger.info("--- Début du nettoyage périodique ---")
+
+                # 1. Nettoyage de la base de données
+                keep = settings.get('cleanup_keep')
+                deleted_count = storage.backend.cleanup(keep)
+                if deleted_count:
+                    # Garde l'état en mémoire identique au contenu de la base: une
+                    # clé d'idempotence supprimée ne rejoue plus son enregistrement
+                    weights.load()
+                    weights.forget_keys(storage.backend.oldest_id())
+                logger.info(f"Nettoyage DB: {deleted_count} anciens enregistrements supprimés. ({keep} conservés)")
+
+                # 2. Rotation des logs
+                # Trouve le handler de fichier et force une rotation
+                for handler in logger.handlers:
+                    if isinstance(handler, logging.handlers.RotatingFileHandler):
+                        handler.doRollover()
+                        logger.info("Nettoyage Logs: Rotation des fichiers de log effectuée.")
+                        break
+
+                logger.info("--- Fin du nettoyage périodique ---")
+
+            except Exception as e:
+                logger.error(f"Erreur durant le nettoyage périodique: {e}")
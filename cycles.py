@@ -0,0 +1,101 @@
+from collections import deque, namedtuple
+
+import metrics
+
+# --- Détection des cycles de pesée ---
+# En mode weighing_mode = "cycle", une pesée complète (plateau vide ->
+# chargement -> pic stable -> déchargement -> plateau vide) produit un seul
+# événement, au lieu d'un enregistrement par palier stable: une palette qui
+# se stabilise par étapes ne donne plus qu'une ligne, et les retours à zéro
+# ne sont plus enregistrés.
+
+EMPTY = "empty"
+LOADING = "loading"
+LOADED = "loaded"
+UNLOADING = "unloading"
+
+
+class Cycle(namedtuple('Cycle', ['peak', 'started_at', 'stable_at', 'ended_at'])):
+    """
+    Une pesée: poids stable maximal (kg), début du chargement, stabilisation
+    du pic et retour au plateau vide (secondes depuis l'epoch).
+    """
+    __slots__ = ()
+
+    @property
+    def settle_s(self):
+        """Durée entre le début du chargement et la stabilisation du pic."""
+        return self.stable_at - self.started_at
+
+
+class CycleDetector:
+    """
+    Machine à états alimentée par chaque lecture décodée. Une fenêtre est
+    stable quand ses 'window' dernières valeurs tiennent dans 'tolerance';
+    un poids inférieur ou égal à 'empty_threshold' est un plateau vide.
+    """
+
+    def __init__(self, window=3, tolerance=1.0, empty_threshold=5.0):
+        self.state = EMPTY
+        self.tolerance = tolerance
+        self.empty_threshold = empty_threshold
+        self._window = deque(maxlen=window)
+        self._reset()
+
+    def configure(self, window, tolerance, empty_threshold):
+        if window != self._window.maxlen:
+            self._window = deque(self._window, maxlen=window)
+        self.tolerance = tolerance
+        self.empty_threshold = empty_threshold
+
+    def _reset(self):
+        self.peak = None
+        self.started_at = None
+        self.stable_at = None
+
+    def _settled(self):
+        window = self._window
+        if len(window) < window.maxlen or max(window) - min(window) > self.tolerance:
+            return None
+        return window[-1]
+
+    def feed(self, weight, stable, at):
+        """Traite une lecture. Retourne le Cycle terminé par cette lecture, ou None."""
+        if stable is False:
+            # L'indicateur signale lui-même un poids en mouvement
+            self._window.clear()
+        else:
+            self._window.append(weight)
+        settled = self._settled()
+        loaded = weight > self.empty_threshold
+
+        if self.state == EMPTY:
+            if loaded:
+                self.state = LOADING
+                self.started_at = at
+            return None
+
+        if settled is not None and settled <= self.empty_threshold:
+            # Retour au plateau vide, stable
+            if self.state == LOADING:
+                # Chargement jamais stabilisé (passage, choc): pas de pesée
+                metrics.incr('cycles_aborted')
+                self.state = EMPTY
+                self._reset()
+                return None
+            cycle = Cycle(self.peak, self.started_at, self.stable_at, at)
+            self.state = EMPTY
+            self._reset()
+            metrics.incr('cycles_completed')
+            metrics.observe('cycle_settle_ms', cycle.settle_s * 1000)
+            return cycle
+
+        if settled is not None:
+            # Palier stable chargé: le pic ne fait que croître (stabilisation par étapes)
+            if self.peak is None or settled > self.peak + self.tolerance:
+                self.peak = settled
+                self.stable_at = at
+            self.state = LOADED
+        elif self.state == LOADED and weight < self.peak - self.tolerance:
+            self.state = UNLOADING
+        return None
@@ -1,6 +1,7 @@
 import sqlite3
 import os
-from datetime import datetime
+import time
+from datetime import datetime, timezone
 
 # --- Configuration ---
 # Utilise ProgramData pour un stockage fiable, avec un fallback local
@@ -14,38 +15,232 @@ except Exception:
 DB_PATH = os.path.join(DB_DIR, 'poids.db')
 print(f"Database path: {DB_PATH}")
 
+# --- Durabilité ---
+# Profil choisi au démarrage du service (paramètre 'durability'):
+#  - strict: journal de rollback, synchronous=FULL. Chaque écriture est sur
+#    disque au retour de commit (plusieurs fsync par pesée).
+#  - balanced: WAL, synchronous=NORMAL. Un commit ne fait pas de fsync; le WAL
+#    est synchronisé à chaque checkpoint. Un arrêt brutal du processus ne perd
+#    rien; une coupure de courant perd au plus les écritures depuis le dernier
+#    checkpoint, sans corrompre la base.
+#  - relaxed: WAL, synchronous=OFF. Aucune synchronisation par les écritures;
+#    seuls les checkpoints (en synchronous=FULL) mettent la base sur disque.
+#    Une coupure de courant peut aussi endommager les dernières transactions.
+# En WAL, les checkpoints sont faits par une tâche de fond (voir checkpoint());
+# tant qu'elle tourne, les écritures n'en font plus elles-mêmes.
+DURABILITY_PROFILES = {
+    # nom: (journal_mode, synchronous)
+    "strict": ("DELETE", "FULL"),
+    "balanced": ("WAL", "NORMAL"),
+    "relaxed": ("WAL", "OFF"),
+}
+durability = "strict"
+background_checkpoint = False
+
+def set_durability(profile):
+    """Choisit le profil de durabilité des prochaines connexions (avant init_db)."""
+    if profile not in DURABILITY_PROFILES:
+        raise ValueError(f"Profil de durabilité inconnu: {profile}")
+    global durability
+    durability = profile
+
+def uses_wal():
+    return DURABILITY_PROFILES[durability][0] == "WAL"
+
 # --- Fonctions de base de données ---
 
 def get_db_connection():
     """Crée et retourne une connexion à la base de données SQLite."""
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row  # Permet d'accéder aux colonnes par nom
+    conn.execute(f"PRAGMA synchronous = {DURABILITY_PROFILES[durability][1]}")
+    if background_checkpoint:
+        conn.execute("PRAGMA wal_autocheckpoint = 0")
     return conn
 
+def checkpoint(conn, mode="PASSIVE"):
+    """
+    Reporte le WAL dans la base, depuis la connexion 'conn' gardée ouverte par
+    la tâche de fond (la fermeture de la dernière connexion ferait elle-même un
+    checkpoint). Synchronise le WAL et la base quel que soit le profil.
+    Retourne (pages du WAL, pages reportées); (0, 0) hors WAL.
+    """
+    conn.execute("PRAGMA synchronous = FULL")
+    busy, log, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    return max(log, 0), max(checkpointed, 0)
+
+# --- Schéma ---
+# Chaque migration fait passer la base de la version précédente à la sienne,
+# dans une transaction. La version courante est stockée dans PRAGMA user_version
+# (0 pour une base neuve ou antérieure aux migrations).
+
+def _migration_1(conn):
+    """Schéma initial: dates ISO 8601, desktop et company en clair."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS poids (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            valeur REAL NOT NULL,
+            desktop TEXT NOT NULL,
+            company TEXT NOT NULL,
+            date TEXT NOT NULL
+        )
+    """)
+    # Clés d'idempotence des POST /api/poids: la clé primaire sert
+    # d'index unique, si bien qu'un doublon ne peut pas être inséré.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS idempotence (
+            cle TEXT PRIMARY KEY,
+            poids_id INTEGER NOT NULL
+        )
+    """)
+
+def _migration_2(conn):
+    """
+    Dates en millisecondes depuis l'epoch (INTEGER, UTC); desktop et company
+    déplacés dans des tables de correspondance référencées par leur ID.
+    """
+    conn.execute("CREATE TABLE desktops (id INTEGER PRIMARY KEY, nom TEXT NOT NULL UNIQUE)")
+    conn.execute("CREATE TABLE companies (id INTEGER PRIMARY KEY, nom TEXT NOT NULL UNIQUE)")
+    conn.execute("INSERT INTO desktops (nom) SELECT DISTINCT desktop FROM poids")
+    conn.execute("INSERT INTO companies (nom) SELECT DISTINCT company FROM poids")
+    conn.execute("""
+        CREATE TABLE poids_v2 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            valeur REAL NOT NULL,
+            desktop_id INTEGER NOT NULL REFERENCES desktops (id),
+            company_id INTEGER NOT NULL REFERENCES companies (id),
+            date INTEGER NOT NULL
+        )
+    """)
+    # Une date illisible devient 0 (1970) plutôt que de bloquer la migration
+    conn.execute("""
+        INSERT INTO poids_v2 (id, valeur, desktop_id, company_id, date)
+        SELECT p.id, p.valeur, d.id, c.id,
+               COALESCE(CAST(ROUND((julianday(p.date) - 2440587.5) * 86400000) AS INTEGER), 0)
+        FROM poids p
+        JOIN desktops d ON d.nom = p.desktop
+        JOIN companies c ON c.nom = p.company
+    """)
+    # Les IDs supprimés par le nettoyage ne doivent pas être réattribués
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'poids'").fetchone()
+    conn.execute("DROP TABLE poids")
+    conn.execute("ALTER TABLE poids_v2 RENAME TO poids")
+    if row:
+        conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'poids'", (row[0],))
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) SELECT 'poids', ? "
+                     "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'poids')", (row[0],))
+    conn.execute("CREATE INDEX idx_poids_poste ON poids (desktop_id, company_id, id)")
+
+def _migration_3(conn):
+    """
+    Cycles de pesée (weighing_mode = "cycle"): l'enregistrement poids porte le
+    pic, daté de sa stabilisation; le début et la fin du cycle sont ici.
+    """
+    conn.execute("""
+        CREATE TABLE cycles (
+            poids_id INTEGER PRIMARY KEY REFERENCES poids (id),
+            debut INTEGER NOT NULL,
+            fin INTEGER NOT NULL
+        )
+    """)
+
+MIGRATIONS = [_migration_1, _migration_2, _migration_3]
+SCHEMA_VERSION = len(MIGRATIONS)
+
 def init_db():
-    """Initialise la base de données et crée la table si elle n'existe pas."""
+    """Initialise la base de données et applique les migrations manquantes."""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS poids (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    valeur REAL NOT NULL,
-                    desktop TEXT NOT NULL,
-                    company TEXT NOT NULL,
-                    date TEXT NOT NULL
-                )
-            """)
-            conn.commit()
-            print("Database initialized successfully.")
+        conn = get_db_connection()
+        # Transactions explicites: SQLite permet d'annuler aussi le DDL
+        conn.isolation_level = None
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version > SCHEMA_VERSION:
+                raise sqlite3.DatabaseError(
+                    f"Base en version {version}, plus récente que ce programme ({SCHEMA_VERSION})")
+            for target, migrate in enumerate(MIGRATIONS[version:], start=version + 1):
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    migrate(conn)
+                    conn.execute(f"PRAGMA user_version = {target}")
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                print(f"Database migrated to version {target}.")
+            # Le mode de journal est enregistré dans le fichier de la base
+            journal = conn.execute(f"PRAGMA journal_mode = {DURABILITY_PROFILES[durability][0]}").fetchone()[0]
+        finally:
+            conn.close()
+        print(f"Database initialized successfully (durability {durability}, journal {journal}).")
     except sqlite3.Error as e:
         print(f"Database initialization error: {e}")
         # Log this error appropriately in a real application
         raise
 
-def add_poids(valeur, desktop, company):
+# --- Dates et enregistrements ---
+
+class IdempotencyConflict(ValueError):
+    """Clé d'idempotence déjà utilisée pour un autre poids (valeur, desktop ou company)."""
+
+def same_poids(record, valeur, desktop, company):
+    """Vrai si l'enregistrement correspond à ce poids (rejeu légitime d'une clé d'idempotence)."""
+    return (record['valeur'], record['desktop'], record['company']) == (float(valeur), desktop, company)
+
+def now_ms():
+    """Date courante en millisecondes depuis l'epoch (UTC), format de la colonne date."""
+    return time.time_ns() // 1_000_000
+
+def format_date(date_ms):
+    """Date de la base -> chaîne ISO 8601 (UTC, sans fuseau) exposée par l'API."""
+    moment = datetime.fromtimestamp(date_ms / 1000, timezone.utc).replace(tzinfo=None)
+    return moment.isoformat(timespec='milliseconds')
+
+def _record(row):
+    """Ligne de SELECT_POIDS -> dictionnaire (même forme que l'API)."""
+    record = dict(row)
+    record['date'] = format_date(record['date'])
+    return record
+
+# Enregistrements avec desktop et company en clair
+SELECT_POIDS = """
+    SELECT p.id, p.valeur, d.nom AS desktop, c.nom AS company, p.date
+    FROM poids p
+    JOIN desktops d ON d.id = p.desktop_id
+    JOIN companies c ON c.id = p.company_id
+"""
+
+def _name_id(cursor, table, nom):
+    """ID de 'nom' dans la table de correspondance (desktops ou companies), créé au besoin."""
+    row = cursor.execute(f"SELECT id FROM {table} WHERE nom = ?", (nom,)).fetchone()
+    if row:
+        return row[0]
+    cursor.execute(f"INSERT INTO {table} (nom) VALUES (?)", (nom,))
+    return cursor.lastrowid
+
+def _insert_poids(cursor, valeur, desktop, company, date):
+    cursor.execute(
+        "INSERT INTO poids (valeur, desktop_id, company_id, date) VALUES (?, ?, ?, ?)",
+        (valeur, _name_id(cursor, 'desktops', desktop), _name_id(cursor, 'companies', company), date)
+    )
+    return cursor.lastrowid
+
+def _filters(desktop, company):
+    """Conditions WHERE (sur les tables jointes de SELECT_POIDS) et leurs paramètres."""
+    conditions = []
+    params = []
+    if desktop:
+        conditions.append("d.nom = ?")
+        params.append(desktop)
+    if company:
+        conditions.append("c.nom = ?")
+        params.append(company)
+    return conditions, params
+
+def add_poids(valeur, desktop, company, date=None):
     """
     Enregistre une nouvelle mesure de poids dans la base de données.
+    'date' (millisecondes depuis l'epoch, UTC) est générée si elle n'est pas fournie.
     Retourne l'ID de la nouvelle ligne ou None en cas d'erreur.
     """
     if valeur < 0:
@@ -55,20 +250,170 @@ def add_poids(valeur, desktop, company):
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            # Utilise le format ISO 8601 pour la date/heure
-            current_date = datetime.utcnow().isoformat()
-            cursor.execute(
-                "INSERT INTO poids (valeur, desktop, company, date) VALUES (?, ?, ?, ?)",
-                (valeur, desktop, company, current_date)
-            )
+            current_date = date or now_ms()
+            new_id = _insert_poids(cursor, valeur, desktop, company, current_date)
             conn.commit()
-            new_id = cursor.lastrowid
             print(f"Successfully added weight: {valeur} for {desktop}")
             return new_id
     except sqlite3.Error as e:
         print(f"Error adding weight to database: {e}")
         return None
 
+def add_poids_idempotent(valeur, desktop, company, cle, date=None):
+    """
+    Enregistre une mesure associée à une clé d'idempotence, dans une seule
+    transaction. Si la clé existe déjà, rien n'est inséré et l'enregistrement
+    d'origine est retourné.
+    Retourne (enregistrement, créé), ou (None, False) en cas d'erreur.
+    """
+    if valeur < 0:
+        print("Error: Weight cannot be negative.")
+        return None, False
+
+    current_date = date or now_ms()
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                new_id = _insert_poids(cursor, valeur, desktop, company, current_date)
+                cursor.execute("INSERT INTO idempotence (cle, poids_id) VALUES (?, ?)", (cle, new_id))
+                conn.commit()
+            except sqlite3.IntegrityError:
+                # Clé déjà utilisée: annule l'insertion du poids
+                conn.rollback()
+                return get_poids_par_cle(cle, conn), False
+            print(f"Successfully added weight: {valeur} for {desktop}")
+            return {"id": new_id, "valeur": float(valeur), "desktop": desktop,
+                    "company": company, "date": format_date(current_date)}, True
+    except sqlite3.Error as e:
+        print(f"Error adding weight to database: {e}")
+        return None, False
+
+def add_poids_batch(items, date=None):
+    """
+    Enregistre une série de mesures (valeur, desktop, company, clé
+    d'idempotence ou None) dans une seule transaction. Une clé déjà utilisée
+    (en base ou plus tôt dans la série) n'insère rien; pour un autre poids,
+    elle lève IdempotencyConflict.
+    Retourne la liste des (enregistrement, créé), ou None en cas d'erreur
+    (rien n'est alors enregistré).
+    """
+    if any(valeur < 0 for valeur, _, _, _ in items):
+        print("Error: Weight cannot be negative.")
+        return None
+
+    current_date = date or now_ms()
+    results = []
+    seen = {}
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                for valeur, desktop, company, cle in items:
+                    known = seen.get(cle) or (get_poids_par_cle(cle, conn) if cle is not None else None)
+                    if known is not None:
+                        if not same_poids(known, valeur, desktop, company):
+                            raise IdempotencyConflict(f"Clé d'idempotence déjà utilisée pour un autre poids: {cle}")
+                        results.append((known, False))
+                        continue
+                    new_id = _insert_poids(cursor, valeur, desktop, company, current_date)
+                    if cle is not None:
+                        cursor.execute("INSERT INTO idempotence (cle, poids_id) VALUES (?, ?)", (cle, new_id))
+                    record = {"id": new_id, "valeur": float(valeur), "desktop": desktop,
+                              "company": company, "date": format_date(current_date)}
+                    if cle is not None:
+                        seen[cle] = record
+                    results.append((record, True))
+                conn.commit()
+            except (sqlite3.Error, IdempotencyConflict):
+                conn.rollback()
+                raise
+            print(f"Successfully added {sum(created for _, created in results)} weight(s) in one batch")
+            return results
+    except sqlite3.Error as e:
+        print(f"Error adding weights to database: {e}")
+        return None
+
+def add_cycle(valeur, desktop, company, debut, stable, fin):
+    """
+    Enregistre une pesée complète (dates en millisecondes depuis l'epoch):
+    le pic dans poids, daté de sa stabilisation, et le cycle dans cycles.
+    Retourne l'ID de la ligne poids ou None en cas d'erreur.
+    """
+    if valeur < 0:
+        print("Error: Weight cannot be negative.")
+        return None
+
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            new_id = _insert_poids(cursor, valeur, desktop, company, stable)
+            cursor.execute("INSERT INTO cycles (poids_id, debut, fin) VALUES (?, ?, ?)", (new_id, debut, fin))
+            conn.commit()
+            print(f"Successfully added weighing cycle: {valeur} for {desktop}")
+            return new_id
+    except sqlite3.Error as e:
+        print(f"Error adding weighing cycle to database: {e}")
+        return None
+
+def get_cycles(desktop=None, company=None, limit=100, before_id=None):
+    """
+    Récupère les pesées complètes les plus récentes, avec filtres optionnels.
+    Retourne une liste de dictionnaires (vide en cas d'erreur).
+    """
+    try:
+        with get_db_connection() as conn:
+            query = """
+                SELECT p.id, p.valeur, d.nom AS desktop, c.nom AS company,
+                       y.debut, p.date AS stable, y.fin
+                FROM cycles y
+                JOIN poids p ON p.id = y.poids_id
+                JOIN desktops d ON d.id = p.desktop_id
+                JOIN companies c ON c.id = p.company_id
+            """
+            conditions, params = _filters(desktop, company)
+            if before_id is not None:
+                conditions.append("p.id < ?")
+                params.append(before_id)
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            query += " ORDER BY p.id DESC LIMIT ?"
+            params.append(limit)
+
+            cycles = []
+            for row in conn.execute(query, params):
+                cycle = dict(row)
+                cycle['duree_stabilisation_s'] = round((cycle['stable'] - cycle['debut']) / 1000, 3)
+                for key in ('debut', 'stable', 'fin'):
+                    cycle[key] = format_date(cycle[key])
+                cycles.append(cycle)
+            return cycles
+    except sqlite3.Error as e:
+        print(f"Error fetching weighing cycles from database: {e}")
+        return []
+
+def get_poids_par_cle(cle, conn=None):
+    """Enregistrement associé à une clé d'idempotence, ou None si la clé est inconnue."""
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    try:
+        row = conn.execute(
+            SELECT_POIDS + " JOIN idempotence i ON i.poids_id = p.id WHERE i.cle = ?",
+            (cle,)
+        ).fetchone()
+        return _record(row) if row else None
+    finally:
+        if own_conn:
+            conn.close()
+
+def ping():
+    """Vérifie que la base répond (ouverture + requête triviale). Lève sqlite3.Error sinon."""
+    conn = get_db_connection()
+    try:
+        conn.execute("SELECT 1 FROM poids LIMIT 1").fetchall()
+    finally:
+        conn.close()
+
 def get_dernier_poids(desktop=None, company=None):
     """
     Récupère le dernier enregistrement de poids, avec filtres optionnels.
@@ -79,36 +424,84 @@ def get_dernier_poids(desktop=None, company=None):
             cursor = conn.cursor()
 
             # Construction de la requête de base
-            query = "SELECT * FROM poids"
+            query = SELECT_POIDS
 
             # Ajout des filtres
-            conditions = []
-            params = []
-            if desktop:
-                conditions.append("desktop = ?")
-                params.append(desktop)
-            if company:
-                conditions.append("company = ?")
-                params.append(company)
+            conditions, params = _filters(desktop, company)
 
             if conditions:
                 query += " WHERE " + " AND ".join(conditions)
 
             # Tri pour obtenir le plus récent
-            query += " ORDER BY date DESC LIMIT 1"
+            query += " ORDER BY p.date DESC, p.id DESC LIMIT 1"
 
             cursor.execute(query, params)
             dernier_poids = cursor.fetchone()
 
             if dernier_poids:
                 # Convertir l'objet Row en dictionnaire pour une utilisation facile
-                return dict(dernier_poids)
+                return _record(dernier_poids)
             else:
                 return None
     except sqlite3.Error as e:
         print(f"Error fetching last weight from database: {e}")
         return None
 
+def get_historique_poids(desktop=None, company=None, limit=100, before_id=None):
+    """
+    Récupère les enregistrements les plus récents (du plus récent au plus ancien),
+    avec filtres optionnels. 'before_id' permet de paginer: seuls les
+    enregistrements d'ID inférieur sont retournés.
+    Retourne une liste de dictionnaires (vide en cas d'erreur).
+    """
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+
+            query = SELECT_POIDS
+            conditions, params = _filters(desktop, company)
+            if before_id is not None:
+                conditions.append("p.id < ?")
+                params.append(before_id)
+
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            query += " ORDER BY p.id DESC LIMIT ?"
+            params.append(limit)
+
+            cursor.execute(query, params)
+            return [_record(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"Error fetching weight history from database: {e}")
+        return []
+
+def get_premier_id():
+    """ID du plus ancien enregistrement, ou None (table vide ou erreur)."""
+    try:
+        with get_db_connection() as conn:
+            return conn.execute("SELECT MIN(id) FROM poids").fetchone()[0]
+    except sqlite3.Error as e:
+        print(f"Error fetching oldest weight id from database: {e}")
+        return None
+
+def get_derniers_poids_par_poste():
+    """
+    Récupère le dernier enregistrement de chaque couple (desktop, company).
+    Retourne une liste de dictionnaires (vide en cas d'erreur).
+    """
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(SELECT_POIDS + """
+                JOIN (
+                    SELECT MAX(id) AS id FROM poids GROUP BY desktop_id, company_id
+                ) dernier ON dernier.id = p.id
+            """)
+            return [_record(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"Error fetching last weights from database: {e}")
+        return []
+
 
 def cleanup_poids(keep=5):
     """
@@ -124,7 +517,7 @@ def cleanup_poids(keep=5):
     conn = None
     deleted_count = 0
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_db_connection()
         cursor = conn.cursor()
         
         # Compter le nombre total d'enregistrements avant suppression
@@ -145,6 +538,9 @@ def cleanup_poids(keep=5):
             """
             cursor.execute(query, (keep,))
             deleted_count = cursor.rowcount
+            # Les clés d'idempotence et les cycles suivent les enregistrements supprimés
+            cursor.execute("DELETE FROM idempotence WHERE poids_id NOT IN (SELECT id FROM poids)")
+            cursor.execute("DELETE FROM cycles WHERE poids_id NOT IN (SELECT id FROM poids)")
             conn.commit()
             
     except sqlite3.Error as e:
@@ -0,0 +1,134 @@
+import logging
+import threading
+import time
+import tracemalloc
+
+from config import settings
+
+# --- Diagnostics mémoire ---
+# Chaque buffer, file ou cache du service déclare ici sa taille courante et
+# sa borne; /api/debug/memory les expose avec, si memory_diagnostics est
+# activé, l'évolution des allocations entre deux instantanés tracemalloc.
+
+logger = logging.getLogger("OdmService")
+
+TRACE_FRAMES = 5  # Profondeur des piles enregistrées par tracemalloc
+TOP_LIMIT = 25
+
+_bounds_lock = threading.Lock()
+_bounds = {}
+
+
+def register_bound(name, size, limit):
+    """
+    Déclare une structure bornée. 'size' est une fonction sans argument
+    retournant la taille courante; 'limit' est la borne appliquée.
+    """
+    with _bounds_lock:
+        _bounds[name] = (size, limit)
+
+
+def bounds():
+    """Taille courante et borne de chaque structure déclarée."""
+    with _bounds_lock:
+        items = list(_bounds.items())
+    report = {}
+    for name, (size, limit) in items:
+        try:
+            current = size()
+        except Exception as e:
+            current = f"erreur: {e}"
+        report[name] = {"size": current, "limit": limit}
+    return report
+
+
+class MemoryProfiler:
+    """
+    Instantanés tracemalloc périodiques, pilotés par la configuration:
+    memory_diagnostics active/désactive le suivi à chaud, et seuls deux
+    instantanés (référence et dernier) sont conservés.
+    """
+
+    def __init__(self, stop_event):
+        self.stop_event = stop_event
+        self._lock = threading.Lock()
+        self.baseline = None
+        self.latest = None
+        self.latest_at = None
+
+    @property
+    def enabled(self):
+        return tracemalloc.is_tracing()
+
+    def run(self):
+        last_snapshot = 0
+        while not self.stop_event.wait(1.0):
+            try:
+                if settings.get('memory_diagnostics'):
+                    if not self.enabled:
+                        self.start()
+                        last_snapshot = time.time()
+                    elif time.time() - last_snapshot >= settings.get('memory_snapshot_interval'):
+                        self.take_snapshot()
+                        last_snapshot = time.time()
+                elif self.enabled:
+                    self.stop()
+            except Exception as e:
+                logger.error(f"Erreur des diagnostics mémoire: {e}")
+        if self.enabled:
+            self.stop()
+
+    def start(self):
+        tracemalloc.start(TRACE_FRAMES)
+        with self._lock:
+            self.baseline = self._snapshot()
+            self.latest, self.latest_at = self.baseline, time.time()
+        logger.info("Diagnostics mémoire activés (tracemalloc).")
+
+    def stop(self):
+        tracemalloc.stop()
+        with self._lock:
+            self.baseline = self.latest = self.latest_at = None
+        logger.info("Diagnostics mémoire désactivés.")
+
+    def take_snapshot(self):
+        snapshot = self._snapshot()
+        with self._lock:
+            self.latest, self.latest_at = snapshot, time.time()
+
+    def _snapshot(self):
+        # Les allocations de tracemalloc lui-même ne sont pas significatives
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+    def report(self, limit=TOP_LIMIT, fresh=False):
+        """Principales différences d'allocation entre la référence et le dernier instantané."""
+        if not self.enabled:
+            return None
+        if fresh:
+            self.take_snapshot()
+        with self._lock:
+            baseline, latest, latest_at = self.baseline, self.latest, self.latest_at
+        current, peak = tracemalloc.get_traced_memory()
+        diffs = latest.compare_to(baseline, 'lineno')[:limit]
+        return {
+            "traced_kb": round(current / 1024, 1),
+            "peak_kb": round(peak / 1024, 1),
+            "snapshot_age_s": round(time.time() - latest_at, 1),
+            "top": [
+                {
+                    "where": str(stat.traceback[0]),
+                    "size_kb": round(stat.size / 1024, 1),
+                    "size_diff_kb": round(stat.size_diff / 1024, 1),
+                    "count": stat.count,
+                    "count_diff": stat.count_diff,
+                }
+                for stat in diffs
+            ],
+        }
+
+
+# Instance utilisée par le service (créée par core.ServiceCore)
+profiler = None
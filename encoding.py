@@ -0,0 +1,101 @@
+import gzip
+import json
+import threading
+import zlib
+from collections import OrderedDict
+
+import diagnostics
+import metrics
+
+# MessagePack est optionnel: sans le paquet msgpack, seul JSON est proposé
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# --- Représentations des réponses /api/poids ---
+# Négociation du format (JSON ou MessagePack via Accept) et de la compression
+# (gzip/deflate via Accept-Encoding). Les enregistrements de la table poids
+# ne changent jamais une fois écrits: leur encodage est mis en cache par ID.
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+MSGPACK_TYPES = (MSGPACK, "application/x-msgpack")
+
+COMPRESS_MIN_SIZE = 1024  # En dessous, la compression coûte plus qu'elle ne rapporte
+CACHE_SIZE = 8192  # Nombre d'enregistrements encodés conservés (tous formats)
+
+_cache_lock = threading.Lock()
+_cache = OrderedDict()  # (format, id) -> octets encodés
+
+
+def negotiate(accept_mimetypes):
+    """Choisit le format de réponse à partir de l'en-tête Accept (werkzeug MIMEAccept)."""
+    if msgpack is None:
+        return JSON
+    best = accept_mimetypes.best_match((JSON,) + MSGPACK_TYPES, default=JSON)
+    return MSGPACK if best in MSGPACK_TYPES else JSON
+
+
+def _encode(value, fmt):
+    if fmt == MSGPACK:
+        return msgpack.packb(value, use_bin_type=True)
+    # Même forme que jsonify (clés triées), sans espaces superflus
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def encode_record(record, fmt):
+    """Encode un enregistrement de la table poids, via le cache si possible."""
+    key = (fmt, record.get('id'))
+    if key[1] is None:
+        return _encode(record, fmt)
+    with _cache_lock:
+        encoded = _cache.get(key)
+        if encoded is not None:
+            _cache.move_to_end(key)
+    if encoded is not None:
+        metrics.incr('encoding_cache_hits')
+        return encoded
+
+    encoded = _encode(record, fmt)
+    metrics.incr('encoding_cache_misses')
+    with _cache_lock:
+        _cache[key] = encoded
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return encoded
+
+
+def encode_records(records, fmt):
+    """Encode une liste d'enregistrements en concaténant les encodages mis en cache."""
+    parts = [encode_record(record, fmt) for record in records]
+    if fmt == MSGPACK:
+        packer = msgpack.Packer(use_bin_type=True)
+        return packer.pack_array_header(len(parts)) + b''.join(parts)
+    return b'[' + b','.join(parts) + b']'
+
+
+def encode(value, fmt):
+    """Encode une valeur quelconque (messages, lectures en direct) sans cache."""
+    return _encode(value, fmt)
+
+
+def compress(body, accept_encodings):
+    """
+    Compresse le corps si le client l'accepte et s'il dépasse COMPRESS_MIN_SIZE.
+    Retourne (corps, Content-Encoding ou None).
+    """
+    if len(body) < COMPRESS_MIN_SIZE:
+        return body, None
+    if 'gzip' in accept_encodings:
+        return gzip.compress(body, compresslevel=5), 'gzip'
+    if 'deflate' in accept_encodings:
+        return zlib.compress(body, 5), 'deflate'
+    return body, None
+
+
+def cache_size():
+    return len(_cache)
+
+
+diagnostics.register_bound("encoding_cache", cache_size, CACHE_SIZE)
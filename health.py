@@ -0,0 +1,128 @@
+import logging
+import time
+
+import analysis
+import metrics
+import storage
+from config import settings
+from state import weights
+
+# --- Santé du service et watchdog du lecteur ---
+# Le lecteur est enregistré par le service au démarrage; /api/health et le
+# watchdog lisent son état sans accéder au port série.
+
+logger = logging.getLogger("OdmService")
+
+CHECK_INTERVAL = 1.0  # Période de vérification du watchdog (secondes)
+
+_reader = None
+
+
+def register_reader(reader):
+    global _reader
+    _reader = reader
+
+
+def _age(timestamp, now):
+    return round(now - timestamp, 3) if timestamp else None
+
+
+def frame_age(reader, now=None):
+    """
+    Secondes écoulées depuis la dernière trame valide de la connexion en cours
+    (ou depuis la connexion si aucune trame n'a encore été reçue).
+    """
+    now = now or time.time()
+    reference = max(reader.last_frame_at or 0, reader.connected_at or 0)
+    return now - reference if reference else None
+
+
+def _analysis():
+    """
+    Moteur de l'analyse de dérive ("python": sans NumPy, lectures résumées
+    par blocs) et étendue de la dernière analyse, ou None si elle est inactive.
+    """
+    analyzer = analysis.analyzer
+    last = analyzer.report if analyzer else None
+    if not settings.get('analysis_interval') and last is None:
+        return None
+    return {"engine": analysis.ENGINE,
+            "readings": last["readings"] if last else None,
+            "span_h": last["span_h"] if last else None}
+
+
+def report():
+    """Rapport de santé. Retourne (dictionnaire, sain)."""
+    now = time.time()
+    reader = _reader
+    timeout = settings.get('watchdog_timeout')
+
+    db_latency_ms = None
+    db_ok = True
+    start = time.perf_counter()
+    try:
+        storage.backend.ping()
+        db_latency_ms = round((time.perf_counter() - start) * 1000, 2)
+    except Exception as e:
+        logger.error(f"Health check DB error: {e}")
+        db_ok = False
+
+    reader_status = reader.status if reader else "not started"
+    age = frame_age(reader, now) if reader and reader.status == "connected" else None
+    reader_ok = reader_status == "connected" and (not timeout or (age is not None and age < timeout))
+
+    body = {
+        "status": "ok" if reader_ok and db_ok else "degraded",
+        "reader": {
+            "status": reader_status,
+            "port": reader.port_name if reader else None,
+            "protocol": reader.protocol_name if reader else None,
+            "last_frame_age_s": _age(reader.last_frame_at, now) if reader else None,
+        },
+        "last_persist_age_s": _age(weights.last_write_at, now),
+        "writer_queue_depth": weights.pending_writes,
+        "db": {"ok": db_ok, "latency_ms": db_latency_ms},
+        "watchdog_restarts": metrics.get_counter("watchdog_restarts"),
+        "analysis": _analysis(),
+    }
+    return body, reader_ok and db_ok
+
+
+class Watchdog:
+    """
+    Redémarre la connexion série quand le lecteur est connecté mais ne reçoit
+    plus de trame valide depuis 'watchdog_timeout' secondes (adaptateur USB
+    à moitié mort, câble coupé sans erreur remontée, ...).
+    """
+
+    def __init__(self, reader, stop_event, check_interval=CHECK_INTERVAL):
+        self.reader = reader
+        self.stop_event = stop_event
+        self.check_interval = check_interval
+        self.restarted_at = None
+
+    def run(self):
+        while not self.stop_event.wait(self.check_interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Erreur du watchdog: {e}")
+
+    def check(self):
+        timeout = settings.get('watchdog_timeout')
+        reader = self.reader
+        if self.restarted_at and reader.last_frame_at and reader.last_frame_at > self.restarted_at:
+            # Temps de rétablissement: du redémarrage à la première trame reçue
+            metrics.observe('watchdog_recovery_ms', (reader.last_frame_at - self.restarted_at) * 1000)
+            self.restarted_at = None
+        if not timeout or reader.status != "connected" or reader.restart_requested:
+            return False
+        age = frame_age(reader)
+        if age is None or age < timeout:
+            return False
+
+        logger.warning(f"Watchdog: aucune trame valide depuis {age:.1f}s, reconnexion de la balance.")
+        metrics.incr('watchdog_restarts')
+        self.restarted_at = time.time()
+        reader.restart()
+        return True
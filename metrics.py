@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import deque
+
+import diagnostics
+
+# --- Métriques internes du service ---
+# Registre minimal en mémoire, exposé par l'API. Chaque série de mesures est
+# bornée pour que la mémoire reste constante quelle que soit la durée de fonctionnement.
+
+SAMPLES_PER_TIMING = 256
+MAX_SERIES = 64  # Nombre maximal de séries de mesures (les suivantes sont ignorées)
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timings = {}
+_started_at = time.time()
+
+
+def incr(name, amount=1):
+    """Incrémente un compteur."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def get_counter(name):
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def set_gauge(name, value):
+    """Fixe la valeur courante d'une jauge."""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, value):
+    """Enregistre une mesure (typiquement une durée en millisecondes)."""
+    with _lock:
+        samples = _timings.get(name)
+        if samples is None:
+            if len(_timings) >= MAX_SERIES:
+                _counters['metrics_dropped'] = _counters.get('metrics_dropped', 0) + 1
+                return
+            samples = _timings[name] = deque(maxlen=SAMPLES_PER_TIMING)
+        samples.append(value)
+
+
+def uptime():
+    """Secondes écoulées depuis le chargement du module (≈ démarrage du processus)."""
+    return time.time() - _started_at
+
+
+def sample_count():
+    """Nombre total de mesures conservées (toutes séries confondues)."""
+    with _lock:
+        return sum(len(samples) for samples in _timings.values())
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def snapshot():
+    """Retourne un instantané de toutes les métriques, sérialisable en JSON."""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        timings = {name: list(samples) for name, samples in _timings.items()}
+
+    summaries = {}
+    for name, values in timings.items():
+        if not values:
+            continue
+        ordered = sorted(values)
+        summaries[name] = {
+            "count": len(values),
+            "last": values[-1],
+            "p50": _percentile(ordered, 0.50),
+            "p99": _percentile(ordered, 0.99),
+            "max": ordered[-1],
+        }
+
+    return {
+        "uptime_s": round(time.time() - _started_at, 1),
+        "counters": counters,
+        "gauges": gauges,
+        "timings": summaries,
+    }
+
+
+diagnostics.register_bound("metrics_samples", sample_count, SAMPLES_PER_TIMING * MAX_SERIES)
@@ -0,0 +1,151 @@
+import re
+from collections import namedtuple
+
+# --- Formats de trames des indicateurs de pesage ---
+# Chaque protocole est un matcher précompilé appliqué directement sur les octets
+# reçus (bytearray/memoryview): pas de décodage ASCII ni de str.replace dans la
+# boucle de lecture.
+
+# weight: poids en kg (int ou float), stable: True/False si l'indicateur
+# transmet un indicateur de stabilité, None sinon.
+Reading = namedtuple('Reading', ['weight', 'stable'])
+
+
+class Protocol:
+    """Un format de trame continue de longueur fixe."""
+
+    def __init__(self, name, pattern, frame_length, convert, encode, description=""):
+        self.name = name
+        self.regex = re.compile(pattern)
+        self.frame_length = frame_length
+        self.description = description
+        self._convert = convert
+        self._encode = encode
+
+    def scan(self, buffer):
+        """
+        Extrait toutes les lectures complètes présentes dans le buffer.
+        Retourne (lectures, nombre d'octets consommés en tête du buffer).
+
+        Les octets consommés incluent les trames reconnues et les déchets qui ne
+        peuvent plus faire partie d'une trame: seule une trame incomplète en fin
+        de buffer (au plus frame_length - 1 octets) est conservée.
+        """
+        readings = []
+        last_end = 0
+        for match in self.regex.finditer(buffer):
+            reading = self._convert(match)
+            if reading is not None:
+                readings.append(reading)
+            last_end = match.end()
+        return readings, max(last_end, len(buffer) - self.frame_length + 1, 0)
+
+    def parse(self, frame):
+        """Parse une trame unique. Retourne une Reading ou None."""
+        match = self.regex.fullmatch(frame)
+        return self._convert(match) if match else None
+
+    def encode(self, weight, stable=True):
+        """Produit une trame valide pour ce protocole (simulateurs, benchmarks)."""
+        return self._encode(weight, stable)
+
+
+# --- Registre ---
+
+REGISTRY = {}
+
+
+def register(protocol):
+    """Ajoute un protocole au registre. L'ordre d'enregistrement est l'ordre de détection."""
+    REGISTRY[protocol.name] = protocol
+    return protocol
+
+
+def get(name):
+    try:
+        return REGISTRY[name]
+    except KeyError:
+        raise ValueError(f"Protocole inconnu: {name}")
+
+
+def names():
+    return list(REGISTRY)
+
+
+def max_frame_length():
+    return max(p.frame_length for p in REGISTRY.values())
+
+
+def detect(data, candidates=None):
+    """
+    Identifie le protocole à partir des premiers octets reçus sur un port.
+    Retourne le premier protocole du registre (ou de candidates) qui extrait
+    au moins une lecture valide, ou None.
+    """
+    for protocol in candidates or REGISTRY.values():
+        readings, _ = protocol.scan(data)
+        if readings:
+            return protocol
+    return None
+
+
+# --- Protocoles intégrés ---
+
+# Format historique: 11 octets, préfixe 'ww' ou 'wn', poids entier sur les
+# octets 2 à 8 (espaces et signe '-' éventuels), suffixe 'kg'.
+def _convert_ww(match):
+    field = match.group(2)
+    digits = field.translate(None, b' -')
+    if not digits:
+        return None
+    value = int(digits)
+    return Reading(-value if b'-' in field else value, None)
+
+
+def _encode_ww(weight, stable):
+    weight = int(round(weight))
+    field = b'%7d' % weight
+    return b'w' + (b'w' if stable else b'n') + field + b'kg'
+
+
+register(Protocol(
+    "ww-kg",
+    rb'w([wn])([ 0-9-]{7})kg',
+    11,
+    _convert_ww,
+    _encode_ww,
+    "Trame 11 octets ww/wn + poids entier + kg",
+))
+
+
+# Format A&D (et compatibles): en-tête de stabilité, poids décimal signé sur
+# 9 caractères, unité sur 3 caractères, CR LF.
+#   ST,+00012.34 kg\r\n   stable
+#   US,+00012.34  g\r\n   instable, en grammes
+#   OL,+99999999 kg\r\n   surcharge (ignorée)
+def _convert_st(match):
+    header = match.group(1)
+    if header == b'OL':
+        return None
+    try:
+        value = float(match.group(2).replace(b' ', b''))
+    except ValueError:
+        return None
+    if match.group(3) == b'  g':
+        value /= 1000.0
+    return Reading(value, header == b'ST')
+
+
+def _encode_st(weight, stable):
+    header = 'ST' if stable else 'US'
+    return f"{header},{weight:+09.2f} kg\r\n".encode('ascii')
+
+
+register(Protocol(
+    "st-us",
+    rb'(ST|US|OL),([+-][0-9. ]{8})( kg|  g)\r\n',
+    17,
+    _convert_st,
+    _encode_st,
+    "Trame 17 octets ST/US/OL + poids décimal + unité (kg ou g)",
+))
@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import OrderedDict
+
+import diagnostics
+
+# --- Limitation de débit des clients de l'API ---
+# Un seau à jetons par client: 'rate' jetons par seconde, au plus 'burst' en
+# réserve. Les seaux des clients les moins récents sont oubliés au-delà de
+# MAX_CLIENTS. Oublier un seau pas encore rempli ne doit pas rendre de jetons:
+# dans ce cas (table saturée de clients actifs), le nouveau seau part vide.
+# Un client (poste) est identifié par son adresse et son 'desktop', choisi
+# par l'appelant: un second seau par adresse, ADDRESS_SHARE fois plus grand,
+# borne l'ensemble des postes d'une même adresse.
+
+MAX_CLIENTS = 1024
+ADDRESS_SHARE = 4  # Débit et rafale d'une adresse, en multiples de ceux d'un poste
+
+
+class TokenBucket:
+
+    def __init__(self, burst, now):
+        self.tokens = float(burst)
+        self.updated = now
+
+    def refill(self, rate, burst, now):
+        self.tokens = min(float(burst), self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        return self.tokens
+
+    def take(self, rate, burst, now):
+        """Consomme un jeton. Retourne 0 si accepté, sinon le délai (s) avant le prochain jeton."""
+        self.refill(rate, burst, now)
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / rate
+
+
+class RateLimiter:
+    """Seaux à jetons par clé, bornés en nombre. Débit et rafale sont lus à chaque appel."""
+
+    def __init__(self, max_clients=MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def check(self, key, rate, burst):
+        """Retourne 0 si la requête est acceptée, sinon le délai conseillé (s) avant de réessayer."""
+        if rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = burst
+                if len(self._buckets) >= self.max_clients:
+                    _, oldest = self._buckets.popitem(last=False)
+                    if oldest.refill(rate, burst, now) < burst:
+                        tokens = 0
+                bucket = self._buckets[key] = TokenBucket(tokens, now)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.take(rate, burst, now)
+
+    def client_count(self):
+        return len(self._buckets)
+
+
+# Limiteurs des écritures de l'API (POST /api/poids): par poste et par adresse;
+# une série (POST /api/poids/batch) ne compte que pour son adresse
+writes = RateLimiter()
+addresses = RateLimiter()
+diagnostics.register_bound("rate_limit_clients", writes.client_count, MAX_CLIENTS)
+diagnostics.register_bound("rate_limit_addresses", addresses.client_count, MAX_CLIENTS)
+
+
+def check_write(address, desktop, rate, burst):
+    """Limite d'écriture d'un poste puis de son adresse. Retourne 0 ou le délai conseillé (s)."""
+    return (writes.check((address, desktop), rate, burst)
+            or addresses.check(address, rate * ADDRESS_SHARE, burst * ADDRESS_SHARE))
+
+
+def check_batch(address, rate, burst):
+    """
+    Limite d'une série de poids (POST /api/poids/batch): un seul jeton, pris
+    dans le seau de l'adresse, quels que soient les postes de la série.
+    Retourne 0 ou le délai conseillé (s).
+    """
+    return addresses.check(address, rate * ADDRESS_SHARE, burst * ADDRESS_SHARE)
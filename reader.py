@@ -0,0 +1,431 @@
+import logging
+import time
+from collections import deque
+
+import serial
+import serial.tools.list_ports
+
+import analysis
+import archive
+import cycles
+import diagnostics
+import metrics
+import protocols
+from config import settings, DESKTOP, SCHEMA
+from state import weights
+
+# --- Acquisition: port série, décodage, stabilisation, enregistrement ---
+# Ne dépend ni de pywin32 ni de Flask: le même code tourne dans le service
+# Windows, les benchmarks et les outils de test sous Linux.
+
+logger = logging.getLogger("OdmService")
+
+RETRY_DELAY = 0.5  # Délai avant un nouvel appel à 'connect' quand la balance est absente (secondes)
+ERROR_DELAY = 5  # Délai après une erreur inattendue du lecteur (secondes)
+MAX_READ = 4096  # Octets lus au plus par appel, quel que soit in_waiting
+BUFFER_LIMIT = MAX_READ + 64  # Borne du buffer de réception (lecture + trame incomplète)
+
+# --- Recherche de la balance ---
+# Lister les ports ne les ouvre pas et ne coûte que quelques millisecondes:
+# l'inventaire est relu à chaque appel (toutes les RETRY_DELAY secondes tant
+# que la balance est absente). Un port n'est ouvert pour être testé que:
+#  - quand l'inventaire change (branchement): la balance déjà connue si elle
+#    réapparaît (identifiée par VID/PID/numéro de série, quel que soit son
+#    nom de port), sinon les ports apparus;
+#  - sinon, pour un test complet de tous les ports, à intervalle doublé à
+#    chaque échec, de PROBE_BACKOFF_MIN à PROBE_BACKOFF_MAX (balance mise
+#    sous tension derrière un adaptateur déjà branché, par exemple).
+# Un test se termine dès qu'un protocole est reconnu, au plus PROBE_TIMEOUT.
+
+PROBE_TIMEOUT = 1.0  # Attente maximale des premiers octets d'un port testé (secondes)
+PROBE_BACKOFF_MIN = 1.0  # Délai avant le premier test complet après un échec (secondes)
+PROBE_BACKOFF_MAX = 60.0
+
+
+def port_key(info):
+    """
+    Identité d'un port: VID/PID/numéro de série (USB), ou nom du port (port
+    natif). Deux adaptateurs identiques sans numéro de série se distinguent
+    par leur nom de port.
+    """
+    if info.vid is not None:
+        return (info.vid, info.pid, info.serial_number or info.device)
+    return info.device
+
+
+def open_port(device, timeout):
+    return serial.Serial(
+        port=device,
+        baudrate=settings.get('baudrate'),
+        bytesize=serial.EIGHTBITS,
+        parity=serial.PARITY_NONE,
+        stopbits=serial.STOPBITS_ONE,
+        timeout=timeout
+    )
+
+
+class ScaleLocator:
+    """
+    Fonction 'connect' du lecteur: retourne (port série ouvert, protocole)
+    ou (None, None). 'list_ports' et 'open_port' remplacent pyserial
+    (simulateurs).
+    """
+
+    def __init__(self, list_ports=None, open_port=open_port):
+        self.list_ports = list_ports or serial.tools.list_ports.comports
+        self.open_port = open_port
+        self.known = None  # Identité du port de la dernière balance trouvée
+        self.inventory = None  # Identité -> nom des ports lors du dernier appel
+        self.backoff = PROBE_BACKOFF_MIN
+        self.next_probe = 0.0
+
+    def _inventory(self):
+        configured_port = settings.get('port')
+        return {port_key(info): info.device for info in self.list_ports()
+                if not configured_port or info.device == configured_port}
+
+    def __call__(self):
+        inventory = self._inventory()
+        previous, self.inventory = self.inventory, inventory
+        now = time.monotonic()
+        if inventory != previous:
+            if previous is not None:
+                metrics.incr('port_inventory_changes')
+            self.backoff = PROBE_BACKOFF_MIN
+            added = [key for key in inventory if previous is None or key not in previous]
+            logger.info(f"Ports disponibles: {sorted(inventory.values())}")
+        elif now >= self.next_probe:
+            added = list(inventory)
+        else:
+            return None, None
+
+        # La balance connue d'abord: reconnexion directe à son nouveau port
+        keys = [self.known] if self.known in inventory else []
+        keys += [key for key in added if key != self.known]
+        for i, key in enumerate(keys):
+            if i and self._inventory() != inventory:
+                break  # Branchement pendant les tests: traité dès le prochain appel
+            ser, protocol = self._probe(inventory[key])
+            if ser:
+                self.known = key
+                self.backoff = PROBE_BACKOFF_MIN
+                self.next_probe = 0.0
+                return ser, protocol
+        if keys or now >= self.next_probe:
+            self.next_probe = time.monotonic() + self.backoff
+            self.backoff = min(self.backoff * 2, PROBE_BACKOFF_MAX)
+        return None, None
+
+    def _probe(self, device):
+        """Ouvre le port et identifie le protocole à partir des premiers octets reçus."""
+        configured_protocol = settings.get('protocol')
+        candidates = [protocols.get(configured_protocol)] if configured_protocol else None
+        # Deux trames de la plus grande longueur garantissent au moins une trame complète
+        needed = 2 * protocols.max_frame_length()
+        ser = None
+        try:
+            logger.info(f"Test du port {device}")
+            metrics.incr('port_probes')
+            ser = self.open_port(device, 0.1)
+            data = bytearray()
+            protocol = None
+            deadline = time.monotonic() + PROBE_TIMEOUT
+            while protocol is None and time.monotonic() < deadline:
+                data += ser.read(max(ser.in_waiting, needed - len(data), 1))
+                if len(data) >= needed:
+                    protocol = protocols.detect(data, candidates)
+                    del data[:-needed]
+            if protocol:
+                logger.info(f"Balance détectée sur {device} (protocole {protocol.name})")
+                ser.reset_input_buffer()
+                return ser, protocol
+            ser.close()
+        except Exception as e:
+            logger.error(f"Erreur sur {device}: {type(e).__name__} - {e}")
+            if ser is not None and ser.is_open:
+                ser.close()
+        return None, None
+
+
+# Recherche utilisée par le service (un seul lecteur par processus)
+locator = None
+
+
+def find_scale_port():
+    """
+    Trouve la balance (ou utilise le port configuré) et identifie son
+    protocole. Retourne (port série ouvert, protocole) ou (None, None).
+    """
+    global locator
+    if locator is None:
+        locator = ScaleLocator()
+    return locator()
+
+
+def save_weight_locally(weight_kg, desktop=DESKTOP):
+    """Saves the weight to the local database (and the in-memory state)."""
+    try:
+        # Les écritures de la balance passent avant celles de l'API
+        if weights.add(weight_kg, desktop, settings.get('company'), priority=True) is None:
+            logger.error(f"Erreur d'enregistrement local du poids {weight_kg}kg.")
+            return False
+        logger.info(f"Poids {weight_kg}kg enregistré localement.")
+        return True
+    except Exception as e:
+        logger.error(f"Erreur d'enregistrement local: {e}")
+        return False
+
+def save_cycle_locally(cycle, desktop=DESKTOP):
+    """Saves a complete weighing cycle (peak weight) to the local database."""
+    try:
+        if weights.add_cycle(cycle, desktop, settings.get('company')) is None:
+            logger.error(f"Erreur d'enregistrement local de la pesée {cycle.peak}kg.")
+            return False
+        logger.info(f"Pesée {cycle.peak}kg enregistrée localement "
+                    f"(stabilisée en {cycle.settle_s:.1f}s, cycle de {cycle.ended_at - cycle.started_at:.1f}s).")
+        return True
+    except Exception as e:
+        logger.error(f"Erreur d'enregistrement local: {e}")
+        return False
+
+def get_latest_recorded_weight(desktop=DESKTOP):
+    """Dernier poids enregistré pour ce poste, lu depuis l'état en mémoire (sans accès disque)."""
+    data = weights.latest(desktop, settings.get('company'))
+    if data:
+        return float(data["valeur"])
+    return 0.0
+
+
+class ScaleReader:
+    """
+    Boucle d'acquisition. 'connect' retourne (port série, protocole) ou
+    (None, None); 'stop_event' est un threading.Event positionné à l'arrêt.
+    'desktop' identifie le poste dans les enregistrements (plusieurs
+    balances simulées dans un même processus, par exemple).
+    """
+
+    def __init__(self, stop_event, connect=find_scale_port, retry_delay=RETRY_DELAY, desktop=DESKTOP):
+        self.stop_event = stop_event
+        self.connect = connect
+        self.retry_delay = retry_delay
+        self.desktop = desktop
+        self.buffer = bytearray()
+        self.ser = None
+        self.protocol = None
+        self.status = "starting"
+        self.connected_at = None
+        self.disconnected_at = None
+        self.last_frame_at = None
+        self.restart_requested = False
+        self.recent_readings = deque(maxlen=settings.get('stabilization_count'))
+        self.last_sent_time = 0
+        self.last_sent_weight = None
+        self.cycles = cycles.CycleDetector()
+
+        diagnostics.register_bound(f"reader_buffer[{desktop}]", lambda: len(self.buffer), BUFFER_LIMIT)
+        diagnostics.register_bound(f"reader_readings[{desktop}]", lambda: len(self.recent_readings),
+                                   SCHEMA['stabilization_count'][3])
+
+    @property
+    def port_name(self):
+        ser = self.ser
+        return ser.port if ser else None
+
+    @property
+    def protocol_name(self):
+        protocol = self.protocol
+        return protocol.name if protocol else None
+
+    # Sorties du lecteur, redéfinies par le processus d'acquisition séparé
+    # (acquisition.py), qui les publie au service au lieu d'écrire lui-même.
+
+    def publish_live(self, reading):
+        weights.set_live(*reading)
+        analysis.record(reading.weight, self.last_frame_at)
+
+    def persist(self, weight):
+        return save_weight_locally(weight, self.desktop)
+
+    def persist_cycle(self, cycle):
+        return save_cycle_locally(cycle, self.desktop)
+
+    def latest_recorded(self):
+        return get_latest_recorded_weight(self.desktop)
+
+    def close(self):
+        """Ferme le port série (appelé depuis un autre thread pour débloquer la lecture)."""
+        ser = self.ser
+        if ser and ser.is_open:
+            ser.close()
+            logger.info("Port série fermé")
+
+    def restart(self):
+        """
+        Démonte et reconstruit la connexion série (appelé par le watchdog).
+        La fermeture du port débloque une lecture en cours; la boucle
+        repart alors sur une nouvelle recherche de la balance.
+        """
+        self.restart_requested = True
+        self.close()
+
+    def run(self):
+        searching = False
+        while not self.stop_event.is_set():
+            try:
+                if not searching:
+                    self.status = "connecting"
+                self.restart_requested = False
+                self.ser, self.protocol = self.connect()
+
+                if not self.ser:
+                    self.status = "disconnected"
+                    if not searching:
+                        searching = True
+                        logger.warning("Balance non détectée! Surveillance des ports série.")
+                    self.stop_event.wait(self.retry_delay)
+                    continue
+                searching = False
+
+                if self.disconnected_at is not None:
+                    # Délai entre la perte de la connexion et son rétablissement
+                    reconnect_ms = (time.time() - self.disconnected_at) * 1000
+                    metrics.observe('reconnect_ms', reconnect_ms)
+                    metrics.incr('reader_reconnects')
+                    self.disconnected_at = None
+                    logger.info(f"Connexion rétablie sur {self.ser.port} en {reconnect_ms:.0f} ms")
+                else:
+                    logger.info(f"Connexion établie sur {self.ser.port}")
+                self.status = "connected"
+                self.connected_at = time.time()
+                self.read_loop()
+                self.close()
+                self.recent_readings.clear()
+                if not self.stop_event.is_set():
+                    self.disconnected_at = time.time()
+
+            except Exception as e:
+                logger.exception(f"ERREUR MAJEURE: {type(e).__name__} - {e}")
+                self.stop_event.wait(ERROR_DELAY)
+
+        self.status = "stopped"
+        logger.info("Arrêt du lecteur")
+
+    def read_loop(self):
+        """Lit le port connecté jusqu'à l'arrêt, une erreur ou un changement de port."""
+        buffer = self.buffer
+        buffer.clear()
+        cfg = settings.snapshot()
+        config_generation = settings.generation
+        self.recent_readings = deque(maxlen=cfg['stabilization_count'])
+        self.last_sent_time = 0
+        self.last_sent_weight = None
+        self.cycles = cycles.CycleDetector(
+            cfg['stabilization_count'], cfg['stabilization_tolerance'], cfg['cycle_empty_threshold'])
+
+        self.ser.timeout = 0.1
+
+        while not self.stop_event.is_set() and not self.restart_requested:
+            try:
+                # Prise en compte à chaud d'une nouvelle configuration,
+                # sans fermer le port série
+                if settings.generation != config_generation:
+                    config_generation = settings.generation
+                    previous, cfg = cfg, settings.snapshot()
+                    if cfg['port'] and cfg['port'] != self.ser.port:
+                        logger.info(f"Port configuré modifié ({cfg['port']}), reconnexion.")
+                        return
+                    if cfg['baudrate'] != previous['baudrate']:
+                        # pyserial reconfigure le port ouvert sans le fermer
+                        self.ser.baudrate = cfg['baudrate']
+                    if cfg['protocol'] and cfg['protocol'] != self.protocol.name:
+                        self.protocol = protocols.get(cfg['protocol'])
+                        buffer.clear()
+                        self.recent_readings.clear()
+                    if cfg['stabilization_count'] != self.recent_readings.maxlen:
+                        self.recent_readings = deque(self.recent_readings, maxlen=cfg['stabilization_count'])
+                    self.cycles.configure(
+                        cfg['stabilization_count'], cfg['stabilization_tolerance'], cfg['cycle_empty_threshold'])
+                    metrics.observe('config_apply_latency_ms', (time.time() - settings.applied_at) * 1000)
+                    logger.info(f"Configuration {config_generation} appliquée au lecteur.")
+
+                # La lecture attend au plus ser.timeout quand rien n'arrive
+                chunk = self.ser.read(min(self.ser.in_waiting, MAX_READ) or 1)
+                if chunk:
+                    archive.record(chunk)
+                    buffer.extend(chunk)
+                    if len(buffer) > BUFFER_LIMIT:
+                        # Ne peut arriver qu'avec un protocole mal défini: on garde la fin
+                        del buffer[:len(buffer) - BUFFER_LIMIT]
+                        metrics.incr('reader_buffer_overflow')
+
+                readings, consumed = self.protocol.scan(buffer)
+                if consumed:
+                    # Le buffer ne conserve jamais plus qu'une trame incomplète
+                    del buffer[:consumed]
+
+                if readings:
+                    if self.last_frame_at is None:
+                        metrics.set_gauge('startup_first_frame_ms', round(metrics.uptime() * 1000))
+                    self.last_frame_at = time.time()
+                    self.publish_live(readings[-1])
+                for reading in readings:
+                    self.handle_reading(reading, cfg)
+
+            except serial.SerialException as se:
+                if not self.restart_requested:
+                    logger.error(f"ERREUR PORT SÉRIE: {se}. Déconnexion.")
+                return
+            except Exception as e:
+                if not self.restart_requested:
+                    logger.exception(f"ERREUR LECTURE: {type(e).__name__} - {e}")
+                    self.stop_event.wait(ERROR_DELAY)
+                return
+
+    def handle_reading(self, reading, cfg):
+        """Stabilisation d'une lecture et enregistrement du poids stable si nécessaire."""
+        if cfg['weighing_mode'] == "cycle":
+            cycle = self.cycles.feed(reading.weight, reading.stable, self.last_frame_at)
+            if cycle and self.persist_cycle(cycle):
+                metrics.observe('cycle_end_to_persist_ms', (time.time() - cycle.ended_at) * 1000)
+            return
+
+        if reading.stable is False:
+            # L'indicateur signale lui-même un poids en mouvement
+            self.recent_readings.clear()
+            return
+
+        recent_readings = self.recent_readings
+        recent_readings.append(reading.weight)
+        if len(recent_readings) < recent_readings.maxlen:
+            return
+        if (max(recent_readings) - min(recent_readings)) > cfg['stabilization_tolerance']:
+            return
+
+        stable_weight = recent_readings[-1]
+        if stable_weight < 0 or stable_weight == self.last_sent_weight:
+            return
+
+        time_since_last = time.time() - self.last_sent_time
+        if time_since_last < cfg['min_send_interval']:
+            logger.debug(f"Valeur stable {stable_weight}kg, mais délai non écoulé ({cfg['min_send_interval'] - time_since_last:.1f}s restants).")
+            return
+
+        should_send = False
+        if stable_weight == 0:
+            # Un retour à zéro n'est enregistré que si le dernier poids enregistré n'est pas déjà 0
+            local_weight = self.latest_recorded()
+            if local_weight != 0:
+                should_send = True
+            else:
+                logger.debug("Poids stable à 0, le dernier poids enregistré est déjà 0.")
+                self.last_sent_weight = 0
+        else: # Poids positif
+            should_send = True
+
+        if should_send:
+            if self.persist(stable_weight):
+                # Délai entre la réception de la trame qui a validé la stabilité et l'écriture
+                metrics.observe('frame_to_persist_ms', (time.time() - self.last_frame_at) * 1000)
+                self.last_sent_weight = stable_weight
+                self.last_sent_time = time.time()
+                recent_readings.clear()
@@ -0,0 +1,169 @@
+import itertools
+import random
+import time
+
+import protocols
+
+# --- Balance simulée ---
+# Remplace un port pyserial ouvert (mêmes attributs et méthodes que ceux
+# utilisés par reader.py) pour les benchmarks et les tests d'endurance.
+
+
+class SimulatedSerial:
+    """
+    Port série simulé qui émet en continu des trames d'un protocole donné,
+    au débit réel du baudrate (10 bits par octet) multiplié par 'speed'.
+    'weights' est un itérable de poids (kg); la dernière valeur est répétée
+    une fois l'itérable épuisé.
+    """
+
+    def __init__(self, protocol=None, weights=(0,), port='SIM0', baudrate=9600, timeout=0.1, speed=1.0):
+        self.protocol = protocol or protocols.get('ww-kg')
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.speed = speed
+        self.is_open = True
+        self.stalled = False  # True: le port reste ouvert mais plus rien n'arrive (adaptateur figé)
+        self._weights = iter(weights)
+        self._weight = 0
+        self._pending = bytearray()
+        self._next_frame_at = time.perf_counter()
+
+    @property
+    def frame_interval(self):
+        return self.protocol.frame_length * 10 / (self.baudrate * self.speed)
+
+    def _produce(self):
+        now = time.perf_counter()
+        if self.stalled:
+            self._next_frame_at = max(self._next_frame_at, now)
+            return
+        while self._next_frame_at <= now:
+            self._weight = next(self._weights, self._weight)
+            self._pending += self.protocol.encode(self._weight)
+            self._next_frame_at += self.frame_interval
+
+    @property
+    def in_waiting(self):
+        self._produce()
+        return len(self._pending)
+
+    def read(self, size=1):
+        if not self.is_open:
+            raise _port_error("Port simulé fermé")
+        self._produce()
+        if not self._pending and self.timeout:
+            # Comme pyserial: attendre au plus 'timeout' qu'un octet arrive
+            wait = self.timeout if self.stalled else min(self._next_frame_at - time.perf_counter(), self.timeout)
+            time.sleep(max(0.0, wait))
+            self._produce()
+        data = bytes(self._pending[:size])
+        del self._pending[:size]
+        return data
+
+    def reset_input_buffer(self):
+        self._pending.clear()
+
+    def close(self):
+        self.is_open = False
+
+
+class FloodSerial:
+    """
+    Port série qui ne transmet que des données invalides (octets aléatoires,
+    trames presque valides, préfixes répétés), aussi vite qu'on les lit, et
+    annonce toujours 'chunk' octets en attente.
+    """
+
+    NEAR_MISSES = (
+        b'ww  12 3kx', b'wx   1234kg', b'wn12345678kg', b'wwwwwwwwwwwwwwww',
+        b'ST,+00012.34 kx\r\n', b'ST,GS,+0012.3kg\r\n', b'OL,+99999999 kg\r\n', b'ST,ST,ST,ST,',
+    )
+
+    def __init__(self, port='FLOOD0', chunk=65536, seed=0):
+        rng = random.Random(seed)
+        parts = []
+        while sum(len(p) for p in parts) < 4 * chunk:
+            if rng.random() < 0.5:
+                parts.append(rng.choice(self.NEAR_MISSES))
+            else:
+                parts.append(bytes(rng.getrandbits(8) for _ in range(rng.randint(1, 64))))
+        self._pool = b''.join(parts)
+        self._offset = 0
+        self.port = port
+        self.baudrate = 9600
+        self.timeout = 0.1
+        self.chunk = chunk
+        self.is_open = True
+        self.bytes_sent = 0
+
+    @property
+    def in_waiting(self):
+        return self.chunk
+
+    def read(self, size=1):
+        if not self.is_open:
+            raise _port_error("Port simulé fermé")
+        start = self._offset % (len(self._pool) - size)
+        self._offset = start + size
+        self.bytes_sent += size
+        return self._pool[start:start + size]
+
+    def reset_input_buffer(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+class SimulatedPortInfo:
+    """Entrée de l'inventaire des ports (mêmes attributs que ceux de pyserial utilisés par reader.py)."""
+
+    def __init__(self, device, vid=None, pid=None, serial_number=None):
+        self.device = device
+        self.vid = vid
+        self.pid = pid
+        self.serial_number = serial_number
+
+
+def _port_error(message):
+    """Erreur équivalente à une déconnexion pyserial (sans dépendre de pyserial)."""
+    try:
+        import serial
+        return serial.SerialException(message)
+    except ImportError:
+        return OSError(message)
+
+
+def connect_factory(protocol=None, weights=(0,), **kwargs):
+    """Retourne une fonction 'connect' utilisable par reader.ScaleReader."""
+    protocol = protocol or protocols.get('ww-kg')
+
+    def connect():
+        return SimulatedSerial(protocol, weights, **kwargs), protocol
+
+    return connect
+
+
+class PlateauScale:
+    """
+    Fonction 'connect' sérialisable (processus d'acquisition séparé, voir
+    acquisition.py): balance simulée à paliers, protocole désigné par son nom.
+    """
+
+    def __init__(self, protocol='ww-kg', loads=(0, 1250, 0, 830, 0), readings_per_plateau=20, **kwargs):
+        self.protocol = protocol
+        self.loads = loads
+        self.readings_per_plateau = readings_per_plateau
+        self.kwargs = kwargs
+
+    def __call__(self):
+        protocol = protocols.get(self.protocol)
+        weights = plateau_weights(self.loads, self.readings_per_plateau)
+        return SimulatedSerial(protocol, weights, **self.kwargs), protocol
+
+
+def plateau_weights(loads=(0, 1250, 0, 830, 0), readings_per_plateau=20):
+    """Séquence de poids par paliers (chargement, stabilisation, déchargement), en boucle."""
+    return itertools.cycle([w for w in loads for _ in range(readings_per_plateau)])
@@ -0,0 +1,264 @@
+"""
+Test d'endurance et de charge du cœur du service, sous Linux, avec balances simulées:
+
+    python soak.py [--duration S] [--speed X] [--scales N] [--clients N]
+                   [--get-rate R] [--post-rate R] [--sample-interval S]
+                   [--reader-process] [--durability PROFIL] [--storage MOTEUR]
+
+Le cœur du service (core.ServiceCore: base, API HTTP, lecteur, watchdog,
+nettoyage) tourne sans pywin32, alimenté par des balances simulées. Des
+clients HTTP interrogent GET/POST /api/poids en parallèle.
+
+--speed accélère le temps simulé: trames, paliers de pesée, délai minimal
+entre envois et nettoyages sont divisés d'autant. À 100, une heure de test
+rejoue environ quatre jours de fonctionnement.
+
+Chaque période d'échantillonnage affiche les latences API (p50/p99), le délai
+trame -> enregistrement, la mémoire (RSS), le nombre de threads et la taille
+de poids.db. Le code de sortie est 1 si la mémoire, la latence ou la base
+dérivent au-delà des seuils.
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+
+OUT = sys.__stdout__
+
+
+def rss_mb():
+    """Mémoire résidente actuelle du processus (Mo)."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    # Repli: pic de mémoire (ko sous Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def stored_kb():
+    """Taille sur disque du stockage des poids (ko); 0 pour le stockage en mémoire."""
+    import datastore
+    import storage
+    path = storage.backend.path if storage.backend.name == "log" else datastore.DB_PATH
+    return os.path.getsize(path) / 1024.0 if os.path.exists(path) else 0.0
+
+
+def percentiles(values):
+    if not values:
+        return None, None
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2], ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+
+
+class LatencyWindow:
+    """Latences (ms) de la période d'échantillonnage en cours, par opération."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+        self.errors = 0
+
+    def record(self, name, value_ms):
+        with self._lock:
+            self._samples.setdefault(name, []).append(value_ms)
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+    def take(self):
+        with self._lock:
+            samples, self._samples = self._samples, {}
+            return samples
+
+
+def client_loop(host, port, get_rate, post_rate, window, stop_event, desktop):
+    """Un client HTTP keep-alive qui enchaîne GET et POST aux débits demandés."""
+    conn = http.client.HTTPConnection(host, port, timeout=5)
+    now = time.perf_counter()
+    next_get = now if get_rate else float('inf')
+    next_post = now if post_rate else float('inf')
+    weight = 0
+    while not stop_event.is_set():
+        due = min(next_get, next_post)
+        delay = due - time.perf_counter()
+        if delay > 0 and stop_event.wait(delay):
+            break
+        if next_get <= next_post:
+            name, method, path, body = 'GET', 'GET', '/api/poids', None
+            next_get += 1.0 / get_rate
+        else:
+            weight = (weight + 7) % 5000
+            name, method, path = 'POST', 'POST', '/api/poids'
+            body = json.dumps({"poids": weight, "desktop": desktop})
+            next_post += 1.0 / post_rate
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 500:
+                window.error()
+            window.record(name, (time.perf_counter() - start) * 1000)
+        except (OSError, http.client.HTTPException):
+            window.error()
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=5)
+    conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test d'endurance OdmService (balances simulées)")
+    parser.add_argument("--duration", type=float, default=300, help="durée réelle du test (s)")
+    parser.add_argument("--speed", type=float, default=100, help="facteur d'accélération du temps simulé")
+    parser.add_argument("--scales", type=int, default=2, help="nombre de balances simulées")
+    parser.add_argument("--clients", type=int, default=4, help="nombre de clients HTTP")
+    parser.add_argument("--get-rate", type=float, default=20, help="GET /api/poids par seconde et par client")
+    parser.add_argument("--post-rate", type=float, default=2, help="POST /api/poids par seconde et par client")
+    parser.add_argument("--sample-interval", type=float, default=10, help="période d'échantillonnage (s)")
+    parser.add_argument("--warmup", type=float, default=20, help="durée de chauffe exclue des références (s)")
+    parser.add_argument("--max-rss-growth-mb", type=float, default=20)
+    parser.add_argument("--max-p99-ms", type=float, default=250)
+    parser.add_argument("--max-latency-drift", type=float, default=3.0,
+                        help="p99 final maximal, en multiple du p99 de référence")
+    parser.add_argument("--max-db-mb", type=float, default=5)
+    parser.add_argument("--db", help="chemin de poids.db (défaut: dossier temporaire)")
+    parser.add_argument("--reader-process", action="store_true",
+                        help="acquisition de la première balance dans un processus séparé")
+    parser.add_argument("--durability", choices=("strict", "balanced", "relaxed"), default="strict",
+                        help="profil de durabilité de la base (voir datastore.py)")
+    parser.add_argument("--storage", choices=("sqlite", "memory", "log"), default="sqlite",
+                        help="moteur de stockage des poids (voir storage.py)")
+    args = parser.parse_args(argv)
+
+    # Une ligne de journal par requête fausserait les mesures
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    import datastore
+    datastore.DB_PATH = args.db or os.path.join(tempfile.mkdtemp(prefix="odm-soak-"), "poids.db")
+
+    import core
+    import metrics
+    import reader
+    import simulator
+    from config import settings, DESKTOP
+
+    settings.update({
+        "min_send_interval": 2.0 / args.speed,
+        "cleanup_interval": max(10, int(600 / args.speed)),
+        "reader_process": args.reader_process,
+        "durability": args.durability,
+        "storage": args.storage,
+    }, persist=False)
+
+    def scale(i):
+        # Paliers d'environ une seconde simulée chacun
+        return simulator.connect_factory(
+            weights=simulator.plateau_weights(readings_per_plateau=90),
+            port=f"SIM{i}", speed=args.speed,
+        )
+
+    stop = threading.Event()
+    window = LatencyWindow()
+    failures = []
+
+    # Les print() de datastore (un par écriture) sont écartés pendant le test
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        # Le processus d'acquisition exige une fonction 'connect' sérialisable
+        first = (simulator.PlateauScale(readings_per_plateau=90, port="SIM0", speed=args.speed)
+                 if args.reader_process else scale(0))
+        service = core.ServiceCore(connect=first, http_host='127.0.0.1', http_port=0)
+        runner = threading.Thread(target=service.run, daemon=True)
+        runner.start()
+        if not service.http_ready.wait(30):
+            print("ÉCHEC: l'API HTTP n'a pas démarré", file=OUT)
+            return 1
+        port = service.http_server.server_port
+
+        for i in range(1, args.scales):
+            extra = reader.ScaleReader(service.stop_event, connect=scale(i), desktop=f"{DESKTOP}-SIM{i}")
+            threading.Thread(target=extra.run, daemon=True).start()
+
+        for i in range(args.clients):
+            threading.Thread(
+                target=client_loop,
+                args=('127.0.0.1', port, args.get_rate, args.post_rate, window, stop, f"CLIENT{i}"),
+                daemon=True,
+            ).start()
+
+        print(f"{'t(s)':>6} {'simulé':>8} {'GET p50/p99':>14} {'POST p50/p99':>14} "
+              f"{'trame->DB p99':>13} {'RSS Mo':>7} {'threads':>7} {'DB ko':>7} {'err':>4}", file=OUT)
+
+        start = time.time()
+        baseline = None
+        history = deque(maxlen=3)
+        while time.time() - start < args.duration:
+            time.sleep(args.sample_interval)
+            elapsed = time.time() - start
+            samples = window.take()
+            get_p50, get_p99 = percentiles(samples.get('GET'))
+            post_p50, post_p99 = percentiles(samples.get('POST'))
+            persist = metrics.snapshot()["timings"].get('frame_to_persist_ms', {})
+            sample = {
+                "rss": rss_mb(),
+                "threads": threading.active_count(),
+                "db_kb": stored_kb(),
+                "p99": max(v for v in (get_p99, post_p99, 0) if v is not None),
+            }
+            history.append(sample)
+
+            def fmt(p50, p99):
+                return f"{p50:.1f}/{p99:.1f}" if p50 is not None else "-"
+
+            print(f"{elapsed:>6.0f} {elapsed * args.speed / 3600:>7.1f}h {fmt(get_p50, get_p99):>14} "
+                  f"{fmt(post_p50, post_p99):>14} {persist.get('p99', 0):>13.1f} {sample['rss']:>7.1f} "
+                  f"{sample['threads']:>7} {sample['db_kb']:>7.0f} {window.errors:>4}", file=OUT)
+
+            if baseline is None and elapsed >= args.warmup:
+                baseline = sample
+            if sample["p99"] > args.max_p99_ms:
+                failures.append(f"p99 {sample['p99']:.1f} ms > {args.max_p99_ms} ms à t={elapsed:.0f}s")
+
+        stop.set()
+        service.stop()
+        # run() retourne une fois les écritures en cours terminées et le stockage fermé
+        runner.join(10)
+
+    final = history[-1] if history else None
+    if baseline and final:
+        # Moyenne des dernières périodes pour ne pas échouer sur un pic isolé
+        rss_end = sum(s["rss"] for s in history) / len(history)
+        p99_end = sum(s["p99"] for s in history) / len(history)
+        if rss_end - baseline["rss"] > args.max_rss_growth_mb:
+            failures.append(f"RSS +{rss_end - baseline['rss']:.1f} Mo depuis la référence")
+        if baseline["p99"] and p99_end > baseline["p99"] * args.max_latency_drift and p99_end > 10:
+            failures.append(f"p99 {p99_end:.1f} ms contre {baseline['p99']:.1f} ms en référence")
+        # Le serveur HTTP crée un thread par requête en cours: marge d'un thread par client
+        if final["threads"] > baseline["threads"] + args.clients + 2:
+            failures.append(f"threads {baseline['threads']} -> {final['threads']}")
+    if final and final["db_kb"] / 1024.0 > args.max_db_mb:
+        failures.append(f"poids.db {final['db_kb'] / 1024.0:.1f} Mo > {args.max_db_mb} Mo")
+    if window.errors:
+        failures.append(f"{window.errors} erreurs HTTP")
+
+    for failure in failures:
+        print(f"ÉCHEC: {failure}", file=OUT)
+    if not failures:
+        print("OK", file=OUT)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
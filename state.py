@@ -0,0 +1,263 @@
+import threading
+import time
+from collections import OrderedDict
+
+import datastore
+import diagnostics
+import metrics
+import storage
+from datastore import IdempotencyConflict
+
+# --- État des poids en mémoire ---
+# Partagé entre le lecteur série et l'API: le dernier poids enregistré par
+# couple (desktop, company) et la lecture courante de la balance. Chargé une
+# fois depuis la base au démarrage puis tenu à jour par le chemin d'écriture,
+# si bien que les lectures (API, contrôle du retour à zéro) ne touchent jamais le disque.
+
+# Nombre maximal de postes gardés en mémoire. POST /api/poids accepte n'importe
+# quel couple (desktop, company): au-delà, les postes les moins récemment
+# écrits sont évincés et relus depuis le stockage si on les redemande.
+MAX_STATIONS = 1000
+
+# Clés d'idempotence récentes gardées en mémoire. Une clé plus ancienne est
+# retrouvée via l'index unique de la table idempotence.
+MAX_IDEMPOTENCY_KEYS = 10000
+
+
+class WriteRejected(Exception):
+    """Écriture refusée par la contre-pression (file trop longue ou verrou indisponible)."""
+
+
+class WriteGate:
+    """
+    Sérialise les écritures en base. Une écriture prioritaire (lecteur série)
+    passe devant toutes les écritures non prioritaires (API) en attente.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._busy = False
+        self._priority_waiting = 0
+
+    def acquire(self, priority=False, timeout=None):
+        """Retourne False si le verrou n'a pas été obtenu dans le délai."""
+        with self._cond:
+            if priority:
+                self._priority_waiting += 1
+            try:
+                acquired = self._cond.wait_for(
+                    lambda: not self._busy and (priority or not self._priority_waiting), timeout)
+                if acquired:
+                    self._busy = True
+                return acquired
+            finally:
+                if priority:
+                    self._priority_waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self._busy = False
+            self._cond.notify_all()
+
+
+class WeightState:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = OrderedDict()  # (desktop, company) -> enregistrement (même forme que la table poids)
+        self._evicted = False
+        self._keys = OrderedDict()  # clé d'idempotence -> enregistrement d'origine
+        self._keys_lock = threading.Lock()  # Sérialise les écritures avec clé d'idempotence
+        self._live = None
+        self._gate = WriteGate()
+        self.pending_writes = 0  # Écritures en attente ou en cours (lecteur + API)
+        self.last_write_at = None
+
+    def load(self):
+        """(Re)charge le dernier enregistrement de chaque poste depuis la base."""
+        rows = storage.backend.latest_per_station()
+        rows.sort(key=lambda row: row['id'])
+        latest = OrderedDict(((row['desktop'], row['company']), row) for row in rows)
+        evicted = False
+        while len(latest) > MAX_STATIONS:
+            latest.popitem(last=False)
+            evicted = True
+        with self._lock:
+            self._latest = latest
+            self._evicted = evicted
+        return len(latest)
+
+    def add(self, valeur, desktop, company, priority=False, timeout=None):
+        """
+        Enregistre un poids en base puis met à jour l'état. Les écritures
+        'priority' (lecteur série) passent devant les autres; 'timeout' borne
+        l'attente du verrou d'écriture (WriteRejected au-delà).
+        Retourne l'enregistrement créé, ou None si l'écriture a échoué.
+        """
+        date = datastore.now_ms()
+        new_id = self._write(priority, timeout, storage.backend.add, valeur, desktop, company, date)
+        if new_id is None:
+            return None
+        row = {"id": new_id, "valeur": float(valeur), "desktop": desktop, "company": company,
+               "date": datastore.format_date(date)}
+        self._remember(row)
+        return dict(row)
+
+    def add_cycle(self, cycle, desktop, company, priority=True):
+        """Enregistre une pesée complète (cycles.Cycle). Retourne l'enregistrement poids, ou None."""
+        started, stable, ended = (int(at * 1000) for at in (cycle.started_at, cycle.stable_at, cycle.ended_at))
+        new_id = self._write(priority, None, storage.backend.add_cycle, cycle.peak, desktop, company, started, stable, ended)
+        if new_id is None:
+            return None
+        row = {"id": new_id, "valeur": float(cycle.peak), "desktop": desktop, "company": company,
+               "date": datastore.format_date(stable)}
+        self._remember(row)
+        return dict(row)
+
+    def add_idempotent(self, valeur, desktop, company, key, timeout=None):
+        """
+        Comme add(), mais une clé d'idempotence déjà vue ne produit pas de
+        nouvel enregistrement: l'enregistrement d'origine est retourné. Une
+        clé déjà vue avec un autre poids lève IdempotencyConflict.
+        Retourne (enregistrement, créé); (None, False) si l'écriture a échoué.
+        """
+        row = self._known_key(key)
+        if row is None:
+            # Une seule écriture par clé à la fois: la seconde requête
+            # concurrente trouve la clé enregistrée par la première.
+            with self._keys_lock:
+                row = self._known_key(key)
+                if row is None:
+                    row, created = self._write(
+                        False, timeout, storage.backend.add_idempotent, valeur, desktop, company, key)
+                    if row is None:
+                        return None, False
+                    with self._lock:
+                        self._keys[key] = row
+                        if len(self._keys) > MAX_IDEMPOTENCY_KEYS:
+                            self._keys.popitem(last=False)
+                    if created:
+                        self._remember(row)
+                        return dict(row), True
+        if not datastore.same_poids(row, valeur, desktop, company):
+            raise IdempotencyConflict(f"Clé d'idempotence déjà utilisée pour un autre poids: {key}")
+        metrics.incr('idempotency_replays')
+        return dict(row), False
+
+    def add_batch(self, items, timeout=None):
+        """
+        Enregistre une série de poids (valeur, desktop, company, clé ou None)
+        en une seule écriture, tous ou aucun (voir storage.Storage.add_batch).
+        Retourne la liste des (enregistrement, créé), ou None si l'écriture a échoué.
+        """
+        date = datastore.now_ms()
+        # Comme add_idempotent: une clé n'est écrite que par une requête à la fois
+        with self._keys_lock:
+            results = self._write(False, timeout, storage.backend.add_batch, items, date)
+            if results is None:
+                return None
+            with self._lock:
+                for (_, _, _, key), (row, _) in zip(items, results):
+                    if key is not None:
+                        self._keys[key] = row
+                        self._keys.move_to_end(key)
+                while len(self._keys) > MAX_IDEMPOTENCY_KEYS:
+                    self._keys.popitem(last=False)
+        for row, created in results:
+            if created:
+                self._remember(row)
+            else:
+                metrics.incr('idempotency_replays')
+        return [(dict(row), created) for row, created in results]
+
+    def forget_keys(self, oldest_id):
+        """
+        Oublie les clés d'idempotence des enregistrements supprimés (ID
+        inférieur à 'oldest_id'; toutes si None), comme le stockage les oublie.
+        Retourne le nombre de clés oubliées.
+        """
+        with self._lock:
+            gone = [key for key, row in self._keys.items() if oldest_id is None or row['id'] < oldest_id]
+            for key in gone:
+                del self._keys[key]
+        return len(gone)
+
+    def _known_key(self, key):
+        with self._lock:
+            row = self._keys.get(key)
+            if row is not None:
+                self._keys.move_to_end(key)
+            return row
+
+    def _write(self, priority, timeout, write, *args):
+        with self._lock:
+            self.pending_writes += 1
+        try:
+            start = time.perf_counter()
+            acquired = self._gate.acquire(priority, timeout)
+            waited = time.perf_counter()
+            metrics.observe('db_lock_wait_ms', (waited - start) * 1000)
+            if not acquired:
+                raise WriteRejected(f"verrou d'écriture indisponible après {waited - start:.3f}s")
+            try:
+                return write(*args)
+            finally:
+                self._gate.release()
+                metrics.observe('db_write_ms', (time.perf_counter() - waited) * 1000)
+        finally:
+            with self._lock:
+                self.pending_writes -= 1
+
+    def _remember(self, row):
+        desktop, company = row['desktop'], row['company']
+        with self._lock:
+            self._latest[(desktop, company)] = row
+            self._latest.move_to_end((desktop, company))
+            if len(self._latest) > MAX_STATIONS:
+                self._latest.popitem(last=False)
+                self._evicted = True
+            self.last_write_at = time.time()
+
+    def latest(self, desktop=None, company=None):
+        """
+        Dernier enregistrement, avec filtres optionnels (mêmes règles que
+        storage.Storage.latest). Retourne un dictionnaire ou None.
+        """
+        with self._lock:
+            if desktop and company:
+                row = self._latest.get((desktop, company))
+            else:
+                candidates = [
+                    row for (d, c), row in self._latest.items()
+                    if (not desktop or d == desktop) and (not company or c == company)
+                ]
+                row = max(candidates, key=lambda r: r['date'], default=None)
+            evicted = self._evicted
+        if row is None and evicted:
+            # Poste évincé de la mémoire: la base fait foi
+            return storage.backend.latest(desktop, company)
+        return dict(row) if row else None
+
+    def station_count(self):
+        return len(self._latest)
+
+    def key_count(self):
+        return len(self._keys)
+
+    def set_live(self, weight, stable=None):
+        """Mémorise la dernière lecture décodée (appelé par le lecteur à chaque trame)."""
+        self._live = (weight, stable, time.time())
+
+    def live(self):
+        """Dernière lecture de la balance: {'poids', 'stable', 'age_s'} ou None."""
+        live = self._live
+        if live is None:
+            return None
+        weight, stable, at = live
+        return {"poids": weight, "stable": stable, "age_s": round(time.time() - at, 3)}
+
+
+# Instance partagée par le service
+weights = WeightState()
+diagnostics.register_bound("weight_state_stations", weights.station_count, MAX_STATIONS)
+diagnostics.register_bound("idempotency_keys", weights.key_count, MAX_IDEMPOTENCY_KEYS)
@@ -0,0 +1,560 @@
+import abc
+import bisect
+import os
+import struct
+import threading
+import zlib
+
+import datastore
+
+# --- Moteurs de stockage des poids ---
+# Le service n'accède aux poids qu'à travers 'backend', choisi au démarrage
+# par le paramètre 'storage':
+#  - "sqlite" (défaut): poids.db, voir datastore.py;
+#  - "memory": tout en mémoire, perdu à l'arrêt (tests, benchmarks);
+#  - "log": journal binaire en ajout seul (poids.log), relu au démarrage, avec
+#    un index en mémoire du dernier poids de chaque poste. Pour les postes où
+#    la latence d'écriture compte plus que les requêtes: une écriture est un
+#    simple ajout en fin de fichier.
+# Les dates passées aux méthodes sont en millisecondes depuis l'epoch (UTC);
+# les enregistrements retournés ont la forme de l'API (date ISO 8601).
+
+ENGINES = ("sqlite", "memory", "log")
+MAX_NAME_LENGTH = 0xFFFF  # Longueur de desktop et company (champ H du journal)
+
+
+class Storage(abc.ABC):
+    """
+    Interface commune des moteurs de stockage. Un moteur qui n'implémente
+    pas toutes les méthodes abstraites ne peut pas être créé.
+    """
+
+    name = None
+
+    def open(self):
+        """Prépare le stockage (schéma, relecture). Appelé une fois au démarrage."""
+
+    def close(self):
+        """Libère les ressources du stockage."""
+
+    def ping(self):
+        """Vérifie que le stockage répond. Lève une exception sinon."""
+
+    @abc.abstractmethod
+    def add(self, valeur, desktop, company, date=None):
+        """Enregistre un poids. Retourne son ID, ou None en cas d'erreur."""
+
+    @abc.abstractmethod
+    def add_idempotent(self, valeur, desktop, company, key, date=None):
+        """
+        Enregistre un poids associé à une clé d'idempotence; une clé déjà
+        utilisée n'insère rien. Retourne (enregistrement, créé), ou (None, False).
+        """
+
+    @abc.abstractmethod
+    def add_batch(self, items, date=None):
+        """
+        Enregistre une série de poids (valeur, desktop, company, clé ou None)
+        en une seule écriture: tous ou aucun. Une clé déjà utilisée n'insère
+        rien; pour un autre poids, elle lève datastore.IdempotencyConflict
+        (rien n'est enregistré). Retourne la liste des (enregistrement, créé), ou None.
+        """
+
+    @abc.abstractmethod
+    def add_cycle(self, valeur, desktop, company, debut, stable, fin):
+        """Enregistre une pesée complète, datée de sa stabilisation. Retourne l'ID du poids, ou None."""
+
+    @abc.abstractmethod
+    def latest(self, desktop=None, company=None):
+        """Enregistrement le plus récent (date, puis ID), avec filtres optionnels, ou None."""
+
+    @abc.abstractmethod
+    def latest_per_station(self):
+        """Dernier enregistrement de chaque couple (desktop, company)."""
+
+    @abc.abstractmethod
+    def oldest_id(self):
+        """ID du plus ancien enregistrement conservé, ou None (stockage vide ou erreur)."""
+
+    @abc.abstractmethod
+    def history(self, desktop=None, company=None, limit=100, before_id=None):
+        """Enregistrements d'ID inférieur à 'before_id', du plus récent au plus ancien."""
+
+    @abc.abstractmethod
+    def cycles(self, desktop=None, company=None, limit=100, before_id=None):
+        """Pesées complètes, comme history(), avec début, stabilisation et fin."""
+
+    @abc.abstractmethod
+    def cleanup(self, keep):
+        """Ne conserve que les 'keep' enregistrements les plus récents. Retourne le nombre supprimé."""
+
+
+class SQLiteStorage(Storage):
+    """poids.db (datastore.DB_PATH), avec le profil de durabilité de datastore."""
+
+    name = "sqlite"
+
+    def open(self):
+        datastore.init_db()
+
+    def ping(self):
+        datastore.ping()
+
+    def add(self, valeur, desktop, company, date=None):
+        return datastore.add_poids(valeur, desktop, company, date)
+
+    def add_idempotent(self, valeur, desktop, company, key, date=None):
+        return datastore.add_poids_idempotent(valeur, desktop, company, key, date)
+
+    def add_batch(self, items, date=None):
+        return datastore.add_poids_batch(items, date)
+
+    def add_cycle(self, valeur, desktop, company, debut, stable, fin):
+        return datastore.add_cycle(valeur, desktop, company, debut, stable, fin)
+
+    def latest(self, desktop=None, company=None):
+        return datastore.get_dernier_poids(desktop, company)
+
+    def latest_per_station(self):
+        return datastore.get_derniers_poids_par_poste()
+
+    def oldest_id(self):
+        return datastore.get_premier_id()
+
+    def history(self, desktop=None, company=None, limit=100, before_id=None):
+        return datastore.get_historique_poids(desktop, company, limit, before_id)
+
+    def cycles(self, desktop=None, company=None, limit=100, before_id=None):
+        return datastore.get_cycles(desktop, company, limit, before_id)
+
+    def cleanup(self, keep):
+        return datastore.cleanup_poids(keep)
+
+
+def _valid(valeur, desktop, company):
+    """Un poids accepté par les moteurs en mémoire: comme datastore, un poids négatif est refusé."""
+    return (isinstance(valeur, (int, float)) and not isinstance(valeur, bool) and valeur >= 0
+            and isinstance(desktop, str) and len(desktop) <= MAX_NAME_LENGTH
+            and isinstance(company, str) and len(company) <= MAX_NAME_LENGTH)
+
+
+def _matches(row, desktop, company):
+    return (not desktop or row[2] == desktop) and (not company or row[3] == company)
+
+
+def _record(row):
+    return {"id": row[0], "valeur": row[1], "desktop": row[2], "company": row[3],
+            "date": datastore.format_date(row[4])}
+
+
+class MemoryStorage(Storage):
+    """
+    Enregistrements en mémoire, triés par ID: (id, valeur, desktop, company,
+    date en ms). Les ID ne sont jamais réattribués, même après un nettoyage.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._rows = []
+        self._ids = []  # ID des lignes, pour la recherche par dichotomie
+        self._latest = {}  # (desktop, company) -> ligne la plus récente
+        self._keys = {}  # clé d'idempotence -> ID
+        self._cycles = {}  # ID -> (début, fin)
+        self._last_id = 0
+
+    def _append(self, valeur, desktop, company, date, new_id=None):
+        new_id = new_id or self._last_id + 1
+        row = (new_id, float(valeur), desktop, company, date)
+        self._rows.append(row)
+        self._ids.append(new_id)
+        self._last_id = new_id
+        current = self._latest.get((desktop, company))
+        if current is None or (date, new_id) >= (current[4], current[0]):
+            self._latest[(desktop, company)] = row
+        return row
+
+    def add(self, valeur, desktop, company, date=None):
+        if not _valid(valeur, desktop, company):
+            return None
+        with self._lock:
+            return self._append(valeur, desktop, company, date or datastore.now_ms())[0]
+
+    def _known(self, key):
+        """Enregistrement d'origine d'une clé d'idempotence, ou None."""
+        known = self._keys.get(key)
+        if known is not None:
+            i = bisect.bisect_left(self._ids, known)
+            if i < len(self._ids) and self._ids[i] == known:
+                return _record(self._rows[i])
+        return None
+
+    def add_idempotent(self, valeur, desktop, company, key, date=None):
+        if not _valid(valeur, desktop, company) or not isinstance(key, str):
+            return None, False
+        with self._lock:
+            known = self._known(key)
+            if known is not None:
+                return known, False
+            row = self._append(valeur, desktop, company, date or datastore.now_ms())
+            self._keys[key] = row[0]
+            return _record(row), True
+
+    def _plan_batch(self, items, date):
+        """
+        Lignes à créer pour add_batch: (résultats, nouvelles lignes avec leur
+        clé), sans rien modifier; None si un poids est invalide.
+        """
+        if not all(_valid(valeur, desktop, company) and (key is None or isinstance(key, str))
+                   for valeur, desktop, company, key in items):
+            return None
+        date = date or datastore.now_ms()
+        results, rows, seen = [], [], {}
+        for valeur, desktop, company, key in items:
+            known = seen.get(key) or (self._known(key) if key is not None else None)
+            if known is not None:
+                if not datastore.same_poids(known, valeur, desktop, company):
+                    raise datastore.IdempotencyConflict(f"Clé d'idempotence déjà utilisée pour un autre poids: {key}")
+                results.append((known, False))
+                continue
+            row = (self._last_id + len(rows) + 1, float(valeur), desktop, company, date)
+            rows.append((row, key))
+            if key is not None:
+                seen[key] = _record(row)
+            results.append((_record(row), True))
+        return results, rows
+
+    def _apply_batch(self, rows):
+        for row, key in rows:
+            self._append(*row[1:], row[0])
+            if key is not None:
+                self._keys[key] = row[0]
+
+    def add_batch(self, items, date=None):
+        with self._lock:
+            plan = self._plan_batch(items, date)
+            if plan is None:
+                return None
+            results, rows = plan
+            self._apply_batch(rows)
+            return results
+
+    def add_cycle(self, valeur, desktop, company, debut, stable, fin):
+        if not _valid(valeur, desktop, company):
+            return None
+        with self._lock:
+            row = self._append(valeur, desktop, company, stable)
+            self._cycles[row[0]] = (debut, fin)
+            return row[0]
+
+    def latest(self, desktop=None, company=None):
+        with self._lock:
+            candidates = [row for row in self._latest.values() if _matches(row, desktop, company)]
+        row = max(candidates, key=lambda r: (r[4], r[0]), default=None)
+        return _record(row) if row else None
+
+    def latest_per_station(self):
+        with self._lock:
+            return [_record(row) for row in self._latest.values()]
+
+    def oldest_id(self):
+        with self._lock:
+            return self._ids[0] if self._ids else None
+
+    def _scan(self, desktop, company, limit, before_id, keep=lambda row: True):
+        with self._lock:
+            end = len(self._ids) if before_id is None else bisect.bisect_left(self._ids, before_id)
+            found = []
+            for i in range(end - 1, -1, -1):
+                row = self._rows[i]
+                if _matches(row, desktop, company) and keep(row):
+                    found.append(row)
+                    if len(found) >= limit:
+                        break
+            return found
+
+    def history(self, desktop=None, company=None, limit=100, before_id=None):
+        return [_record(row) for row in self._scan(desktop, company, limit, before_id)]
+
+    def cycles(self, desktop=None, company=None, limit=100, before_id=None):
+        cycles = []
+        for row in self._scan(desktop, company, limit, before_id, lambda r: r[0] in self._cycles):
+            debut, fin = self._cycles[row[0]]
+            cycle = _record(row)
+            del cycle['date']
+            cycle.update(debut=datastore.format_date(debut), stable=datastore.format_date(row[4]),
+                         fin=datastore.format_date(fin), duree_stabilisation_s=round((row[4] - debut) / 1000, 3))
+            cycles.append(cycle)
+        return cycles
+
+    def cleanup(self, keep):
+        with self._lock:
+            deleted = max(len(self._rows) - keep, 0)
+            if deleted:
+                self._drop(deleted)
+            return deleted
+
+    def _drop(self, count):
+        """Supprime les 'count' plus anciennes lignes et ce qui s'y rapporte."""
+        del self._rows[:count]
+        del self._ids[:count]
+        first = self._ids[0] if self._ids else self._last_id + 1
+        self._keys = {key: i for key, i in self._keys.items() if i >= first}
+        self._cycles = {i: cycle for i, cycle in self._cycles.items() if i >= first}
+        self._latest = {}
+        for row in self._rows:
+            current = self._latest.get((row[2], row[3]))
+            if current is None or (row[4], row[0]) >= (current[4], current[0]):
+                self._latest[(row[2], row[3])] = row
+
+
+# Journal: une entrée = en-tête (type, longueur, CRC32 de la charge utile) + charge utile
+LOG_HEADER = struct.Struct('<BII')
+LOG_POIDS = 1  # id, date, valeur, puis desktop et company (UTF-8, longueur préfixée)
+LOG_KEY = 2  # id, puis la clé d'idempotence (UTF-8)
+LOG_CYCLE = 3  # id, début, fin
+POIDS_FIELDS = struct.Struct('<QqdHH')
+KEY_FIELDS = struct.Struct('<Q')
+CYCLE_FIELDS = struct.Struct('<Qqq')
+
+
+class LogStorage(MemoryStorage):
+    """
+    Journal binaire en ajout seul, relu en mémoire à l'ouverture. Une entrée
+    tronquée ou corrompue en fin de fichier (arrêt pendant une écriture) est
+    ignorée et retirée. 'sync' force un fsync par écriture; sinon l'entrée
+    est confiée au système à chaque écriture (rien n'est perdu si seul le
+    processus s'arrête). Le nettoyage réécrit le journal (compaction).
+    """
+
+    name = "log"
+
+    def __init__(self, path=None, sync=False):
+        super().__init__()
+        self.path = path or os.path.join(os.path.dirname(datastore.DB_PATH), 'poids.log')
+        self.sync = sync
+        self._file = None
+
+    def open(self):
+        with self._lock:
+            self._reset()
+            good = self._replay()
+            self._file = open(self.path, 'ab')
+            if self._file.tell() != good:
+                self._file.truncate(good)
+                self._file.seek(good)
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def ping(self):
+        if self._file is None or self._file.closed:
+            raise OSError("Journal des poids fermé")
+
+    def _replay(self):
+        """Relit le journal. Retourne la position de la fin de la dernière entrée valide."""
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        position = 0
+        while position + LOG_HEADER.size <= len(data):
+            kind, length, crc = LOG_HEADER.unpack_from(data, position)
+            payload = data[position + LOG_HEADER.size:position + LOG_HEADER.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            self._apply(kind, payload)
+            position += LOG_HEADER.size + length
+        return position
+
+    def _apply(self, kind, payload):
+        if kind == LOG_POIDS:
+            new_id, date, valeur, desktop_len, company_len = POIDS_FIELDS.unpack_from(payload)
+            names = payload[POIDS_FIELDS.size:].decode('utf-8')
+            self._append(valeur, names[:desktop_len], names[desktop_len:desktop_len + company_len], date, new_id)
+        elif kind == LOG_KEY:
+            self._keys[payload[KEY_FIELDS.size:].decode('utf-8')] = KEY_FIELDS.unpack_from(payload)[0]
+        elif kind == LOG_CYCLE:
+            new_id, debut, fin = CYCLE_FIELDS.unpack_from(payload)
+            self._cycles[new_id] = (debut, fin)
+
+    @staticmethod
+    def _entry(kind, payload):
+        return LOG_HEADER.pack(kind, len(payload), zlib.crc32(payload)) + payload
+
+    @classmethod
+    def _poids_entry(cls, row):
+        new_id, valeur, desktop, company, date = row
+        # Longueurs en caractères: le découpage se fait après décodage
+        payload = POIDS_FIELDS.pack(new_id, date, valeur, len(desktop), len(company))
+        return cls._entry(LOG_POIDS, payload + (desktop + company).encode('utf-8'))
+
+    def _write(self, data):
+        """
+        Ajoute des entrées au journal. Retourne False en cas d'erreur: le
+        journal est ramené à sa taille d'avant l'écriture (une entrée
+        partielle masquerait les suivantes à la relecture), ou fermé si
+        c'est impossible (ping échoue alors).
+        """
+        if self._file is None or self._file.closed:
+            return False
+        position = self._file.tell()
+        try:
+            self._file.write(data)
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+            return True
+        except OSError as e:
+            print(f"Error adding weight to log: {e}")
+            try:
+                self._file.truncate(position)
+                self._file.seek(position)
+            except OSError:
+                self._file.close()
+                self._file = None
+            return False
+
+    def _commit(self, row, *extra):
+        """
+        Écrit le poids 'row' suivi des entrées 'extra' ((type, champs, texte)).
+        Les entrées sont écrites avant la mise à jour de la mémoire: en cas
+        d'erreur (texte non encodable, écriture impossible), la mémoire reste
+        identique au journal. Retourne True si tout est écrit.
+        """
+        try:
+            data = self._entries(row, *extra)
+        except (ValueError, struct.error) as e:
+            print(f"Error adding weight to log: {e}")
+            return False
+        return self._write(data)
+
+    @classmethod
+    def _entries(cls, row, *extra):
+        return cls._poids_entry(row) + b''.join(
+            cls._entry(kind, fields + text.encode('utf-8')) for kind, fields, text in extra)
+
+    def add(self, valeur, desktop, company, date=None):
+        if not _valid(valeur, desktop, company):
+            return None
+        with self._lock:
+            row = (self._last_id + 1, float(valeur), desktop, company, date or datastore.now_ms())
+            if not self._commit(row):
+                return None
+            return self._append(*row[1:], row[0])[0]
+
+    def add_idempotent(self, valeur, desktop, company, key, date=None):
+        if not _valid(valeur, desktop, company) or not isinstance(key, str):
+            return None, False
+        with self._lock:
+            known = self._known(key)
+            if known is not None:
+                return known, False
+            row = (self._last_id + 1, float(valeur), desktop, company, date or datastore.now_ms())
+            # Poids et clé dans un seul write: un arrêt brutal garde les deux ou aucun
+            if not self._commit(row, (LOG_KEY, KEY_FIELDS.pack(row[0]), key)):
+                return None, False
+            self._append(*row[1:], row[0])
+            self._keys[key] = row[0]
+            return _record(row), True
+
+    def add_batch(self, items, date=None):
+        with self._lock:
+            plan = self._plan_batch(items, date)
+            if plan is None:
+                return None
+            results, rows = plan
+            # Toute la série dans un seul write (au plus un fsync)
+            try:
+                data = b''.join(
+                    self._entries(row, (LOG_KEY, KEY_FIELDS.pack(row[0]), key)) if key is not None
+                    else self._entries(row)
+                    for row, key in rows)
+            except (ValueError, struct.error) as e:
+                print(f"Error adding weights to log: {e}")
+                return None
+            if rows and not self._write(data):
+                return None
+            self._apply_batch(rows)
+            return results
+
+    def add_cycle(self, valeur, desktop, company, debut, stable, fin):
+        if not _valid(valeur, desktop, company):
+            return None
+        with self._lock:
+            row = (self._last_id + 1, float(valeur), desktop, company, stable)
+            if not self._commit(row, (LOG_CYCLE, CYCLE_FIELDS.pack(row[0], debut, fin), '')):
+                return None
+            self._append(*row[1:], row[0])
+            self._cycles[row[0]] = (debut, fin)
+            return row[0]
+
+    def cleanup(self, keep):
+        with self._lock:
+            deleted = max(len(self._rows) - keep, 0)
+            if not deleted or self._file is None:
+                return 0
+            # Réécriture complète sous un nom temporaire, puis remplacement
+            # atomique. Le dernier ID est conservé (entrée du plus récent poids).
+            # La mémoire n'est modifiée qu'une fois le nouveau journal en place.
+            kept = self._rows[deleted:]
+            keys = {}
+            for key, i in self._keys.items():
+                keys.setdefault(i, []).append(key)
+            partial = self.path + '.partial'
+            try:
+                with open(partial, 'wb') as f:
+                    for row in kept:
+                        f.write(self._poids_entry(row))
+                        for key in keys.get(row[0], ()):
+                            f.write(self._entry(LOG_KEY, KEY_FIELDS.pack(row[0]) + key.encode('utf-8')))
+                        if row[0] in self._cycles:
+                            f.write(self._entry(LOG_CYCLE, CYCLE_FIELDS.pack(row[0], *self._cycles[row[0]])))
+                    f.flush()
+                    os.fsync(f.fileno())
+                # Windows refuse de remplacer un fichier ouvert
+                self._file.close()
+                os.replace(partial, self.path)
+            except OSError as e:
+                print(f"Error compacting weight log: {e}")
+                try:
+                    os.remove(partial)
+                except OSError:
+                    pass
+                self._reopen()
+                return 0
+            self._drop(deleted)
+            self._reopen()
+            return deleted
+
+    def _reopen(self):
+        """Rouvre le journal en ajout s'il a été fermé; sans journal, les écritures échouent (ping aussi)."""
+        if self._file is not None and not self._file.closed:
+            return
+        try:
+            self._file = open(self.path, 'ab')
+        except OSError as e:
+            print(f"Error reopening weight log: {e}")
+            self._file = None
+
+
+def create(name, **options):
+    """Moteur de stockage 'name' (voir ENGINES)."""
+    if name == "sqlite":
+        return SQLiteStorage()
+    if name == "memory":
+        return MemoryStorage()
+    if name == "log":
+        return LogStorage(**options)
+    raise ValueError(f"Moteur de stockage inconnu: {name}")
+
+
+# Moteur utilisé par le service (remplacé au démarrage selon 'storage')
+backend = SQLiteStorage()
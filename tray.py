@@ -12,9 +12,10 @@ import ctypes
 import winreg
 import serial
 import serial.tools.list_ports
-import requests
 import traceback
 import socket
+import protocols
+from client import Client, ApiError
 
 # Configuration
 SERVICE_NAME = "OdmService"  
@@ -22,12 +23,20 @@ APP_NAME = "OdmServiceTray"
 COMPANY = "SITC, SAN-PEDRO"
 DESKTOP = socket.gethostname()
 # The API is now local
-API_URL = "http://localhost:5000/api/poids"
+API_URL = "http://localhost:5000"
+# Connexions réutilisées d'un appel à l'autre; l'état du service est
+# interrogé sans nouvelle tentative ni longue attente
+api_client = Client(API_URL, desktop=DESKTOP, company=COMPANY)
+health_client = Client(API_URL, timeout=2, attempts=1, pool_size=1)
 
 # Constantes pour la capture
-FRAME_LENGTH = 11
 CAPTURE_TIMEOUT = 15  # secondes
 
+# Le service s'arrête en moins d'une seconde: son état est interrogé toutes
+# les 50 ms plutôt qu'attendu par pas d'une seconde (RestartService)
+SERVICE_STOP_TIMEOUT = 10  # secondes
+SERVICE_POLL_INTERVAL = 0.05  # secondes
+
 # Chemin des logs
 LOG_DIR = os.path.join(os.getenv('ProgramData'), 'OdmService', 'logs')
 if not os.path.exists(LOG_DIR):
@@ -74,6 +83,35 @@ def get_service_status():
         print(f"Erreur statut service: {e}")
         return win32service.SERVICE_STOPPED
 
+def wait_for_service_status(status, timeout=SERVICE_STOP_TIMEOUT):
+    """Attend que le service atteigne l'état 'status'. Retourne False après 'timeout' secondes."""
+    deadline = time.monotonic() + timeout
+    while get_service_status() != status:
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(SERVICE_POLL_INTERVAL)
+    return True
+
+def get_service_health():
+    """
+    Interroge /api/health: True si le lecteur reçoit des trames, False sinon,
+    None si l'API ne répond pas (service en cours de démarrage, par exemple).
+    """
+    try:
+        return health_client.health()[0]
+    except Exception:
+        return None
+
+def get_tray_state():
+    """Retourne (statut SCM, icône, texte d'état) pour l'icône de notification."""
+    status = get_service_status()
+    if status != win32service.SERVICE_RUNNING:
+        return status, 'red', "Arrêté"
+    if get_service_health() is False:
+        # Le service tourne mais la balance ne transmet plus rien
+        return status, 'red', "En cours d'exécution - balance inactive"
+    return status, 'green', "En cours d'exécution"
+
 def is_user_admin():
     try:
         return ctypes.windll.shell32.IsUserAnAdmin()
@@ -96,7 +134,10 @@ def service_action(action):
         elif action == "stop":
             win32serviceutil.StopService(SERVICE_NAME)
         elif action == "restart":
-            win32serviceutil.RestartService(SERVICE_NAME)
+            win32serviceutil.StopService(SERVICE_NAME)
+            if not wait_for_service_status(win32service.SERVICE_STOPPED):
+                raise RuntimeError("le service ne s'est pas arrêté à temps")
+            win32serviceutil.StartService(SERVICE_NAME)
         return True
     except Exception as e:
         error_msg = f"Erreur action service: {str(e)}"
@@ -132,22 +173,6 @@ def set_autostart(enabled=True):
         print(f"Erreur autostart: {e}")
         return False
 
-def parse_weight_data(frame):
-    """Parse une trame de données de poids"""
-    try:
-        frame_str = frame.decode('ascii')
-        if not ((frame_str.startswith('ww') or frame_str.startswith('wn')) and frame_str.endswith('kg')):
-            return None
-        
-        num_part = frame_str[2:9].replace(' ', '')
-        
-        if '-' in num_part:
-            return -int(num_part.replace('-', '').strip())
-        else:
-            return int(num_part)
-    except (UnicodeDecodeError, ValueError):
-        return None
-
 def capture_single_weight():
     """Capture un seul poids depuis la balance"""
     ser = None
@@ -172,6 +197,7 @@ def capture_single_weight():
                 # Lire les données
                 start_time = time.time()
                 buffer = bytearray()
+                protocol = None
                 #print("Début de la capture...")
                 
                 while time.time() - start_time < CAPTURE_TIMEOUT:
@@ -180,15 +206,19 @@ def capture_single_weight():
                         chunk = ser.read(to_read)
                         buffer.extend(chunk)
                     
-                    # Rechercher une trame valide
-                    for i in range(len(buffer)):
-                        if buffer[i] == ord('w') and len(buffer) - i >= FRAME_LENGTH:
-                            frame_candidate = bytes(buffer[i:i+FRAME_LENGTH])
-                            if frame_candidate.endswith(b'kg') and frame_candidate[1] in [ord('w'), ord('n')]:
-                                weight = parse_weight_data(frame_candidate)
-                                if weight is not None:
-                                    #print(f"Poids capturé: {weight}kg")
-                                    return weight
+                    # Identifier le protocole puis rechercher une trame valide
+                    if protocol is None:
+                        protocol = protocols.detect(buffer)
+                        if protocol is None:
+                            # Ne garder que de quoi compléter une trame en cours
+                            del buffer[:-protocols.max_frame_length()]
+                    if protocol is not None:
+                        readings, consumed = protocol.scan(buffer)
+                        for reading in readings:
+                            if reading.stable is not False:
+                                #print(f"Poids capturé: {reading.weight}kg")
+                                return reading.weight
+                        del buffer[:consumed]
                     
                     time.sleep(0.1)
                 
@@ -209,22 +239,20 @@ def capture_single_weight():
             ser.close()
 
 def send_to_api(weight_kg):
-    """Envoie le poids à l'API"""
+    """
+    Envoie le poids à l'API. Les nouvelles tentatives (erreur réseau, service
+    occupé) réutilisent la même clé d'idempotence: le poids n'est jamais
+    enregistré deux fois.
+    """
     try:
-        response = requests.post(
-            API_URL, 
-            json={
-                "poids": weight_kg,
-                "company": COMPANY,
-                "desktop": DESKTOP
-            }, 
-            timeout=5
-        )
-        print(f"Réponse API: {response.status_code} - {response.text[:50]}")
-        return response.status_code == 200
+        result = api_client.post(weight_kg)
+        print(f"Réponse API: {result.get('message')}{' (déjà enregistré)' if result['replayed'] else ''}")
+        return True
+    except ApiError as e:
+        print(f"Erreur API ({e.status or 'pas de réponse'}): {e}")
     except Exception as e:
         print(f"Erreur API: {str(e)}")
-        return False
+    return False
 
 class ScaleTrayApp:
     def __init__(self):
@@ -263,7 +291,7 @@ class ScaleTrayApp:
             raise Exception("Échec de la création de la fenêtre")
             
         # Initialiser l'icône
-        self.last_status = get_service_status()
+        self.last_status = get_tray_state()
         self.add_tray_icon()
         
         # Démarrer le thread de vérification
@@ -274,9 +302,8 @@ class ScaleTrayApp:
         if not self.hwnd:
             return
             
-        status = get_service_status()
-        icon = ICONS['green' if status == win32service.SERVICE_RUNNING else 'red']
-        status_text = "En cours d'exécution" if status == win32service.SERVICE_RUNNING else "Arrêté"
+        _, icon_name, status_text = get_tray_state()
+        icon = ICONS[icon_name]
         tooltip = f"ODM Capture Poids Service - {status_text}"
         
         # Créer la structure NOTIFYICONDATA
@@ -309,9 +336,8 @@ class ScaleTrayApp:
         if not self.hwnd:
             return
             
-        status = get_service_status()
-        icon = ICONS['green' if status == win32service.SERVICE_RUNNING else 'red']
-        status_text = "En cours d'exécution" if status == win32service.SERVICE_RUNNING else "Arrêté"
+        _, icon_name, status_text = get_tray_state()
+        icon = ICONS[icon_name]
         tooltip = f"ODM Capture Poids Service - {status_text}"
         
         # Créer la structure de mise à jour
@@ -380,7 +406,7 @@ class ScaleTrayApp:
         """Vérifie périodiquement l'état du service"""
         while not self.stop_event.is_set():
             try:
-                current_status = get_service_status()
+                current_status = get_tray_state()
                 if current_status != self.last_status:
                     self.last_status = current_status
                     self.update_tray_icon()
@@ -451,12 +477,8 @@ class ScaleTrayApp:
                     win32api.MessageBox(0, "Impossible d'arrêter le service", "Erreur", win32con.MB_ICONERROR)
                     return
                 
-                # Attendre l'arrêt complet du service (max 5 secondes)
-                for _ in range(10):
-                    if get_service_status() == win32service.SERVICE_STOPPED:
-                        break
-                    time.sleep(0.5)
-                else:
+                # Attendre l'arrêt complet du service
+                if not wait_for_service_status(win32service.SERVICE_STOPPED):
                     win32api.MessageBox(0, "Le service n'a pas pu s'arrêter à temps", "Erreur", win32con.MB_ICONERROR)
                     return
             